@@ -1,39 +1,83 @@
-import streamlit as st
-from openai import AzureOpenAI
+import inspect
+import os
+from reporting import get_reporter
+from metrics import stage, count, record_usage
+from endpoint_pool import EndpointPool, POOL_CONFIG
 
 # Azure OpenAI Configuration
-AZURE_ENDPOINT = "https://momofssd1.openai.azure.com/"  # Your Azure OpenAI endpoint
+AZURE_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT", "https://momofssd1.openai.azure.com/")  # Your Azure OpenAI endpoint
 AZURE_DEPLOYMENT = "gpt-4o"  # Replace with your actual deployment name
 AZURE_API_VERSION = "2024-02-01"
+# Cheaper, lower-latency deployment for simple POs (see routing.py); routing is off when empty
+AZURE_FAST_DEPLOYMENT = os.environ.get("AZURE_OPENAI_FAST_DEPLOYMENT", "")
+# Endpoints/deployments requests are spread and hedged across (see endpoint_pool.py)
+ENDPOINT_POOL = EndpointPool.from_config(POOL_CONFIG)
+
+# Function to create an Azure OpenAI client
+def create_client(openai_api_key, endpoint=None):
+    # openai takes most of a second to import, so it is loaded on the first API call
+    from openai import AzureOpenAI
+    return AzureOpenAI(
+        api_key=openai_api_key,
+        api_version=AZURE_API_VERSION,
+        azure_endpoint=endpoint or AZURE_ENDPOINT
+    )
+
+# Function to create an asyncio Azure OpenAI client (endpoint_pool.py cancels losing hedged requests)
+def create_async_client(openai_api_key, endpoint=None):
+    from openai import AsyncAzureOpenAI
+    return AsyncAzureOpenAI(
+        api_key=openai_api_key,
+        api_version=AZURE_API_VERSION,
+        azure_endpoint=endpoint or AZURE_ENDPOINT
+    )
 
 # Function to validate OpenAI API key
 def validate_api_key(openai_api_key):
     try:
-        client = AzureOpenAI(
-            api_key=openai_api_key,
-            api_version=AZURE_API_VERSION,
-            azure_endpoint=AZURE_ENDPOINT
-        )
+        client = create_client(openai_api_key)
         client.models.list()
         return True, "✅ API Key validated successfully!"
     except Exception as e:
         return False, "❌ Invalid API Key. Please try again."
 
-# Function to call OpenAI API for extraction
-def extract_data_from_text(pdf_text, openai_api_key, prompts):
-    client = AzureOpenAI(
-        api_key=openai_api_key,
-        api_version=AZURE_API_VERSION,
-        azure_endpoint=AZURE_ENDPOINT
-    )
-    try:
-        response = client.chat.completions.create(
-            model=AZURE_DEPLOYMENT,
+# Function to call the chat-completions API and record its usage
+def chat_completion(openai_api_key, prompts, deployment=None):
+    """
+    Returns:
+        tuple: (parsed ChatCompletion, seconds the call took); raises if the call fails
+    """
+    async def send(client, member):
+        # The raw response exposes how many retries the client took
+        raw_response = await client.chat.completions.with_raw_response.create(
+            model=member.deployment,
             messages=prompts,
             temperature=0,
             top_p=0
         )
+        response = raw_response.parse()
+        if inspect.isawaitable(response):
+            response = await response
+        return response, getattr(raw_response, 'retries_taken', 0)
+
+    try:
+        with stage('llm_call'):
+            # The pool picks the endpoint; seconds run from the first send, so client setup is not counted
+            (response, retries), _, seconds = ENDPOINT_POOL.complete(
+                deployment or AZURE_DEPLOYMENT, AZURE_ENDPOINT,
+                lambda member: create_async_client(member.api_key(openai_api_key), member.endpoint), send)
+    except Exception:
+        count('llm_requests')
+        count('llm_errors')
+        raise
+    record_usage(response.usage, retries=retries)
+    return response, seconds
+
+# Function to call OpenAI API for extraction
+def extract_data_from_text(pdf_text, openai_api_key, prompts, reporter=None, deployment=None):
+    try:
+        response, _ = chat_completion(openai_api_key, prompts, deployment)
         return response.choices[0].message.content
     except Exception as e:
-        st.error(f"⚠ Error calling OpenAI API: {e}")
+        get_reporter(reporter).error(f"⚠ Error calling OpenAI API: {e}")
         return None
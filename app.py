@@ -1,8 +1,14 @@
+import time
 import streamlit as st
 from session_state import initialize_session_state
-from ui_components import create_sidebar, display_data_and_downloads
-from processing import process_files
+from ui_components import create_sidebar, display_data_and_downloads, display_job_status, display_metrics_panel
+from jobs import submit_extraction_job, get_job
+from upload_store import touch_uploads
 from api import validate_api_key
+from metrics import record_stages
+
+# Seconds between progress refreshes while a background job is running
+JOB_POLL_SECONDS = 1.5
 
 # Set Streamlit Page Layout
 st.set_page_config(page_title="📄 LLM-Powered Purchase Order Extractor", layout="wide")
@@ -14,11 +20,39 @@ initialize_session_state()
 openai_api_key, process_clicked = create_sidebar(validate_api_key)
 
 # Processing Logic (Only runs when Process is clicked)
-if st.session_state.api_key_valid and st.session_state.uploaded_files_list and st.session_state.processed:
-    # Process the files and store results in session state
-    extracted_data = process_files(st.session_state.uploaded_files_list, openai_api_key)
-    st.session_state.extracted_data = extracted_data
+if st.session_state.api_key_valid and st.session_state.upload_handles and st.session_state.processed:
+    # Submit the spilled files as a background job so reruns and refreshes don't restart the batch
+    handles, expired = touch_uploads(st.session_state.upload_handles)
+    for handle in expired:
+        st.warning(f"⚠ {handle['filename']} expired from the upload store; please upload it again.")
+    st.session_state.upload_handles = handles
+    if handles:
+        files = [(handle['filename'], handle['path']) for handle in handles]
+        st.session_state.job_id = submit_extraction_job(files, openai_api_key,
+                                                        profile=st.session_state.get("profile_next_batch", False),
+                                                        pack=st.session_state.get("pack_small_pos", False))
+        st.session_state.loaded_job_id = None
+        st.query_params["job"] = st.session_state.job_id
+    st.session_state.processed = False
+
+# Poll the background job and load its results once it stops
+job_active = False
+if st.session_state.job_id:
+    job = get_job(st.session_state.job_id)
+    job_active = display_job_status(job, openai_api_key)
+    if job and not job_active and st.session_state.loaded_job_id != job['job_id']:
+        # display_data_and_downloads reads the results of the loaded job from disk
+        st.session_state.loaded_job_id = job['job_id']
+
+# Display data and download options, timing the DataFrame and export stages of this run
+with record_stages() as render_metrics:
+    edited_df = display_data_and_downloads()
+
+# Stage timings and token usage of the current batch
+display_metrics_panel(st.session_state.job_id, render_metrics)
 
-# Display data and download options
-edited_df = display_data_and_downloads() 
+# Keep polling while the job is running
+if job_active:
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
 
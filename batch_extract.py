@@ -0,0 +1,248 @@
+"""
+Headless batch extraction of purchase-order PDFs.
+
+Runs the same pipeline as the Streamlit app (text extraction -> prompts ->
+Azure OpenAI -> JSON parsing -> customer matching) over a directory or glob of
+PDFs with a pool of parallel workers, and writes the enriched records as
+JSONL/CSV plus optional IDoc-XML and ANSI X12 850 files.
+
+Usage:
+    python batch_extract.py incoming/ --workers 8 --output-dir out
+    python batch_extract.py "incoming/2025-03-*.pdf" --idoc --x12
+    python batch_extract.py incoming/ --pack
+"""
+import argparse
+import contextvars
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from processing import process_single_file
+from packing import plan_packs, extract_pack, packing_summary, format_packing_summary
+from endpoint_pool import pool_summary, format_pool_summary
+from data_processing import convert_to_dataframe
+from exports import write_parquet_dataset
+from utils import load_customer_master_data, extract_pages_from_pdf
+from reporting import ConsoleReporter, set_default_reporter
+from metrics import REGISTRY, write_prometheus_file, percentile
+from routing import routing_savings, format_routing_savings
+from followup import repair_summary, format_repair_summary
+
+# Function to expand directories and glob patterns into a sorted list of PDF paths
+def collect_pdf_paths(inputs, recursive=False):
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*.pdf") if recursive else os.path.join(item, "*.pdf")
+            matches = glob.glob(pattern, recursive=recursive)
+            matches += glob.glob(pattern[:-3] + "PDF", recursive=recursive)
+        else:
+            matches = glob.glob(item, recursive=recursive)
+        paths.update(os.path.abspath(path) for path in matches if os.path.isfile(path))
+    return sorted(paths)
+
+# Function to process one PDF path, returning (path, result, seconds)
+def process_path(path, openai_api_key, reporter):
+    started = time.perf_counter()
+    with open(path, 'rb') as pdf_file:
+        result = process_single_file(pdf_file, openai_api_key, reporter, filename=os.path.basename(path))
+    return path, result, time.perf_counter() - started
+
+# Function to read the page texts of one PDF path
+def read_pages(path, reporter):
+    with open(path, 'rb') as pdf_file:
+        return extract_pages_from_pdf(pdf_file, reporter)
+
+# Function to process a packed group of PDF paths, returning (paths, results, seconds)
+def process_pack(paths, pages, openai_api_key, reporter):
+    started = time.perf_counter()
+    results = extract_pack([(os.path.basename(path), path_pages) for path, path_pages in zip(paths, pages)],
+                           openai_api_key, reporter)
+    return paths, results, time.perf_counter() - started
+
+# Function to run the pipeline over many PDFs in parallel
+def run_batch(paths, openai_api_key, workers=4, reporter=None, pack=False):
+    """
+    Args:
+        pack (bool): Send small POs together in packed requests (see packing.py)
+
+    Returns:
+        tuple: (extracted_data in input order, per-file seconds, failed paths)
+    """
+    reporter = reporter or ConsoleReporter()
+    results = {}
+    timings = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each worker runs in a copy of the caller's context, so an enclosing record_stages() block sees its metrics
+        if pack:
+            # Packs are planned from the page texts, so every PDF is parsed first
+            page_futures = [executor.submit(contextvars.copy_context().run, read_pages, path, reporter) for path in paths]
+            readable_paths = []
+            pages = []
+            for path, future in zip(paths, page_futures):
+                try:
+                    path_pages = future.result()
+                except Exception as e:
+                    path_pages = None
+                    reporter.error(f"{os.path.basename(path)}: {e}")
+                if not path_pages:
+                    # Unreadable (extract_pages_from_pdf has reported why) or gone; it is not packed
+                    failed.append(path)
+                    continue
+                readable_paths.append(path)
+                pages.append(path_pages)
+            documents = [(os.path.basename(path), path_pages) for path, path_pages in zip(readable_paths, pages)]
+            futures = {}
+            for group in plan_packs(documents):
+                group_paths = [readable_paths[index] for index in group]
+                future = executor.submit(contextvars.copy_context().run, process_pack, group_paths,
+                                         [pages[index] for index in group], openai_api_key, reporter)
+                futures[future] = group_paths
+        else:
+            futures = {executor.submit(contextvars.copy_context().run, process_path, path, openai_api_key, reporter): [path]
+                       for path in paths}
+        done = len(failed)
+        for future in as_completed(futures):
+            group_paths = futures[future]
+            done += len(group_paths)
+            try:
+                outcome = future.result()
+            except Exception as e:
+                reporter.error(f"{', '.join(os.path.basename(path) for path in group_paths)}: {e}")
+                failed.extend(group_paths)
+                continue
+            # process_path returns one result, process_pack one per path
+            group_results = outcome[1] if pack else [outcome[1]]
+            seconds = outcome[2]
+            for path, result in zip(group_paths, group_results):
+                timings.append(seconds)
+                if result:
+                    results[path] = result
+                else:
+                    failed.append(path)
+            names = ", ".join(os.path.basename(path) for path in group_paths)
+            reporter.progress(done / len(paths), text=f"{done}/{len(paths)} {names} ({seconds:.1f}s)")
+
+    extracted_data = [results[path] for path in paths if path in results]
+    return extracted_data, timings, failed
+
+# Function to write the enriched records and optional SAP files
+def write_outputs(df, output_dir, formats, idoc=False, x12=False):
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    if 'jsonl' in formats:
+        path = os.path.join(output_dir, "Purchase_Order_Data.jsonl")
+        with open(path, 'w') as f:
+            for record in df.to_dict(orient='records'):
+                f.write(json.dumps(record, default=str) + "\n")
+        written.append(path)
+    if 'csv' in formats:
+        path = os.path.join(output_dir, "Purchase_Order_Data.csv")
+        df.to_csv(path, index=False)
+        written.append(path)
+    if 'parquet' in formats:
+        # Appended as new files, so the dataset accumulates across runs
+        path = os.path.join(output_dir, "parquet")
+        write_parquet_dataset(df, path)
+        written.append(path)
+    if idoc or x12:
+        from sap_integration import generate_idoc_xml_data, generate_ansi_x12_850_data
+        if idoc:
+            path = os.path.join(output_dir, "SAP_IDOC_Data.xml")
+            with open(path, 'w') as f:
+                f.write(generate_idoc_xml_data(df))
+            written.append(path)
+        if x12:
+            path = os.path.join(output_dir, "ANSI_X12_850_Data.txt")
+            with open(path, 'w') as f:
+                f.write(generate_ansi_x12_850_data(df))
+            written.append(path)
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract purchase-order data from PDFs without the Streamlit UI")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("--recursive", action="store_true", help="Search directories recursively")
+    parser.add_argument("--workers", type=int, default=4, help="Files processed in parallel")
+    parser.add_argument("--api-key", help="Azure OpenAI API key (default: AZURE_API_KEY environment variable / .env)")
+    parser.add_argument("--output-dir", default="output", help="Directory for the result files")
+    parser.add_argument("--format", default="jsonl,csv", help="Comma-separated record formats: jsonl, csv, parquet")
+    parser.add_argument("--idoc", action="store_true", help="Also write SAP IDoc-XML")
+    parser.add_argument("--x12", action="store_true", help="Also write ANSI X12 850")
+    parser.add_argument("--quiet", action="store_true", help="Do not print per-file progress")
+    parser.add_argument("--metrics-file", help="Write stage timings and token usage here in Prometheus text format")
+    parser.add_argument("--pack", action="store_true", help="Send small POs together in packed requests")
+    args = parser.parse_args()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    openai_api_key = args.api_key or os.environ.get("AZURE_API_KEY")
+    if not openai_api_key:
+        parser.error("No API key: pass --api-key or set AZURE_API_KEY")
+
+    # Route every pipeline message to the console instead of Streamlit
+    reporter = ConsoleReporter(show_progress=not args.quiet)
+    set_default_reporter(reporter)
+
+    paths = collect_pdf_paths(args.inputs, recursive=args.recursive)
+    if not paths:
+        print("No PDF files found", file=sys.stderr)
+        sys.exit(1)
+    print(f"Processing {len(paths)} PDFs with {args.workers} workers...", file=sys.stderr)
+
+    started = time.perf_counter()
+    extracted_data, timings, failed = run_batch(paths, openai_api_key, args.workers, reporter, pack=args.pack)
+    extraction_seconds = time.perf_counter() - started
+
+    customer_master_data = load_customer_master_data(reporter)
+    df = convert_to_dataframe(extracted_data, customer_master_data, reporter)
+    written = []
+    if not df.empty:
+        formats = {fmt.strip().lower() for fmt in args.format.split(',') if fmt.strip()}
+        written = write_outputs(df, args.output_dir, formats, idoc=args.idoc, x12=args.x12)
+    total_seconds = time.perf_counter() - started
+
+    # Throughput summary
+    print("\n===== Batch Summary =====")
+    print(f"Files:        {len(paths)} ({len(extracted_data)} succeeded, {len(failed)} failed)")
+    print(f"Line items:   {len(df)}")
+    print(f"Elapsed:      {total_seconds:.1f}s (extraction {extraction_seconds:.1f}s)")
+    print(f"Throughput:   {len(paths) / extraction_seconds * 60:.1f} files/min")
+    if timings:
+        print(f"Per file:     p50 {percentile(timings, 50):.2f}s  p95 {percentile(timings, 95):.2f}s  max {max(timings):.2f}s")
+    print(f"Tokens:       {REGISTRY.counter('prompt_tokens')} prompt ({REGISTRY.counter('cached_prompt_tokens')} cached), "
+          f"{REGISTRY.counter('completion_tokens')} completion, {REGISTRY.counter('llm_retries')} retries")
+    savings = routing_savings(REGISTRY)
+    if savings:
+        print(f"Routing:      {format_routing_savings(savings)}")
+    packing = packing_summary(REGISTRY)
+    if packing:
+        print(f"Packing:      {format_packing_summary(packing)}")
+    pool = pool_summary(REGISTRY)
+    if pool:
+        print(f"Pool:         {format_pool_summary(pool)}")
+    repairs = repair_summary(REGISTRY)
+    if repairs:
+        print(f"JSON:         {format_repair_summary(repairs)}")
+    for row in REGISTRY.summary_rows():
+        print(f"  {row['Stage']:<15} {row['Calls']:>6} calls  {row['Total (s)']:>9.3f}s  mean {row['Mean (ms)']:>8.1f} ms  {row['Share']:>4}")
+    if args.metrics_file:
+        write_prometheus_file(args.metrics_file)
+        written.append(args.metrics_file)
+    for path in written:
+        print(f"Wrote:        {path}")
+    for path in failed:
+        print(f"Failed:       {path}")
+    print("=========================")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Helpers shared by the bench_*.py scripts: peak memory and baseline files for
+comparing runs. The latency percentile helpers live in metrics.py, which the
+pipeline also uses, and are re-exported here.
+"""
+import json
+import sys
+
+from metrics import percentile, latency_summary
+
+# Function to get the peak resident set size of this process in MB
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+# Function to save a benchmark result as a baseline file
+def save_baseline(path, result):
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=4, sort_keys=True)
+    print(f"Baseline written to {path}")
+
+# Function to compare a result against a baseline file
+def compare_to_baseline(path, result, metrics, max_regression=None):
+    """
+    Print the change of selected metrics relative to a saved baseline.
+
+    Args:
+        path (str): Baseline JSON file written by save_baseline
+        result (dict): Current result
+        metrics (dict): Metric name -> True if higher is better, False if lower is better.
+                        Nested values are addressed with dots, e.g. 'latency.p95_ms'
+        max_regression (float): Allowed relative regression (0.1 = 10%); None to only report
+
+    Returns:
+        bool: False if any metric regressed by more than max_regression
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+
+    def lookup(data, dotted):
+        for key in dotted.split('.'):
+            if not isinstance(data, dict) or key not in data:
+                return None
+            data = data[key]
+        return data
+
+    ok = True
+    print(f"\nComparison with baseline {path}:")
+    for name, higher_is_better in metrics.items():
+        old, new = lookup(baseline, name), lookup(result, name)
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or old == 0:
+            print(f"  {name:<28} baseline={old} current={new}")
+            continue
+        change = (new - old) / abs(old)
+        regression = -change if higher_is_better else change
+        flag = ""
+        if max_regression is not None and regression > max_regression:
+            flag = "  <-- REGRESSION"
+            ok = False
+        print(f"  {name:<28} baseline={old:<12} current={new:<12} change={change:+.1%}{flag}")
+    return ok
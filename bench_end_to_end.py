@@ -0,0 +1,393 @@
+"""
+End-to-end benchmark of the extraction pipeline on a synthetic PO corpus.
+
+Generates purchase-order PDFs (varied line-item and page counts) from
+customer_master_data.json, runs them through the full pipeline (PyPDF2 text
+extraction -> prompts -> chat completions -> JSON parsing -> customer and
+ship-to matching -> DataFrame) against the local mock chat-completions server
+in mock_openai_server.py, and reports files/min, per-file latency
+percentiles, stage timings and peak memory. Every field of the resulting
+DataFrame is checked against the corpus ground truth, so a change that makes
+the pipeline faster but less correct shows up as an accuracy drop.
+
+Usage:
+    python bench_end_to_end.py --files 200 --workers 8 --latency-ms 800 --jitter-ms 200
+    python bench_end_to_end.py --error-rate 0.05 --rate-limit-rate 0.02
+    python bench_end_to_end.py --max-lines 8 --fast-deployment gpt-4o-mini --fast-miss-rate 0.1
+    python bench_end_to_end.py --max-lines 4 --max-extra-pages 0 --pack
+    python bench_end_to_end.py --pool-latency-ms 800,800 --stall-rate 0.05 --stall-ms 5000
+    python bench_end_to_end.py --save-baseline bench_baseline_e2e.json
+    python bench_end_to_end.py --baseline bench_baseline_e2e.json --max-regression 0.2 --min-accuracy 1.0
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import api
+from batch_extract import run_batch
+from data_processing import convert_to_dataframe
+from utils import load_customer_master_data
+from reporting import CollectingReporter, set_default_reporter
+from metrics import REGISTRY
+from routing import routing_savings, format_routing_savings
+from followup import repair_summary, format_repair_summary
+from packing import packing_summary, format_packing_summary
+from endpoint_pool import EndpointPool, pool_summary, format_pool_summary
+from mock_openai_server import MockBehaviour, start_mock_server
+from bench_common import latency_summary, peak_rss_mb, save_baseline, compare_to_baseline
+
+# Metrics compared against a baseline (True = higher is better)
+BASELINE_METRICS = {
+    'throughput.files_per_min': True,
+    'latency.p50_ms': False,
+    'latency.p95_ms': False,
+    'memory.peak_rss_mb': False,
+    'accuracy.field': True,
+    'accuracy.coverage': True,
+}
+
+# Line items that fit on one synthetic PDF page
+LINES_PER_PAGE = 25
+
+# Fields checked against the ground truth: DataFrame column -> ground-truth key
+ACCURACY_FIELDS = {
+    'Customer Number': 'customer_number',
+    'Ship To Number': 'ship_to_number',
+    'Purchase Order Number': 'po_number',
+    'Required Delivery Date': 'delivery_date',
+    'Customer Part Number': 'part_number',
+    'Order Quantity': 'quantity',
+}
+
+_FILLER_TEXT = (
+    "All goods are subject to inspection and acceptance at destination.",
+    "Seller warrants that the goods conform to the specifications of this order.",
+    "Invoices must reference the purchase order number and line item.",
+    "Remit To: PO Box 4471, Accounts Payable Department",
+    "Vendor Ref: see supplier portal for the latest schedule agreements.",
+    "Delivery shall be made during normal receiving hours, Monday to Friday.",
+    "Prices are firm for the duration of this order unless agreed in writing.",
+)
+
+# Function to escape text for a PDF string literal
+def _pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+# Function to build a minimal text-only PDF (one Helvetica text block per page)
+def build_pdf(pages):
+    """
+    Args:
+        pages (list): One list of text lines per page
+
+    Returns:
+        bytes: PDF document PyPDF2 can extract the lines from
+    """
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        content = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        content += [f"({_pdf_text(line)}) Tj T*" for line in lines]
+        content.append("ET")
+        stream = "\n".join(content).encode('latin-1', 'replace')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(output)
+
+# Function to format a quantity the way customers' PO systems print it
+def _format_quantity(rng, quantity):
+    style = rng.random()
+    if style < 0.4:
+        return f"{quantity:,}.{rng.randint(0, 999):03d}"  # 41,976.050
+    if style < 0.7:
+        return f"{quantity:,}"                             # 41,976
+    return str(quantity)                                   # 41976
+
+# Function to generate one synthetic purchase order and its ground truth
+def synthesize_po(index, rng, customers, max_lines, max_extra_pages):
+    cust_num, data = rng.choice(customers)
+    name = (data.get('customer_names') or ["Test Customer"])[0]
+    ship_to = data.get('ship_to') or {"": "1 Test Street, Springfield, USA"}
+    ship_to_num, address = rng.choice(sorted(ship_to.items()))
+    po_number = f"45{rng.randint(0, 99999999):08d}"
+    delivery = datetime.date(2025, 1, 1) + datetime.timedelta(days=rng.randint(0, 364))
+    # Mostly short orders, with a tail of long multi-page ones
+    line_count = 1 if rng.random() < 0.4 else min(max_lines, int(rng.paretovariate(1.2)) + 1)
+
+    items = []
+    for _ in range(line_count):
+        quantity = rng.randint(1, 60000)
+        items.append({'part_number': f"P-{rng.randint(10000, 99999)}", 'quantity': str(quantity),
+                      'printed_quantity': _format_quantity(rng, quantity)})
+
+    header = [
+        "PURCHASE ORDER",
+        f"Customer: {name}",
+        f"PO Number: {po_number}",
+        f"Order Date: {datetime.date(2025, 1, 1):%m/%d/%Y}",
+        f"Required Delivery Date: {delivery:%m/%d/%Y}",
+        f"SHIP TO: {address}",
+        "BILL TO: Accounts Payable, PO Box 991, Wilmington, DE, USA",
+        "",
+        "Item  Material  Order Qty  UOM",
+    ]
+    rows = [f"{(i + 1) * 10}  {item['part_number']}  {item['printed_quantity']}  KG" for i, item in enumerate(items)]
+    pages = []
+    for start in range(0, len(rows), LINES_PER_PAGE):
+        pages.append((header if start == 0 else ["PURCHASE ORDER (continued)", "Item  Material  Order Qty  UOM"])
+                     + rows[start:start + LINES_PER_PAGE])
+    for _ in range(rng.randint(0, max_extra_pages)):
+        pages.append(["TERMS AND CONDITIONS"] + [rng.choice(_FILLER_TEXT) for _ in range(40)])
+    for number, page in enumerate(pages, start=1):
+        page.append(f"Page {number} of {len(pages)}")
+
+    truth = {
+        'filename': f"PO_{index:05d}.pdf",
+        'pages': len(pages),
+        'customer_number': cust_num,
+        'ship_to_number': ship_to_num,
+        'po_number': po_number,
+        'delivery_date': delivery.isoformat(),
+        'lines': [{'part_number': item['part_number'], 'quantity': item['quantity']} for item in items],
+    }
+    return build_pdf(pages), truth
+
+# Function to write the synthetic corpus and its ground truth to a directory
+def generate_corpus(directory, files, customer_master_data, seed=0, max_lines=60, max_extra_pages=3):
+    """
+    Returns:
+        list: Ground truth per file (also written to ground_truth.json)
+    """
+    rng = random.Random(seed)
+    customers = sorted(customer_master_data.items()) or [("CUST001", {})]
+    os.makedirs(directory, exist_ok=True)
+    ground_truth = []
+    for index in range(files):
+        pdf_bytes, truth = synthesize_po(index, rng, customers, max_lines, max_extra_pages)
+        with open(os.path.join(directory, truth['filename']), 'wb') as f:
+            f.write(pdf_bytes)
+        ground_truth.append(truth)
+    with open(os.path.join(directory, "ground_truth.json"), 'w') as f:
+        json.dump(ground_truth, f, indent=2)
+    return ground_truth
+
+# Function to score the pipeline output against the ground truth
+def score_accuracy(df, ground_truth):
+    """
+    Returns:
+        dict: coverage (files with output / files), field accuracy over the files that
+              produced output, per-field accuracy, and files whose output was fully correct
+    """
+    rows_by_file = {}
+    if not df.empty:
+        for record in df.to_dict(orient='records'):
+            rows_by_file.setdefault(record.get('filename'), []).append(record)
+
+    per_field = {column: [0, 0] for column in ACCURACY_FIELDS}
+    exact_files = 0
+    covered = 0
+    for truth in ground_truth:
+        rows = rows_by_file.get(truth['filename'])
+        if not rows:
+            continue
+        covered += 1
+        file_ok = len(rows) == len(truth['lines'])
+        for position, line in enumerate(truth['lines']):
+            row = rows[position] if position < len(rows) else {}
+            expected = {**truth, **line}
+            for column, key in ACCURACY_FIELDS.items():
+                correct = str(row.get(column, '')).strip() == str(expected[key])
+                per_field[column][0] += correct
+                per_field[column][1] += 1
+                file_ok = file_ok and correct
+        exact_files += file_ok
+
+    total_correct = sum(correct for correct, _ in per_field.values())
+    total_checked = sum(checked for _, checked in per_field.values())
+    return {
+        'coverage': round(covered / len(ground_truth), 4) if ground_truth else None,
+        'field': round(total_correct / total_checked, 4) if total_checked else None,
+        'exact_files': exact_files,
+        'per_field': {column: round(correct / checked, 4) if checked else None
+                      for column, (correct, checked) in per_field.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark on a synthetic PO corpus")
+    parser.add_argument("--files", type=int, default=100, help="Synthetic POs to generate")
+    parser.add_argument("--workers", type=int, default=4, help="Files processed in parallel")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus and the mock server")
+    parser.add_argument("--max-lines", type=int, default=60, help="Maximum line items per PO")
+    parser.add_argument("--max-extra-pages", type=int, default=3, help="Maximum terms-and-conditions pages per PO")
+    parser.add_argument("--corpus-dir", help="Keep the corpus here (default: a temporary directory)")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Mock completion latency")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="Standard deviation of the mock latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests failing with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of mock requests failing with HTTP 429")
+    parser.add_argument("--bad-json-rate", type=float, default=0.0, help="Fraction of mock responses with truncated JSON")
+    parser.add_argument("--messy-json-rate", type=float, default=0.0,
+                        help="Fraction of mock responses fenced and with a trailing comma")
+    parser.add_argument("--mock-url", help="Use an already running mock server instead of starting one")
+    parser.add_argument("--fast-deployment", help="Route simple POs to this deployment (see routing.py)")
+    parser.add_argument("--pack", action="store_true", help="Send small POs together in packed requests (see packing.py)")
+    parser.add_argument("--fast-latency-factor", type=float, default=0.4, help="Mock fast-model latency relative to --latency-ms")
+    parser.add_argument("--fast-miss-rate", type=float, default=0.0, help="Fraction of mock fast-model answers missing a field")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of mock requests delayed by an extra --stall-ms")
+    parser.add_argument("--stall-ms", type=float, default=5000.0, help="Extra latency of a stalled mock request")
+    parser.add_argument("--pool-latency-ms",
+                        help="Comma-separated latencies: start one mock per value and spread requests over them "
+                             "as an endpoint pool with hedging (see endpoint_pool.py)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report the tracemalloc peak (slows the run down; latencies are not comparable)")
+    parser.add_argument("--min-accuracy", type=float, help="Exit with status 1 if field accuracy falls below this")
+    parser.add_argument("--baseline", help="Compare the result against this baseline file")
+    parser.add_argument("--save-baseline", help="Write the result as a baseline file")
+    parser.add_argument("--max-regression", type=float, default=0.1,
+                        help="Allowed relative regression against the baseline (default 0.1 = 10%%)")
+    parser.add_argument("--json", action="store_true", help="Print the full result as JSON")
+    args = parser.parse_args()
+
+    customer_master_data = load_customer_master_data()
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix="po_bench_")
+    ground_truth = generate_corpus(corpus_dir, args.files, customer_master_data, args.seed,
+                                   args.max_lines, args.max_extra_pages)
+    paths = [os.path.join(corpus_dir, truth['filename']) for truth in ground_truth]
+    total_pages = sum(truth['pages'] for truth in ground_truth)
+    total_lines = sum(len(truth['lines']) for truth in ground_truth)
+
+    mock_servers = []
+    if args.mock_url:
+        api.AZURE_ENDPOINT = args.mock_url
+    else:
+        pool_latencies = [float(value) for value in args.pool_latency_ms.split(',')] if args.pool_latency_ms else [args.latency_ms]
+        pool_members = []
+        for number, latency_ms in enumerate(pool_latencies, start=1):
+            behaviour = MockBehaviour(latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate,
+                                      args.bad_json_rate, args.seed + number - 1, args.fast_deployment,
+                                      args.fast_latency_factor, args.fast_miss_rate, args.messy_json_rate,
+                                      args.stall_rate, args.stall_ms)
+            mock_server, mock_url = start_mock_server(behaviour)
+            mock_servers.append(mock_server)
+            pool_members.append({'name': f"mock{number}", 'endpoint': mock_url, 'deployment': api.AZURE_DEPLOYMENT})
+        api.AZURE_ENDPOINT = pool_members[0]['endpoint']
+        if args.pool_latency_ms:
+            api.ENDPOINT_POOL = EndpointPool.from_config(pool_members)
+    if args.fast_deployment:
+        api.AZURE_FAST_DEPLOYMENT = args.fast_deployment
+
+    # Errors are expected when failures are injected; count them instead of printing each one
+    reporter = CollectingReporter()
+    set_default_reporter(reporter)
+
+    print(f"End-to-end benchmark: {args.files} POs ({total_pages} pages, {total_lines} line items), "
+          f"{args.workers} workers, mock at {api.AZURE_ENDPOINT}")
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    extracted_data, timings, failed = run_batch(paths, "mock-key", args.workers, reporter, pack=args.pack)
+    df = convert_to_dataframe(extracted_data, customer_master_data, reporter)
+    elapsed = time.perf_counter() - started
+    traced_peak = None
+    if args.trace_memory:
+        traced_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+    for mock_server in mock_servers:
+        mock_server.shutdown()
+
+    result = {
+        'config': {
+            'files': args.files, 'workers': args.workers, 'seed': args.seed,
+            'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'error_rate': args.error_rate,
+            'rate_limit_rate': args.rate_limit_rate, 'bad_json_rate': args.bad_json_rate,
+            'messy_json_rate': args.messy_json_rate,
+            'fast_deployment': args.fast_deployment, 'fast_miss_rate': args.fast_miss_rate, 'pack': args.pack,
+            'stall_rate': args.stall_rate, 'stall_ms': args.stall_ms, 'pool_latency_ms': args.pool_latency_ms,
+            'pages': total_pages, 'line_items': total_lines,
+        },
+        'throughput': {
+            'files_per_min': round(args.files / elapsed * 60, 1),
+            'pages_per_min': round(total_pages / elapsed * 60, 1),
+            'elapsed_s': round(elapsed, 2),
+        },
+        'latency': latency_summary(timings),
+        'memory': {'peak_rss_mb': peak_rss_mb(), 'tracemalloc_peak_mb': traced_peak},
+        'failures': {'files': len(failed), 'errors_reported': len(reporter.errors)},
+        'tokens': {
+            'prompt': REGISTRY.counter('prompt_tokens'),
+            'completion': REGISTRY.counter('completion_tokens'),
+            'retries': REGISTRY.counter('llm_retries'),
+        },
+        'routing': routing_savings(REGISTRY),
+        'json': repair_summary(REGISTRY),
+        'packing': packing_summary(REGISTRY),
+        'pool': pool_summary(REGISTRY),
+        'stages': REGISTRY.summary_rows(),
+        'accuracy': score_accuracy(df, ground_truth),
+    }
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        accuracy = result['accuracy']
+        latency = result['latency']
+        print(f"  Throughput:  {result['throughput']['files_per_min']} files/min "
+              f"({result['throughput']['pages_per_min']} pages/min, {result['throughput']['elapsed_s']} s)")
+        print(f"  Per file:    p50 {latency['p50_ms']} ms  p95 {latency['p95_ms']} ms  max {latency['max_ms']} ms")
+        print(f"  Memory:      peak RSS {result['memory']['peak_rss_mb']} MB"
+              + (f", tracemalloc peak {traced_peak} MB" if traced_peak is not None else ""))
+        print(f"  Failures:    {len(failed)} files, {len(reporter.errors)} errors, "
+              f"{result['tokens']['retries']} client retries")
+        print(f"  Tokens:      {result['tokens']['prompt']} prompt, {result['tokens']['completion']} completion")
+        if result['routing']:
+            print(f"  Routing:     {format_routing_savings(result['routing'])}")
+        if result['packing']:
+            print(f"  Packing:     {format_packing_summary(result['packing'])}")
+        if result['json']:
+            print(f"  JSON:        {format_repair_summary(result['json'])}")
+        if result['pool']:
+            print(f"  Pool:        {format_pool_summary(result['pool'])}")
+        for row in result['stages']:
+            print(f"    {row['Stage']:<15} {row['Calls']:>6} calls  {row['Total (s)']:>9.3f}s  mean {row['Mean (ms)']:>8.1f} ms")
+        print(f"  Accuracy:    {accuracy['field']} of fields correct, {accuracy['exact_files']} files exact, "
+              f"coverage {accuracy['coverage']}")
+        for column, value in accuracy['per_field'].items():
+            print(f"    {column:<24} {value}")
+    if not args.corpus_dir:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    ok = True
+    if args.min_accuracy is not None and (result['accuracy']['field'] or 0) < args.min_accuracy:
+        print(f"Field accuracy {result['accuracy']['field']} is below --min-accuracy {args.min_accuracy}")
+        ok = False
+    if args.save_baseline:
+        save_baseline(args.save_baseline, result)
+    if args.baseline:
+        ok = compare_to_baseline(args.baseline, result, BASELINE_METRICS, args.max_regression) and ok
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
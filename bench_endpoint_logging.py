@@ -0,0 +1,83 @@
+"""
+Benchmark the SAP endpoint stand-in at each logging verbosity.
+
+Starts sap_endpoint in-process on a free port (logs, XML log and IDoc store in a
+temporary directory), posts the same IDoc-XML payload repeatedly and reports
+requests per second for each verbosity level.
+
+Usage:
+    python bench_endpoint_logging.py --requests 200 --idocs 50
+"""
+import argparse
+import http.client
+import os
+import tempfile
+import threading
+import time
+
+import sap_endpoint
+
+IDOC_TEMPLATE = (
+    '  <IDOC BEGIN="DOC{idx:04d}">\n'
+    '    <E1EDK01>\n      <ACTION>0</ACTION>\n      <CURRENCY>USD</CURRENCY>\n    </E1EDK01>\n'
+    '    <E1EDKA1>\n      <PARVW>AG</PARVW>\n      <PARTN>CUST{cust:03d}</PARTN>\n    </E1EDKA1>\n'
+    '    <E1EDK02>\n      <QUALF>001</QUALF>\n      <BELNR>PO{idx:06d}</BELNR>\n      <DATUM>20250319</DATUM>\n    </E1EDK02>\n'
+    '    <E1EDP01>\n      <POSEX>1</POSEX>\n      <MENGE>{qty}</MENGE>\n      <MENEE>KG</MENEE>\n    </E1EDP01>\n'
+    '    <E1EDP19>\n      <QUALF>001</QUALF>\n      <IDTNR>PART{idx:05d}</IDTNR>\n    </E1EDP19>\n'
+    '  </IDOC>\n'
+)
+
+# Function to build an IDoc-XML payload with the given number of IDOCs
+def build_payload(idoc_count):
+    body = ['<?xml version="1.0" encoding="UTF-8"?>\n<ORDERS05>\n']
+    for idx in range(idoc_count):
+        body.append(IDOC_TEMPLATE.format(idx=idx, cust=idx % 50, qty=100 + idx))
+    body.append('</ORDERS05>\n')
+    return ''.join(body).encode('utf-8')
+
+# Function to post the payload repeatedly and return requests per second
+def run_level(verbosity, payload, request_count, workdir):
+    sap_endpoint.XML_FILE = os.path.join(workdir, f"xml_{verbosity}.log")
+    sap_endpoint.IDOC_DB_FILE = os.path.join(workdir, f"idocs_{verbosity}.db")
+    sap_endpoint.setup_logging(verbosity=verbosity, log_file=os.path.join(workdir, f"endpoint_{verbosity}.log"), console=False)
+
+    server = sap_endpoint.create_server(host="127.0.0.1", port=0)
+    port = server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        headers = {'Content-Type': 'application/xml'}
+        start = time.perf_counter()
+        for _ in range(request_count):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            conn.request("POST", "/idoc", body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status != 200:
+                raise RuntimeError(f"Endpoint returned HTTP {response.status}")
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+        sap_endpoint.stop_logging()
+
+    return request_count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests/second of sap_endpoint per logging verbosity")
+    parser.add_argument("--requests", type=int, default=200, help="POSTs per verbosity level")
+    parser.add_argument("--idocs", type=int, default=50, help="IDOCs per POST")
+    parser.add_argument("--levels", default="minimal,summary,full", help="Comma-separated verbosity levels")
+    args = parser.parse_args()
+
+    payload = build_payload(args.idocs)
+    print(f"Payload: {args.idocs} IDOCs, {len(payload)} bytes, {args.requests} requests per level")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for level in args.levels.split(','):
+            rps = run_level(level.strip(), payload, args.requests, workdir)
+            print(f"  {level.strip():<8} {rps:8.1f} req/s  {rps * args.idocs:10.0f} IDOCs/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark the Excel export of large result tables.
+
+Compares the previous in-memory export (DataFrame.to_excel into a BytesIO) with
+the constant-memory streaming export in exports.py. Each mode runs in its own
+subprocess so the reported peak RSS belongs to that mode alone.
+
+Usage:
+    python bench_excel_export.py --rows 100000
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from bench_common import peak_rss_mb
+from exports import export_excel_to_tempfile
+
+# Function to build a result table shaped like convert_to_dataframe output
+def build_dataframe(rows):
+    return pd.DataFrame({
+        'filename': [f"PO_{i // 3:06d}.pdf" for i in range(rows)],
+        'Customer Number': [f"CUST{i % 500:03d}" for i in range(rows)],
+        'Ship To Number': [f"SHIP{i % 1500:04d}" for i in range(rows)],
+        'Customer Name': [f"Customer {i % 500} Manufacturing Co." for i in range(rows)],
+        'Purchase Order Number': [f"45{i:08d}" for i in range(rows)],
+        'Required Delivery Date': [f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in range(rows)],
+        'Customer Part Number': [f"P-{i % 9000 + 1000}" for i in range(rows)],
+        'Order Quantity': [str(100 + i % 40000) for i in range(rows)],
+        'Delivery Address': [f"{i % 999} Industrial Way, Houston, TX, USA" for i in range(rows)],
+    })
+
+# Function to run one export mode in this process and return its measurements
+def run_mode(mode, rows):
+    df = build_dataframe(rows)
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == 'inmemory':
+        output = io.BytesIO()
+        df.to_excel(output, engine='xlsxwriter', index=False, sheet_name='Purchase Orders')
+        size = len(output.getvalue())
+    else:
+        path, _ = export_excel_to_tempfile(df)
+        size = os.path.getsize(path)
+        os.remove(path)
+    elapsed = time.perf_counter() - start
+    return {
+        'mode': mode,
+        'rows': rows,
+        'seconds': round(elapsed, 2),
+        'rows_per_sec': round(rows / elapsed, 1),
+        'size_bytes': size,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_after_dataframe_mb': rss_before,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Rows/s and peak RSS of in-memory vs streaming Excel export")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows in the exported table")
+    parser.add_argument("--modes", default="inmemory,streaming", help="Comma-separated modes to run")
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        # Child process: run a single mode and report JSON on stdout's last line
+        print(json.dumps(run_mode(args.run_mode, args.rows)))
+        return
+
+    print(f"Excel export benchmark: {args.rows} rows")
+    for mode in args.modes.split(','):
+        completed = subprocess.run(
+            [sys.executable, __file__, "--rows", str(args.rows), "--run-mode", mode.strip()],
+            capture_output=True, text=True, check=True
+        )
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(f"  {result['mode']:<10} {result['rows_per_sec']:>10} rows/s  {result['seconds']:>7} s  "
+              f"peak RSS {result['peak_rss_mb']} MB (table alone {result['rss_after_dataframe_mb']} MB)  "
+              f"file {result['size_bytes'] / (1024 * 1024):.1f} MB")
+
+if __name__ == "__main__":
+    main()
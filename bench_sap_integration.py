@@ -0,0 +1,200 @@
+"""
+Load-generation benchmark for the SAP integration path.
+
+Synthesizes purchase-order DataFrames from customer_master_data.json, then runs
+generate_idoc_xml_data + send_idoc_xml_to_sap end to end against sap_endpoint
+(started in-process unless --endpoint-url is given) at the requested concurrency.
+Reports throughput, p50/p95/p99 latency, payload sizes and peak memory, and can
+save or compare against a baseline file.
+
+Usage:
+    python bench_sap_integration.py --rows 100 --requests 200 --concurrency 4
+    python bench_sap_integration.py --save-baseline bench_baseline_sap.json
+    python bench_sap_integration.py --baseline bench_baseline_sap.json --max-regression 0.2
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import sap_endpoint
+from sap_integration import generate_idoc_xml_data, send_idoc_xml_to_sap
+from bench_common import latency_summary, peak_rss_mb, save_baseline, compare_to_baseline
+
+# Metrics compared against a baseline (True = higher is better)
+BASELINE_METRICS = {
+    'throughput.requests_per_sec': True,
+    'throughput.rows_per_sec': True,
+    'latency_total.p50_ms': False,
+    'latency_total.p95_ms': False,
+    'latency_total.p99_ms': False,
+    'latency_generate.p95_ms': False,
+    'memory.peak_rss_mb': False,
+}
+
+# Function to synthesize a purchase-order DataFrame shaped like convert_to_dataframe output
+def synthesize_dataframe(rows, rng, customer_master_data):
+    customers = list(customer_master_data.items()) or [("CUST001", {"customer_names": ["Test Customer"], "ship_to": {"SHIP001": "1 Test St"}})]
+    today = datetime.date.today()
+    records = []
+    for idx in range(rows):
+        cust_num, data = rng.choice(customers)
+        ship_to = data.get('ship_to') or {"": ""}
+        ship_to_num, address = rng.choice(list(ship_to.items()))
+        records.append({
+            'filename': f"PO_{idx // 5:05d}.pdf",
+            'Customer Number': cust_num,
+            'Ship To Number': ship_to_num,
+            'Customer Name': (data.get('customer_names') or [""])[0],
+            'Purchase Order Number': f"45{rng.randint(0, 99999999):08d}",
+            'Required Delivery Date': (today + datetime.timedelta(days=rng.randint(1, 90))).isoformat(),
+            'Customer Part Number': f"P-{rng.randint(10000, 99999)}",
+            'Order Quantity': str(rng.randint(1, 50000)),
+            'Delivery Address': address,
+        })
+    return pd.DataFrame(records)
+
+# Function to generate and send one payload, returning timings and size
+def run_once(df, endpoint_url):
+    start = time.perf_counter()
+    xml_data = generate_idoc_xml_data(df)
+    generated = time.perf_counter()
+    response = send_idoc_xml_to_sap(xml_data, endpoint_url=endpoint_url)
+    sent = time.perf_counter()
+    return {
+        'generate_s': generated - start,
+        'send_s': sent - generated,
+        'total_s': sent - start,
+        'payload_bytes': len(xml_data.encode('utf-8')),
+        'ok': response.get('status') == 'success',
+        'message': response.get('message'),
+    }
+
+# Function to run the full load test and summarize it
+def run_benchmark(rows, request_count, concurrency, endpoint_url, trace_memory=False, distinct_frames=8, seed=42):
+    try:
+        with open('customer_master_data.json') as f:
+            customer_master_data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        customer_master_data = {}
+
+    # Pre-build a small pool of frames so synthesis is not part of the measurement
+    rng = random.Random(seed)
+    frames = [synthesize_dataframe(rows, rng, customer_master_data) for _ in range(min(distinct_frames, request_count))]
+
+    # tracemalloc gives exact Python allocation peaks but slows every allocation,
+    # so it is opt-in; peak RSS is always reported
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda i: run_once(frames[i % len(frames)], endpoint_url), range(request_count)))
+    elapsed = time.perf_counter() - start
+    traced_peak = None
+    if trace_memory:
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    succeeded = [r for r in results if r['ok']]
+    errors = [r['message'] for r in results if not r['ok']]
+    payload_sizes = [r['payload_bytes'] for r in results]
+    return {
+        'config': {'rows': rows, 'requests': request_count, 'concurrency': concurrency, 'endpoint_url': endpoint_url},
+        'throughput': {
+            'elapsed_s': round(elapsed, 3),
+            'requests_per_sec': round(len(succeeded) / elapsed, 2),
+            'rows_per_sec': round(len(succeeded) * rows / elapsed, 1),
+            'mb_per_sec': round(sum(r['payload_bytes'] for r in succeeded) / elapsed / (1024 * 1024), 2),
+        },
+        'latency_total': latency_summary([r['total_s'] for r in succeeded]),
+        'latency_generate': latency_summary([r['generate_s'] for r in results]),
+        'latency_send': latency_summary([r['send_s'] for r in succeeded]),
+        'payload': {
+            'min_bytes': min(payload_sizes),
+            'mean_bytes': round(sum(payload_sizes) / len(payload_sizes)),
+            'max_bytes': max(payload_sizes),
+        },
+        'memory': {
+            'tracemalloc_peak_mb': round(traced_peak / (1024 * 1024), 2) if traced_peak is not None else None,
+            'peak_rss_mb': peak_rss_mb(),
+        },
+        'errors': {'count': len(errors), 'sample': errors[:5]},
+    }
+
+# Function to print a result in a readable layout
+def print_result(result):
+    config = result['config']
+    print(f"\nSAP integration benchmark: {config['requests']} requests x {config['rows']} rows, "
+          f"concurrency {config['concurrency']} -> {config['endpoint_url']}")
+    throughput = result['throughput']
+    print(f"  Throughput : {throughput['requests_per_sec']} req/s, {throughput['rows_per_sec']} rows/s, "
+          f"{throughput['mb_per_sec']} MB/s ({throughput['elapsed_s']} s)")
+    for name in ('latency_total', 'latency_generate', 'latency_send'):
+        lat = result[name]
+        print(f"  {name:<17}: p50={lat['p50_ms']} ms  p95={lat['p95_ms']} ms  p99={lat['p99_ms']} ms  max={lat['max_ms']} ms")
+    payload = result['payload']
+    print(f"  Payload    : min={payload['min_bytes']} B  mean={payload['mean_bytes']} B  max={payload['max_bytes']} B")
+    memory = result['memory']
+    print(f"  Memory     : tracemalloc peak={memory['tracemalloc_peak_mb']} MB  peak RSS={memory['peak_rss_mb']} MB")
+    if result['errors']['count']:
+        print(f"  Errors     : {result['errors']['count']} (e.g. {result['errors']['sample'][0]})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test generate_idoc_xml_data + send_idoc_xml_to_sap")
+    parser.add_argument("--rows", type=int, default=100, help="Rows (IDOCs) per generated DataFrame")
+    parser.add_argument("--requests", type=int, default=200, help="Total generate+send iterations")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel senders")
+    parser.add_argument("--endpoint-url", help="Existing endpoint to target (default: start sap_endpoint in-process)")
+    parser.add_argument("--log-verbosity", default="summary", help="Verbosity of the in-process endpoint")
+    parser.add_argument("--trace-memory", action="store_true", help="Also measure the Python allocation peak with tracemalloc (slower)")
+    parser.add_argument("--baseline", help="Baseline JSON file to compare against")
+    parser.add_argument("--save-baseline", help="Write this run's result to a baseline JSON file")
+    parser.add_argument("--max-regression", type=float, help="Exit non-zero if a metric regresses by more than this fraction")
+    parser.add_argument("--json", action="store_true", help="Print the raw result as JSON")
+    args = parser.parse_args()
+
+    server = None
+    workdir = None
+    endpoint_url = args.endpoint_url
+    if not endpoint_url:
+        # Local endpoint with its logs and store in a throwaway directory
+        workdir = tempfile.TemporaryDirectory()
+        sap_endpoint.XML_FILE = os.path.join(workdir.name, "sap_endpoint_xml.log")
+        sap_endpoint.IDOC_DB_FILE = os.path.join(workdir.name, "sap_endpoint_idocs.db")
+        sap_endpoint.setup_logging(verbosity=args.log_verbosity, log_file=os.path.join(workdir.name, "sap_endpoint.log"), console=False)
+        server = sap_endpoint.create_server(host="127.0.0.1", port=0, threaded=args.concurrency > 1)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        endpoint_url = f"http://127.0.0.1:{server.server_address[1]}/idoc"
+
+    try:
+        result = run_benchmark(args.rows, args.requests, args.concurrency, endpoint_url, trace_memory=args.trace_memory)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            sap_endpoint.stop_logging()
+        if workdir is not None:
+            workdir.cleanup()
+
+    if args.json:
+        print(json.dumps(result, indent=4))
+    else:
+        print_result(result)
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, result)
+    if args.baseline:
+        if not compare_to_baseline(args.baseline, result, BASELINE_METRICS, args.max_regression):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
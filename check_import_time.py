@@ -0,0 +1,123 @@
+"""
+Import-time budget check for the pipeline modules.
+
+Imports each module in a fresh interpreter with ``-X importtime`` and fails if
+its cumulative import time exceeds the budget, or if it pulls in a heavy
+dependency (openai, pandas, PyPDF2, fuzzywuzzy, requests) that the pipeline
+only needs once work actually starts. Those are imported inside the functions
+that use them, so the app's first page load, the CLIs and the worker
+processes start without paying for them. The UI modules necessarily load
+Streamlit (and with it pandas) and get a larger budget instead.
+
+Each module is imported several times and the fastest run is compared, which
+keeps disk-cache noise out of the result.
+
+Usage:
+    python check_import_time.py
+    python check_import_time.py --runs 5 --budget-ms 100 --json
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules checked with the default budget; none may import a heavy dependency
+PIPELINE_MODULES = (
+    'api', 'utils', 'prompts', 'data_processing', 'processing', 'reporting', 'metrics', 'profiling',
+    'routing', 'followup', 'packing', 'endpoint_pool', 'upload_store', 'material_xref', 'exports', 'sap_integration', 'idoc_store', 'jobs', 'batch_extract', 'extraction_service', 'watch_folder',
+)
+# Streamlit modules: (budget in ms, heavy dependencies they may import)
+UI_MODULES = {
+    'session_state': (1000, {'streamlit', 'pandas'}),
+    'ui_components': (1500, {'streamlit', 'pandas'}),
+}
+# Dependencies that must only be imported on first use
+HEAVY_MODULES = ('openai', 'pandas', 'PyPDF2', 'fuzzywuzzy', 'requests', 'streamlit')
+
+DEFAULT_BUDGET_MS = 150
+DEFAULT_RUNS = 3
+
+# Function to import a module in a fresh interpreter and parse the -X importtime output
+def measure_import(module):
+    """
+    Returns:
+        tuple: (cumulative import time of the module in ms, set of all imported module names)
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr.strip().splitlines()[-1]}")
+
+    cumulative_us = None
+    imported = set()
+    for line in completed.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or '|' not in line:
+            continue
+        parts = line.split('|')
+        name = parts[2].strip()
+        if not parts[1].strip().isdigit():
+            continue
+        imported.add(name)
+        if name == module:
+            cumulative_us = int(parts[1])
+    return (cumulative_us or 0) / 1000.0, imported
+
+# Function to check one module against its budget
+def check_module(module, budget_ms, allowed_heavy=(), runs=DEFAULT_RUNS):
+    best_ms = None
+    imported = set()
+    for _ in range(runs):
+        elapsed_ms, imported = measure_import(module)
+        best_ms = elapsed_ms if best_ms is None else min(best_ms, elapsed_ms)
+    heavy = sorted(name for name in HEAVY_MODULES if name in imported and name not in allowed_heavy)
+    return {
+        'module': module,
+        'import_ms': round(best_ms, 1),
+        'budget_ms': budget_ms,
+        'heavy_imports': heavy,
+        'ok': best_ms <= budget_ms and not heavy,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if pipeline modules exceed their import-time budget")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Budget per pipeline module")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Imports per module (the fastest counts)")
+    parser.add_argument("--skip-ui", action="store_true", help="Do not check the Streamlit modules")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    checks = [(module, args.budget_ms, ()) for module in PIPELINE_MODULES]
+    if not args.skip_ui:
+        checks += [(module, budget, allowed) for module, (budget, allowed) in UI_MODULES.items()]
+
+    results = []
+    for module, budget_ms, allowed in checks:
+        try:
+            results.append(check_module(module, budget_ms, allowed, args.runs))
+        except RuntimeError as e:
+            results.append({'module': module, 'import_ms': None, 'budget_ms': budget_ms,
+                            'heavy_imports': [], 'ok': False, 'error': str(e)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"Import-time budget (fastest of {args.runs} runs):")
+        for result in results:
+            status = "ok  " if result['ok'] else "FAIL"
+            line = f"  {status} {result['module']:<20} {result['import_ms'] if result['import_ms'] is not None else '-':>8} ms  (budget {result['budget_ms']:g} ms)"
+            if result['heavy_imports']:
+                line += f"  imports {', '.join(result['heavy_imports'])} eagerly"
+            if result.get('error'):
+                line += f"  {result['error']}"
+            print(line)
+
+    failed = [result['module'] for result in results if not result['ok']]
+    if failed:
+        print(f"\nOver budget: {', '.join(failed)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,78 +1,99 @@
-import pandas as pd
-import streamlit as st
 import json
 import datetime
 import io
+import re
 from utils import load_customer_master_data, find_customer_number, find_ship_to_number
+from material_xref import resolve_materials
+from reporting import get_reporter
+from metrics import stage, count
+from profiling import profile_batch
 
-# Function to convert extracted data to pandas DataFrame
-def convert_to_dataframe(extracted_data):
-    all_records = []
-    
+# Fields the prompts ask for on every line item
+REQUIRED_FIELDS = ('Customer Name', 'Purchase Order Number', 'Required Delivery Date',
+                   'Material Number', 'Order Quantity in kg', 'Delivery Address')
+
+# Function to check an extracted line item against the fields and formats the prompts ask for
+def validate_line_item(line_item):
+    """
+    Returns:
+        dict: field -> problem; empty if the line item is valid
+    """
+    if not isinstance(line_item, dict):
+        return {'line item': "not a JSON object"}
+
+    problems = {}
+    for field in REQUIRED_FIELDS:
+        value = line_item.get(field)
+        if value is None or not str(value).strip():
+            problems[field] = "missing"
+
+    if 'Required Delivery Date' not in problems:
+        try:
+            datetime.date.fromisoformat(str(line_item['Required Delivery Date']).strip())
+        except ValueError:
+            problems['Required Delivery Date'] = "not an ISO date (YYYY-MM-DD)"
+    if 'Order Quantity in kg' not in problems and not str(line_item['Order Quantity in kg']).strip().isdigit():
+        problems['Order Quantity in kg'] = "not a whole number"
+    return problems
+
+# Function to add customer number and ship to number to a single line item
+def enrich_line_item(line_item, filename, customer_master_data, reporter=None):
+    line_item['filename'] = filename
+    # Fix delivery address formatting - replace newlines with spaces
+    if 'Delivery Address' in line_item:
+        line_item['Delivery Address'] = line_item['Delivery Address'].replace('\n', ' ').replace('\r', ' ')
+
+    # Add customer number and ship to number using fuzzy matching
+    if 'Customer Name' in line_item:
+        with stage('customer_match'):
+            customer_number, _ = find_customer_number(line_item['Customer Name'], customer_master_data, reporter)
+            line_item['Customer Number'] = customer_number or ""
+
+            # Find ship to number if customer number and delivery address are available
+            if customer_number and 'Delivery Address' in line_item:
+                ship_to_number = find_ship_to_number(
+                    customer_number,
+                    line_item['Delivery Address'],
+                    customer_master_data
+                )
+                line_item['Ship To Number'] = ship_to_number or ""
+            else:
+                line_item['Ship To Number'] = ""
+    else:
+        line_item['Customer Number'] = ""
+        line_item['Ship To Number'] = ""
+
+    return line_item
+
+# Function to flatten extracted data into enriched line-item records
+def enrich_records(extracted_data, customer_master_data=None, reporter=None):
     # Load customer master data
-    customer_master_data = load_customer_master_data()
-    
+    if customer_master_data is None:
+        customer_master_data = load_customer_master_data(reporter)
+
+    all_records = []
     for item in extracted_data:
         filename = item['filename']
         data = item['data']
-        
+
         # Handle both single PO and multiple line items
-        if isinstance(data, list):
-            # Multiple line items
-            for line_item in data:
-                line_item['filename'] = filename
-                # Fix delivery address formatting - replace newlines with spaces
-                if 'Delivery Address' in line_item:
-                    line_item['Delivery Address'] = line_item['Delivery Address'].replace('\n', ' ').replace('\r', ' ')
-                
-                # Add customer number and ship to number using fuzzy matching
-                if 'Customer Name' in line_item:
-                    customer_number, _ = find_customer_number(line_item['Customer Name'], customer_master_data)
-                    line_item['Customer Number'] = customer_number or ""
-                    
-                    # Find ship to number if customer number and delivery address are available
-                    if customer_number and 'Delivery Address' in line_item:
-                        ship_to_number = find_ship_to_number(
-                            customer_number, 
-                            line_item['Delivery Address'], 
-                            customer_master_data
-                        )
-                        line_item['Ship To Number'] = ship_to_number or ""
-                    else:
-                        line_item['Ship To Number'] = ""
-                else:
-                    line_item['Customer Number'] = ""
-                    line_item['Ship To Number'] = ""
-                
-                all_records.append(line_item)
-        else:
-            # Single PO
-            data['filename'] = filename
-            # Fix delivery address formatting - replace newlines with spaces
-            if 'Delivery Address' in data:
-                data['Delivery Address'] = data['Delivery Address'].replace('\n', ' ').replace('\r', ' ')
-            
-            # Add customer number and ship to number using fuzzy matching
-            if 'Customer Name' in data:
-                customer_number, _ = find_customer_number(data['Customer Name'], customer_master_data)
-                data['Customer Number'] = customer_number or ""
-                
-                # Find ship to number if customer number and delivery address are available
-                if customer_number and 'Delivery Address' in data:
-                    ship_to_number = find_ship_to_number(
-                        customer_number, 
-                        data['Delivery Address'], 
-                        customer_master_data
-                    )
-                    data['Ship To Number'] = ship_to_number or ""
-                else:
-                    data['Ship To Number'] = ""
-            else:
-                data['Customer Number'] = ""
-                data['Ship To Number'] = ""
-            
-            all_records.append(data)
-    
+        line_items = data if isinstance(data, list) else [data]
+        for line_item in line_items:
+            all_records.append(enrich_line_item(line_item, filename, customer_master_data, reporter))
+
+    return all_records
+
+# Function to convert extracted data to pandas DataFrame
+@profile_batch('convert_to_dataframe')
+def convert_to_dataframe(extracted_data, customer_master_data=None, reporter=None, material_xref=None):
+    all_records = enrich_records(extracted_data, customer_master_data, reporter)
+    return build_dataframe(all_records, material_xref)
+
+# Function to build the output DataFrame from enriched line-item records
+@stage('dataframe')
+def build_dataframe(all_records, material_xref=None):
+    import pandas as pd
+
     # Create DataFrame
     if all_records:
         df = pd.DataFrame(all_records)
@@ -83,6 +104,11 @@ def convert_to_dataframe(extracted_data):
             'Order Quantity in kg': 'Order Quantity'
         }
         df = df.rename(columns=column_mapping)
+
+        # Look up the SAP material number of every line item in one pass over the cross-reference
+        if 'Customer Part Number' in df.columns:
+            df.insert(df.columns.get_loc('Customer Part Number') + 1, 'SAP Material Number',
+                      resolve_materials(df['Customer Number'], df['Customer Part Number'], material_xref))
         
         # Reorder columns to put filename first, followed by customer number and ship to number
         priority_cols = ['filename', 'Customer Number', 'Ship To Number']
@@ -103,27 +129,161 @@ def convert_to_dataframe(extracted_data):
 
 # SAP integration functions have been moved to sap_integration.py
 
+# Markdown code fence around the JSON (```json ... ```): the opening line, and a closing fence only at
+# the very end, so ``` inside a JSON string is left alone; text after a closing fence is removed as prose
+_FENCE_OPEN_PATTERN = re.compile(r"```[\w-]*")
+_FENCE_CLOSE_PATTERN = re.compile(r"\s*```\s*\Z")
+
+# Function to scan JSON text outside of strings for trailing commas and truncation points
+def _scan_json(text):
+    """
+    Returns:
+        tuple: (text without trailing commas, brackets still open at the end,
+                whether the text ends inside a string, [(cut position, open brackets)]
+                where a prefix ends after a complete value)
+    """
+    out = []
+    stack = []
+    cuts = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char in ']}':
+            # Drop a comma that directly precedes the closing bracket
+            end = len(out)
+            while end and out[end - 1].isspace():
+                end -= 1
+            if end and out[end - 1] == ',':
+                del out[end - 1:]
+            if stack:
+                stack.pop()
+            out.append(char)
+            cuts.append((len(out), tuple(stack)))
+            continue
+        if char == ',':
+            cuts.append((len(out), tuple(stack)))
+        out.append(char)
+        if char == '"':
+            in_string = True
+        elif char in '[{':
+            stack.append(char)
+            # An empty nested value is no use; an empty top-level one still parses
+            if len(stack) == 1:
+                cuts.append((len(out), tuple(stack)))
+    return "".join(out), stack, in_string, cuts
+
+# Function to parse a model response as JSON, repairing common defects
+def repair_json(text):
+    """
+    Repairs a code fence, text around the JSON, trailing commas and a response
+    cut off mid-way (the incomplete last value is dropped, open arrays and
+    objects are closed).
+
+    Returns:
+        tuple: (parsed JSON, list of repairs applied: 'fence', 'prose',
+                'trailing_comma', 'truncated'); raises json.JSONDecodeError if
+                the text cannot be repaired
+    """
+    repairs = []
+    candidate = text.strip()
+    starts = [index for index in (candidate.find('{'), candidate.find('[')) if index >= 0]
+    fence = _FENCE_OPEN_PATTERN.search(candidate)
+    if fence and (not starts or fence.start() < min(starts)):
+        candidate = _FENCE_CLOSE_PATTERN.sub("", candidate[fence.end():]).strip()
+        repairs.append('fence')
+        starts = [index for index in (candidate.find('{'), candidate.find('[')) if index >= 0]
+    if starts and min(starts) > 0:
+        candidate = candidate[min(starts):]
+        repairs.append('prose')
+    try:
+        return json.loads(candidate), repairs
+    except json.JSONDecodeError as e:
+        error = e
+
+    # Text after a complete JSON value
+    try:
+        value, _ = json.JSONDecoder().raw_decode(candidate)
+        if 'prose' not in repairs:
+            repairs.append('prose')
+        return value, repairs
+    except json.JSONDecodeError:
+        pass
+
+    cleaned, stack, in_string, cuts = _scan_json(candidate)
+    if cleaned != candidate:
+        repairs.append('trailing_comma')
+        try:
+            return json.loads(cleaned), repairs
+        except json.JSONDecodeError as e:
+            error = e
+    if not stack and not in_string:
+        raise error
+
+    # Cut off: keep the longest prefix that ends after a complete value and close it
+    closers = {'[': ']', '{': '}'}
+    for position, open_brackets in reversed(cuts):
+        try:
+            value = json.loads(cleaned[:position] + "".join(closers[bracket] for bracket in reversed(open_brackets)))
+        except json.JSONDecodeError:
+            continue
+        return value, repairs + ['truncated']
+    raise error
+
+# Function to put each delivery address of extracted data on a single line
+def clean_delivery_addresses(extract_contents_json):
+    line_items = extract_contents_json if isinstance(extract_contents_json, list) else [extract_contents_json]
+    for item in line_items:
+        if isinstance(item, dict) and isinstance(item.get('Delivery Address'), str):
+            item['Delivery Address'] = item['Delivery Address'].replace('\n', ' ').replace('\r', ' ')
+    return extract_contents_json
+
 # Function to clean and parse JSON response from OpenAI
-def process_api_response(extract_contents, pdf_file_name):
-    import json
-    
+def process_api_response(extract_contents, pdf_file_name, reporter=None):
+    """
+    Returns:
+        dict or None: {"filename": ..., "data": line item or list of line items}. "truncated" is
+                      set when the response was cut off, so followup.py can ask for the lost lines.
+                      None if the response is not a line item or a list of line items.
+    """
     try:
-        # Clean and validate JSON before parsing
-        extract_contents = extract_contents.strip().strip("```json").strip("```")
-        extract_contents_json = json.loads(extract_contents)
-        
-        # Process and fix any potential address formatting issues in the JSON
-        if isinstance(extract_contents_json, list):
-            for item in extract_contents_json:
-                if 'Delivery Address' in item:
-                    item['Delivery Address'] = item['Delivery Address'].replace('\n', ' ').replace('\r', ' ')
-        elif isinstance(extract_contents_json, dict):
-            if 'Delivery Address' in extract_contents_json:
-                extract_contents_json['Delivery Address'] = extract_contents_json['Delivery Address'].replace('\n', ' ').replace('\r', ' ')
-        
-        return {"filename": pdf_file_name, "data": extract_contents_json}
+        with stage('json_parse'):
+            # Clean and validate JSON before parsing, repairing what the model got wrong
+            extract_contents_json, repairs = repair_json(extract_contents)
     except json.JSONDecodeError:
-        st.error(f"⚠ OpenAI returned invalid JSON for {pdf_file_name}")
-        st.text("Raw API Response:")
-        st.code(extract_contents, language="json")  # Show the invalid response for debugging
-        return None
+        return _reject_response(extract_contents, pdf_file_name, "invalid JSON", reporter)
+    # Anything else (a string, null, a list of strings) cannot be enriched or followed up
+    if not is_line_item_data(extract_contents_json):
+        return _reject_response(extract_contents, pdf_file_name, "JSON that is not a line item or a list of line items", reporter)
+    if 'truncated' in repairs and not extract_contents_json:
+        return _reject_response(extract_contents, pdf_file_name, "a response cut off before its first complete line item", reporter)
+    count('json_responses', label='repaired' if repairs else 'clean')
+    for repair in repairs:
+        count('json_repairs', label=repair)
+
+    # Process and fix any potential address formatting issues in the JSON
+    clean_delivery_addresses(extract_contents_json)
+
+    result = {"filename": pdf_file_name, "data": extract_contents_json}
+    if 'truncated' in repairs:
+        result['truncated'] = True
+    return result
+
+# Function to check that parsed JSON is a line item or a list of line items
+def is_line_item_data(data):
+    return isinstance(data, dict) or (isinstance(data, list) and all(isinstance(item, dict) for item in data))
+
+def _reject_response(extract_contents, pdf_file_name, problem, reporter):
+    count('json_responses', label='failed')
+    reporter = get_reporter(reporter)
+    reporter.error(f"⚠ OpenAI returned {problem} for {pdf_file_name}")
+    reporter.info("Raw API Response:")
+    reporter.code(extract_contents, language="json")  # Show the invalid response for debugging
+    return None
@@ -0,0 +1,320 @@
+"""
+Pool of Azure OpenAI endpoints and deployments with hedged requests.
+
+Every chat completion used to go to the single AZURE_ENDPOINT, so one slow or
+throttled region held up the whole batch. AZURE_OPENAI_POOL lists several
+endpoints/deployments as JSON:
+
+    [{"name": "eastus", "endpoint": "https://eastus.openai.azure.com/", "deployment": "gpt-4o"},
+     {"name": "swedencentral", "endpoint": "https://sweden.openai.azure.com/", "deployment": "gpt-4o-se",
+      "model": "gpt-4o", "api_key_env": "AZURE_API_KEY_SWEDEN"}]
+
+"model" is the deployment name the pipeline asks for (api.AZURE_DEPLOYMENT or
+the fast deployment, default: the member's own deployment), so regions may
+name their deployments differently. "api_key_env" names the environment
+variable holding that resource's key; without it the key entered in the app
+is used. A model no member serves goes to AZURE_ENDPOINT as before.
+
+Each request goes to the least-loaded healthy member: fewest requests in
+flight, then lowest median latency. After FAILURE_THRESHOLD consecutive
+failures a member cools down for COOLDOWN_SECONDS and is only used if every
+member is cooling down.
+
+When the chosen member has not answered within HEDGE_PERCENTILE of its recent
+latencies, the same request is sent to a second member. The first answer wins
+and the other request is cancelled, which closes its connection. Hedges are
+limited to HEDGE_MAX_RATE of requests so a slow pool is not doubled in load. A
+request that fails is re-sent to another member at once.
+
+``pool_summary`` reports requests and failures per member, hedges and which
+side won them, from the pool_* and hedged_requests counters.
+"""
+import asyncio
+import collections
+import json
+import os
+import threading
+import time
+
+from metrics import count, percentile
+
+# Pool configuration (JSON list of members); empty means AZURE_ENDPOINT only
+POOL_CONFIG = os.environ.get("AZURE_OPENAI_POOL", "")
+# Hedge when a request takes longer than this percentile of the member's recent latencies
+HEDGE_PERCENTILE = float(os.environ.get("PO_POOL_HEDGE_PERCENTILE", 95))
+# Latencies needed before the percentile is trusted, and the hedge delay used until then
+HEDGE_MIN_SAMPLES = int(os.environ.get("PO_POOL_HEDGE_MIN_SAMPLES", 20))
+HEDGE_DEFAULT_SECONDS = float(os.environ.get("PO_POOL_HEDGE_DEFAULT_SECONDS", 30))
+# Most hedges allowed, as a fraction of requests
+HEDGE_MAX_RATE = float(os.environ.get("PO_POOL_HEDGE_MAX_RATE", 0.1))
+# Consecutive failures that take a member out of rotation, and for how long
+FAILURE_THRESHOLD = int(os.environ.get("PO_POOL_FAILURE_THRESHOLD", 3))
+COOLDOWN_SECONDS = float(os.environ.get("PO_POOL_COOLDOWN_SECONDS", 30))
+# Recent latencies kept per member
+LATENCY_WINDOW = 200
+
+class PoolMember:
+    """One endpoint/deployment and its health."""
+
+    def __init__(self, name, endpoint, deployment, model=None, api_key_env=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.model = model or deployment
+        self.api_key_env = api_key_env
+        # Health, updated by EndpointPool under its lock
+        self.in_flight = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def api_key(self, default_key):
+        return os.environ.get(self.api_key_env, default_key) if self.api_key_env else default_key
+
+    def healthy(self, now):
+        return now >= self.cooldown_until
+
+    def median_latency(self):
+        return percentile(self.latencies, 50) or 0.0
+
+    def hedge_delay(self):
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_SECONDS
+        return percentile(self.latencies, HEDGE_PERCENTILE)
+
+class EndpointPool:
+    """Least-loaded selection, health tracking and hedging across pool members."""
+
+    def __init__(self, members=()):
+        self.members = list(members)
+        names = [member.name for member in self.members]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Pool member names must be unique: {names}")
+        self._lock = threading.Lock()
+        # Members created for models no configured member serves, keyed by (endpoint, deployment)
+        self._fallback_members = {}
+        self.requests = 0
+        self.hedges = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Args:
+            config (str or list): AZURE_OPENAI_POOL JSON, or the parsed list of member dicts
+
+        Raises:
+            ValueError: If a member lacks an endpoint or deployment
+        """
+        if isinstance(config, str):
+            config = json.loads(config) if config.strip() else []
+        members = []
+        for index, entry in enumerate(config):
+            if not entry.get('endpoint') or not entry.get('deployment'):
+                raise ValueError(f"Pool member {index} needs an endpoint and a deployment: {entry}")
+            members.append(PoolMember(entry.get('name') or f"member{index + 1}", entry['endpoint'], entry['deployment'],
+                                      entry.get('model'), entry.get('api_key_env')))
+        return cls(members)
+
+    def members_for(self, model, default_endpoint):
+        members = [member for member in self.members if member.model == model]
+        if members:
+            return members
+        with self._lock:
+            key = (default_endpoint, model)
+            if key not in self._fallback_members:
+                self._fallback_members[key] = PoolMember("default", default_endpoint, model)
+            return [self._fallback_members[key]]
+
+    def _select(self, members, exclude=(), healthy_only=False):
+        # Least-loaded healthy member; if all are cooling down, the one that recovers first
+        with self._lock:
+            now = time.monotonic()
+            candidates = [member for member in members if member not in exclude]
+            healthy = [member for member in candidates if member.healthy(now)]
+            if healthy:
+                chosen = min(healthy, key=lambda member: (member.in_flight, member.median_latency()))
+            elif candidates and not healthy_only:
+                chosen = min(candidates, key=lambda member: member.cooldown_until)
+            else:
+                return None
+            chosen.in_flight += 1
+            return chosen
+
+    def _finish(self, member, seconds, failed=False, cancelled=False):
+        with self._lock:
+            member.in_flight -= 1
+            if cancelled:
+                # A cancelled request says only that it took at least this long: the losing hedge is cut
+                # short and would drag the percentile down, while a stalled primary outlasts it
+                if member.latencies and seconds > percentile(member.latencies, HEDGE_PERCENTILE):
+                    member.latencies.append(seconds)
+                return
+            if not failed:
+                member.latencies.append(seconds)
+            if failed:
+                member.consecutive_failures += 1
+                if member.consecutive_failures >= FAILURE_THRESHOLD:
+                    member.cooldown_until = time.monotonic() + COOLDOWN_SECONDS
+            else:
+                member.consecutive_failures = 0
+                member.cooldown_until = 0.0
+        count('pool_requests', label=member.name)
+        if failed:
+            count('pool_failures', label=member.name)
+
+    def _may_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > HEDGE_MAX_RATE * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def complete(self, model, default_endpoint, client_factory, send):
+        """
+        Send one request to the pool, hedging or failing over to a second member when needed.
+
+        The attempts run as asyncio tasks in the calling thread, so cancelling the
+        losing one closes its connection and the endpoint stops working on it.
+
+        Args:
+            model (str): Deployment name the pipeline asks for
+            default_endpoint (str): Endpoint for a model no member serves (api.AZURE_ENDPOINT)
+            client_factory (callable): member -> async client with an async close()
+            send (callable): async (client, member) -> response
+
+        Returns:
+            tuple: (response, member that answered, seconds from the first send to the answer)
+
+        Raises:
+            Exception: The last error if every attempt failed
+        """
+        return asyncio.run(self._complete(self.members_for(model, default_endpoint), client_factory, send))
+
+    async def _attempt(self, member, client, send):
+        started = time.perf_counter()
+        try:
+            response = await send(client, member)
+        except asyncio.CancelledError:
+            self._finish(member, time.perf_counter() - started, cancelled=True)
+            count('cancelled_requests', label=member.name)
+            raise
+        except Exception:
+            self._finish(member, time.perf_counter() - started, failed=True)
+            raise
+        finally:
+            await client.close()
+        self._finish(member, time.perf_counter() - started)
+        return response
+
+    async def _complete(self, members, client_factory, send):
+        with self._lock:
+            self.requests += 1
+        tried = []
+        # task -> member
+        attempts = {}
+
+        def launch(member):
+            tried.append(member)
+            try:
+                client = client_factory(member)
+            except Exception as e:
+                self._finish(member, 0.0, failed=True)
+                task = asyncio.get_running_loop().create_future()
+                task.set_exception(e)
+            else:
+                task = asyncio.ensure_future(self._attempt(member, client, send))
+            attempts[task] = member
+            return task
+
+        primary = self._select(members)
+        pending = {launch(primary)}
+        first_task = next(iter(pending))
+        started = time.perf_counter()
+        with self._lock:
+            deadline = time.monotonic() + primary.hedge_delay()
+        second_sent = hedged = hedge_skipped = False
+        last_error = None
+        while pending:
+            timeout = None if second_sent or hedge_skipped else max(0.0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    # First answer wins; cancel the other request
+                    for other in pending:
+                        other.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    if hedged:
+                        count('hedged_requests', label='primary' if task is first_task else 'hedge')
+                    return task.result(), attempts[task], time.perf_counter() - started
+                last_error = task.exception()
+            if second_sent:
+                continue
+            if done:
+                # Failed: re-send to another member right away
+                secondary = self._select(members, exclude=tried)
+                second_sent = True
+                if secondary is not None:
+                    count('pool_failovers')
+                    pending.add(launch(secondary))
+            elif not hedge_skipped:
+                # Slower than the member's latency percentile: hedge on another member
+                secondary = None
+                if len(members) > 1 and self._may_hedge():
+                    secondary = self._select(members, exclude=tried, healthy_only=True)
+                if secondary is not None:
+                    second_sent = hedged = True
+                    pending.add(launch(secondary))
+                else:
+                    hedge_skipped = True
+        if hedged:
+            count('hedged_requests', label='none')
+        raise last_error
+
+    def status(self):
+        """
+        Returns:
+            list: One dict per member: name, endpoint, deployment, model, in_flight,
+                  healthy, p50/p95 latency (seconds) and consecutive failures
+        """
+        with self._lock:
+            now = time.monotonic()
+            return [{
+                'name': member.name,
+                'endpoint': member.endpoint,
+                'deployment': member.deployment,
+                'model': member.model,
+                'in_flight': member.in_flight,
+                'healthy': member.healthy(now),
+                'p50_s': percentile(member.latencies, 50),
+                'p95_s': percentile(member.latencies, 95),
+                'consecutive_failures': member.consecutive_failures,
+            } for member in self.members + list(self._fallback_members.values())]
+
+# Function to summarize the pool counters of a StageMetrics
+def pool_summary(metrics):
+    """
+    Returns:
+        dict or None: Requests and failures per member, failovers, hedges by winner
+                      and cancelled requests; None if fewer than two members answered
+    """
+    requests = {label: value for name, label, value in metrics.to_dict()['counters'] if name == 'pool_requests'}
+    if len(requests) < 2:
+        return None
+    hedges = {winner: metrics.counter('hedged_requests', winner) for winner in ('primary', 'hedge', 'none')}
+    return {
+        'requests': requests,
+        'failures': {member: metrics.counter('pool_failures', member) for member in requests},
+        'failovers': metrics.counter('pool_failovers'),
+        'hedges': sum(hedges.values()),
+        'hedges_won': hedges['hedge'],
+        'hedges_lost': hedges['primary'],
+        'cancelled': metrics.counter('cancelled_requests'),
+    }
+
+# Function to format pool_summary() as one line
+def format_pool_summary(summary):
+    members = ", ".join(f"{member} {value} ({summary['failures'][member]} failed)"
+                        for member, value in summary['requests'].items())
+    return (f"{members}; {summary['failovers']} failovers; {summary['hedges']} hedges "
+            f"({summary['hedges_won']} won by the hedge, {summary['hedges_lost']} by the first request), "
+            f"{summary['cancelled']} cancelled")
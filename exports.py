@@ -0,0 +1,251 @@
+import datetime
+import math
+import os
+import tempfile
+import time
+import uuid
+
+from metrics import stage
+
+# Maximum number of data rows on one Excel worksheet (header row excluded)
+EXCEL_MAX_ROWS = 1048575
+
+# Parquet dataset the app appends to (batch paths write under their output directory)
+PARQUET_DATASET_DIR = os.environ.get("PO_PARQUET_DIR", os.path.join("output", "parquet"))
+# DataFrame column -> Parquet column and Arrow type name; other columns are not exported
+PARQUET_COLUMNS = {
+    'filename': ('filename', 'string'),
+    'Customer Number': ('customer_number', 'string'),
+    'Ship To Number': ('ship_to_number', 'string'),
+    'Customer Name': ('customer_name', 'string'),
+    'Purchase Order Number': ('purchase_order_number', 'string'),
+    'Required Delivery Date': ('required_delivery_date', 'date32'),
+    'Customer Part Number': ('customer_part_number', 'string'),
+    'SAP Material Number': ('sap_material_number', 'string'),
+    'Order Quantity': ('order_quantity', 'int64'),
+    'Delivery Address': ('delivery_address', 'string'),
+}
+# Hive-style partition directories: extracted_date=YYYY-MM-DD/customer_number=...
+PARQUET_PARTITION_COLUMNS = ('extracted_date', 'customer_number')
+
+# Function to convert a DataFrame value into something the Excel writers accept
+def _excel_cell(value):
+    if value is None:
+        return None
+    # numpy / pandas scalars -> native Python values
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        try:
+            value = value.item()
+        except (ValueError, AttributeError):
+            pass
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    # pandas NaT (not equal to itself) and NA (raises when used as a bool)
+    try:
+        if value != value:
+            return None
+    except TypeError:
+        return None
+    if hasattr(value, 'to_pydatetime'):
+        value = value.to_pydatetime()
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        value = value.replace(tzinfo=None)
+    if isinstance(value, (int, float, str, bool, datetime.date, datetime.datetime)):
+        return value
+    return str(value)
+
+# Function to stream a DataFrame into an .xlsx file row by row
+@stage('excel_export')
+def write_excel_streaming(df, path, sheet_name='Purchase Orders'):
+    """
+    Write a DataFrame to an Excel file without building the workbook in memory.
+
+    xlsxwriter's constant_memory mode flushes every row to disk as soon as it is
+    written; openpyxl's write-only mode is used as a fallback.
+
+    Args:
+        df (pandas.DataFrame): Data to export
+        path (str): Destination .xlsx path
+        sheet_name (str): Worksheet name
+
+    Returns:
+        int: Number of data rows written
+
+    Raises:
+        ValueError: If the DataFrame does not fit on one worksheet
+        ImportError: If neither xlsxwriter nor openpyxl is installed
+    """
+    if len(df) > EXCEL_MAX_ROWS:
+        raise ValueError(f"{len(df)} rows exceed the Excel limit of {EXCEL_MAX_ROWS} rows per sheet")
+
+    header = [str(col) for col in df.columns]
+    rows = df.itertuples(index=False, name=None)
+    row_count = 0
+
+    try:
+        import xlsxwriter
+
+        workbook = xlsxwriter.Workbook(path, {
+            'constant_memory': True,
+            'strings_to_urls': False,  # Addresses/URLs stay plain text
+            'default_date_format': 'yyyy-mm-dd',
+        })
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, header, workbook.add_format({'bold': True}))
+        for row_count, row in enumerate(rows, start=1):
+            worksheet.write_row(row_count, 0, [_excel_cell(value) for value in row])
+        workbook.close()
+    except ImportError:
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet(sheet_name)
+        worksheet.append(header)
+        for row_count, row in enumerate(rows, start=1):
+            worksheet.append([_excel_cell(value) for value in row])
+        workbook.save(path)
+
+    return row_count
+
+# Function to export a DataFrame to a temporary Excel file
+def export_excel_to_tempfile(df, sheet_name='Purchase Orders'):
+    """
+    Stream a DataFrame into a new temporary .xlsx file.
+
+    Returns:
+        tuple: (path, stats) where stats has rows, seconds, rows_per_sec and size_bytes.
+               The caller is responsible for deleting the file.
+    """
+    fd, path = tempfile.mkstemp(prefix="po_export_", suffix=".xlsx")
+    os.close(fd)
+    start = time.perf_counter()
+    try:
+        rows = write_excel_streaming(df, path, sheet_name=sheet_name)
+    except Exception:
+        os.remove(path)
+        raise
+    elapsed = time.perf_counter() - start
+    stats = {
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed > 0 else None,
+        'size_bytes': os.path.getsize(path),
+    }
+    print(f"Excel export: {rows} rows in {stats['seconds']}s ({stats['rows_per_sec']} rows/s, {stats['size_bytes']} bytes)")
+    return path, stats
+
+# Function to convert a DataFrame value into a Parquet string column value
+def _parquet_text(value):
+    value = _excel_cell(value)
+    if value is None:
+        return None
+    # Empty strings are stored as nulls so missing values look the same whatever produced them
+    return str(value).strip() or None
+
+# Function to convert a numeric quantity into a Parquet int64 value
+def _parquet_quantity(value):
+    # NaN, inf, fractions and numbers beyond the int64 range become nulls
+    if not math.isfinite(value) or value != int(value):
+        return None
+    value = int(value)
+    return value if -2 ** 63 <= value < 2 ** 63 else None
+
+# Function to get the Arrow schema of the Parquet export
+def parquet_schema():
+    import pyarrow as pa
+    types = {'string': pa.string(), 'date32': pa.date32(), 'int64': pa.int64()}
+    return pa.schema(
+        [(name, types[type_name]) for name, type_name in PARQUET_COLUMNS.values()]
+        + [('extracted_at', pa.timestamp('s')), ('extracted_date', pa.date32())]
+    )
+
+# Function to convert the output DataFrame into a typed Arrow table
+def to_arrow_table(df, extracted_at=None):
+    """
+    Args:
+        df (pandas.DataFrame): Output of convert_to_dataframe (possibly edited)
+        extracted_at (datetime.datetime): Extraction time stored with every row (default: now)
+
+    Returns:
+        pyarrow.Table: One column per PARQUET_COLUMNS entry plus extracted_at and
+                       extracted_date; quantities that are not whole numbers within
+                       the int64 range and dates that are not ISO become nulls
+
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    extracted_at = (extracted_at or datetime.datetime.now()).replace(microsecond=0)
+    columns = {}
+    for source, (name, type_name) in PARQUET_COLUMNS.items():
+        if source not in df.columns:
+            columns[name] = [None] * len(df)
+        elif type_name == 'int64':
+            quantities = pd.to_numeric(df[source], errors='coerce')
+            columns[name] = [_parquet_quantity(value) for value in quantities]
+        elif type_name == 'date32':
+            dates = pd.to_datetime(df[source], format='%Y-%m-%d', errors='coerce')
+            columns[name] = [None if pd.isna(value) else value.date() for value in dates]
+        else:
+            columns[name] = [_parquet_text(value) for value in df[source]]
+    columns['extracted_at'] = [extracted_at] * len(df)
+    columns['extracted_date'] = [extracted_at.date()] * len(df)
+    return pa.Table.from_pydict(columns, schema=parquet_schema())
+
+# Function to append the output DataFrame to a partitioned Parquet dataset
+@stage('parquet_export')
+def write_parquet_dataset(df, root_dir=None, extracted_at=None):
+    """
+    Append rows to a Parquet dataset partitioned by extraction date and customer number.
+
+    Every call writes new files with a unique name, so repeated batches only add
+    files and readers of the dataset (pyarrow.dataset, DuckDB, Spark) see the
+    union. Partitions use the Hive layout, e.g.
+    ``extracted_date=2024-05-01/customer_number=CUST001/part-<id>-0.parquet``.
+
+    Args:
+        df (pandas.DataFrame): Output of convert_to_dataframe
+        root_dir (str): Dataset directory (default: PARQUET_DATASET_DIR)
+
+    Returns:
+        list: Paths of the Parquet files written
+
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    root_dir = root_dir or PARQUET_DATASET_DIR
+    table = to_arrow_table(df, extracted_at)
+    if table.num_rows == 0:
+        return []
+    written = []
+    partitioning = ds.partitioning(pa.schema([table.schema.field(name) for name in PARQUET_PARTITION_COLUMNS]), flavor='hive')
+    ds.write_dataset(
+        table, root_dir, format='parquet', partitioning=partitioning,
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        file_visitor=lambda written_file: written.append(written_file.path),
+    )
+    print(f"Parquet export: {table.num_rows} rows in {len(written)} files under {root_dir}")
+    return written
+
+# Function to export the output DataFrame as a single Parquet file in memory
+@stage('parquet_export')
+def export_parquet_bytes(df, extracted_at=None):
+    """
+    Returns:
+        bytes: Parquet file with the same typed columns as the dataset (not partitioned)
+
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = pa.BufferOutputStream()
+    pq.write_table(to_arrow_table(df, extracted_at), sink)
+    return sink.getvalue().to_pybytes()
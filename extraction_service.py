@@ -0,0 +1,395 @@
+"""
+Local HTTP service for programmatic purchase-order extraction.
+
+PDFs posted to /jobs are queued onto a bounded worker pool that runs the same
+pipeline as the Streamlit app (extract_text_from_pdf -> create_prompts ->
+extract_data_from_text -> process_api_response -> customer matching).
+When the queue is full the service answers HTTP 429 with a Retry-After header
+instead of accepting more work.
+
+Endpoints:
+    POST /jobs                 PDF body (?filename=... or X-Filename header) or
+                               multipart/form-data with one or more files
+                               -> 202 {"jobs": [{"job_id", "filename", "status"}]}
+    GET  /jobs/<id>            Job status
+    GET  /jobs/<id>/result     Enriched line items (202 while pending)
+    GET  /stats                Queue depth, worker utilisation and latency percentiles
+    GET  /metrics              Stage timings, token usage and queue gauges (Prometheus text format)
+    GET  /health               Liveness
+
+Usage:
+    AZURE_API_KEY=... python extraction_service.py --port 8100 --workers 4 --queue-size 32
+"""
+import argparse
+import collections
+import datetime
+import email.parser
+import email.policy
+import http.server
+import io
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from urllib.parse import urlparse, parse_qs
+
+import api
+from processing import process_single_file
+from data_processing import enrich_records
+from utils import load_customer_master_data
+from reporting import CollectingReporter, ConsoleReporter, set_default_reporter
+from metrics import REGISTRY, latency_summary
+
+# Service defaults
+PORT = 8100
+WORKERS = 4
+QUEUE_SIZE = 32
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+# Finished jobs kept in memory for status/result lookups
+MAX_RETAINED_JOBS = 5000
+# Completed-job latencies kept for the /stats percentiles
+LATENCY_WINDOW = 1000
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+class ExtractionService:
+    """Bounded job queue and worker pool around the extraction pipeline."""
+
+    def __init__(self, openai_api_key, workers=WORKERS, queue_size=QUEUE_SIZE):
+        self.openai_api_key = openai_api_key
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.jobs = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.busy_workers = 0
+        self.rejected = 0
+        self.counts = collections.Counter()
+        self.wait_times = collections.deque(maxlen=LATENCY_WINDOW)
+        self.process_times = collections.deque(maxlen=LATENCY_WINDOW)
+        self.total_times = collections.deque(maxlen=LATENCY_WINDOW)
+        self.started_at = time.time()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"extraction-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # Function to queue a PDF, returning the job or None when the queue is full
+    def submit(self, filename, pdf_bytes):
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'filename': filename,
+            'status': JOB_QUEUED,
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'errors': [],
+        }
+        with self.lock:
+            try:
+                self.queue.put_nowait((job['job_id'], pdf_bytes))
+            except queue.Full:
+                self.rejected += 1
+                return None
+            self.jobs[job['job_id']] = job
+            self.counts['submitted'] += 1
+            self._evict_finished()
+        return job
+
+    def _evict_finished(self):
+        # Drop the oldest finished jobs once the table is over its cap
+        while len(self.jobs) > MAX_RETAINED_JOBS:
+            for job_id, job in self.jobs.items():
+                if job['status'] in (JOB_COMPLETED, JOB_FAILED):
+                    del self.jobs[job_id]
+                    break
+            else:
+                return
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _worker(self):
+        while True:
+            job_id, pdf_bytes = self.queue.get()
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    self.queue.task_done()
+                    continue
+                job['status'] = JOB_RUNNING
+                job['started_at'] = time.time()
+                self.busy_workers += 1
+
+            reporter = CollectingReporter()
+            records = None
+            error = None
+            try:
+                pdf_file = io.BytesIO(pdf_bytes)
+                processed_data = process_single_file(pdf_file, self.openai_api_key, reporter, filename=job['filename'])
+                if processed_data:
+                    # Parsed once and cached; picks up update_customer_master.py runs without a restart
+                    records = enrich_records([processed_data], load_customer_master_data(reporter), reporter)
+            except Exception as e:
+                error = str(e)
+            finally:
+                del pdf_bytes
+
+            with self.lock:
+                job['finished_at'] = time.time()
+                job['errors'] = reporter.errors + ([error] if error else [])
+                if records is not None:
+                    job['status'] = JOB_COMPLETED
+                    job['result'] = records
+                else:
+                    job['status'] = JOB_FAILED
+                    if not job['errors']:
+                        job['errors'].append("No data could be extracted from the PDF")
+                self.counts[job['status']] += 1
+                self.busy_workers -= 1
+                self.wait_times.append(job['started_at'] - job['submitted_at'])
+                self.process_times.append(job['finished_at'] - job['started_at'])
+                self.total_times.append(job['finished_at'] - job['submitted_at'])
+            self.queue.task_done()
+
+    def stats(self):
+        # Health, in-flight requests and latency of each endpoint pool member (see endpoint_pool.py)
+        endpoint_pool = api.ENDPOINT_POOL.status()
+        with self.lock:
+            uptime = time.time() - self.started_at
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queue_capacity': self.queue.maxsize,
+                'workers': self.workers,
+                'busy_workers': self.busy_workers,
+                'submitted': self.counts['submitted'],
+                'completed': self.counts[JOB_COMPLETED],
+                'failed': self.counts[JOB_FAILED],
+                'rejected': self.rejected,
+                'uptime_s': round(uptime, 1),
+                'completed_per_min': round((self.counts[JOB_COMPLETED] + self.counts[JOB_FAILED]) / uptime * 60, 2) if uptime else 0,
+                'latency_queue_wait': latency_summary(list(self.wait_times)),
+                'latency_processing': latency_summary(list(self.process_times)),
+                'latency_total': latency_summary(list(self.total_times)),
+                'endpoint_pool': endpoint_pool,
+            }
+
+# Function to render a job for JSON responses
+def job_view(job, include_result=False):
+    def iso(ts):
+        return datetime.datetime.fromtimestamp(ts).isoformat(timespec='seconds') if ts else None
+
+    view = {
+        'job_id': job['job_id'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'submitted_at': iso(job['submitted_at']),
+        'started_at': iso(job['started_at']),
+        'finished_at': iso(job['finished_at']),
+        'errors': job['errors'],
+    }
+    if job['finished_at']:
+        view['seconds'] = round(job['finished_at'] - job['submitted_at'], 3)
+    if include_result:
+        view['result'] = job['result']
+    return view
+
+# Function to split a multipart/form-data body into (filename, bytes) pairs
+def parse_multipart_files(content_type, body):
+    message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+        b"Content-Type: " + content_type.encode('latin-1') + b"\r\n\r\n" + body
+    )
+    files = []
+    if not message.is_multipart():
+        return files
+    for part in message.iter_parts():
+        filename = part.get_filename()
+        if filename:
+            files.append((os.path.basename(filename), part.get_payload(decode=True) or b""))
+    return files
+
+class ExtractionRequestHandler(http.server.BaseHTTPRequestHandler):
+    # Set by run_server / create_server
+    service = None
+
+    def _send_metrics(self):
+        stats = self.service.stats()
+        gauges = [
+            ('po_service_queue_depth', "Jobs waiting in the queue", stats['queue_depth']),
+            ('po_service_queue_capacity', "Maximum queued jobs", stats['queue_capacity']),
+            ('po_service_busy_workers', "Workers processing a job", stats['busy_workers']),
+        ]
+        lines = []
+        for name, help_text, value in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        lines += ["# HELP po_service_rejected_total Uploads answered with 429",
+                  "# TYPE po_service_rejected_total counter", f"po_service_rejected_total {stats['rejected']}"]
+        body = (REGISTRY.render_prometheus() + "\n".join(lines) + "\n").encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status_code, payload, headers=None):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        if path == '/health':
+            self._send_json(200, {'status': 'ok'})
+            return
+        if path == '/stats':
+            self._send_json(200, self.service.stats())
+            return
+        if path == '/metrics':
+            self._send_metrics()
+            return
+
+        match = re.fullmatch(r"/jobs/([0-9a-f]{32})(/result)?", path)
+        if not match:
+            self._send_json(404, {'status': 'error', 'message': 'Not found'})
+            return
+        job = self.service.get(match.group(1))
+        if job is None:
+            self._send_json(404, {'status': 'error', 'message': 'Unknown job ID'})
+            return
+        if not match.group(2):
+            self._send_json(200, job_view(job))
+        elif job['status'] in (JOB_QUEUED, JOB_RUNNING):
+            self._send_json(202, job_view(job))
+        else:
+            self._send_json(200, job_view(job, include_result=True))
+
+    def do_POST(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path.rstrip('/') != '/jobs':
+            self._send_json(404, {'status': 'error', 'message': 'Not found'})
+            return
+
+        # Reject early when saturated so clients do not upload bodies that cannot be queued
+        if self.service.queue.full():
+            with self.service.lock:
+                self.service.rejected += 1
+            self._reject_busy()
+            return
+
+        content_length = self.headers.get('Content-Length')
+        if content_length is None:
+            self._send_json(411, {'status': 'error', 'message': 'Content-Length header required'})
+            return
+        try:
+            content_length = int(content_length)
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            self._send_json(400, {'status': 'error', 'message': 'Invalid Content-Length header'})
+            return
+        if content_length == 0:
+            self._send_json(400, {'status': 'error', 'message': 'Empty request body'})
+            return
+        if content_length > MAX_UPLOAD_BYTES:
+            self._send_json(413, {'status': 'error', 'message': f'Upload exceeds {MAX_UPLOAD_BYTES} bytes'})
+            return
+        body = self.rfile.read(content_length)
+
+        content_type = self.headers.get('Content-Type', 'application/pdf')
+        if content_type.startswith('multipart/form-data'):
+            files = parse_multipart_files(content_type, body)
+        else:
+            params = parse_qs(parsed_url.query)
+            filename = params.get('filename', [None])[0] or self.headers.get('X-Filename') or "upload.pdf"
+            files = [(os.path.basename(filename), body)]
+        del body
+
+        if not files:
+            self._send_json(400, {'status': 'error', 'message': 'No files in request'})
+            return
+
+        accepted = []
+        for filename, pdf_bytes in files:
+            if not pdf_bytes.startswith(b'%PDF'):
+                accepted.append({'filename': filename, 'status': 'rejected', 'message': 'Not a PDF file'})
+                continue
+            job = self.service.submit(filename, pdf_bytes)
+            if job is None:
+                accepted.append({'filename': filename, 'status': 'rejected', 'message': 'Queue full'})
+                continue
+            accepted.append({'job_id': job['job_id'], 'filename': filename, 'status': job['status']})
+
+        if not any('job_id' in item for item in accepted):
+            if any(item['message'] == 'Queue full' for item in accepted):
+                self._reject_busy()
+            else:
+                self._send_json(400, {'status': 'error', 'jobs': accepted})
+            return
+        self._send_json(202, {'status': 'accepted', 'jobs': accepted})
+
+    def _reject_busy(self):
+        # Rough hint: time for the workers to drain one queue's worth of jobs
+        processing = latency_summary(list(self.service.process_times))['p50_ms'] or 5000
+        retry_after = max(1, int(processing / 1000 * self.service.queue.maxsize / max(self.service.workers, 1)))
+        self._send_json(429, {'status': 'error', 'message': 'Extraction queue is full, retry later'},
+                        headers={'Retry-After': str(retry_after)})
+
+    def log_message(self, format, *args):
+        # Keep request logging terse; per-job errors are reported through the job status
+        pass
+
+# Function to create the HTTP server around a started ExtractionService
+def create_server(service, host="", port=PORT):
+    handler = type("BoundExtractionRequestHandler", (ExtractionRequestHandler,), {'service': service})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def run_server():
+    parser = argparse.ArgumentParser(description="HTTP service for purchase-order PDF extraction")
+    parser.add_argument("--host", default="", help="Interface to bind (default: all)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Parallel extraction workers")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Queued jobs before answering 429")
+    parser.add_argument("--api-key", help="Azure OpenAI API key (default: AZURE_API_KEY environment variable / .env)")
+    args = parser.parse_args()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    openai_api_key = args.api_key or os.environ.get("AZURE_API_KEY")
+    if not openai_api_key:
+        parser.error("No API key: pass --api-key or set AZURE_API_KEY")
+
+    set_default_reporter(ConsoleReporter())
+    service = ExtractionService(openai_api_key, workers=args.workers, queue_size=args.queue_size)
+    service.start()
+    with create_server(service, args.host, args.port) as httpd:
+        print(f"Extraction service started at http://localhost:{args.port} "
+              f"({args.workers} workers, queue size {args.queue_size})")
+        print("Press Ctrl+C to stop the server")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("Server stopped")
+
+if __name__ == "__main__":
+    run_server()
@@ -0,0 +1,201 @@
+"""
+Targeted follow-up requests for missing or invalid fields.
+
+When a parsed response has line items that fail
+data_processing.validate_line_item (a field missing, a date that is not ISO,
+a quantity that is not a whole number, or the tail of a response that was cut
+off), ``complete_missing_fields`` asks the model for just those fields instead
+of dropping or re-extracting the file. The follow-up repeats the original
+messages unchanged, adds the model's own answer and lists the problems, so the
+prompt cache can serve the PO text and the model only generates the few
+missing values. Values that still fail validation are left as they were.
+
+A response cut off part-way through a list of line items loses the lines
+after the cut entirely. ``complete_truncated_lines`` first asks the model for
+the line items after the last one kept, up to MAX_CONTINUATIONS times, and
+reports an error if the rest still cannot be recovered.
+
+``repair_summary`` reports how often responses needed repairing and fields
+needed asking again, from the json_responses, json_repairs, reask_requests,
+reask_fields and continuation_* counters.
+"""
+import json
+import os
+
+import api
+from data_processing import repair_json, validate_line_item
+from reporting import get_reporter
+from metrics import count
+
+# Requests for the rest of a cut-off response before its lost line items are reported as an error
+MAX_CONTINUATIONS = int(os.environ.get("PO_MAX_CONTINUATIONS", 2))
+
+# Function to find the line items that need a follow-up
+def find_invalid_fields(line_items):
+    """
+    Returns:
+        dict: line number (1-based) -> {field: problem}, for line items that are JSON objects
+    """
+    invalid = {}
+    for number, line_item in enumerate(line_items, start=1):
+        if isinstance(line_item, dict):
+            problems = validate_line_item(line_item)
+            if problems:
+                invalid[number] = problems
+    return invalid
+
+# Function to build the follow-up prompts for the invalid fields
+def create_followup_prompts(prompts, line_items, invalid):
+    problem_lines = "\n".join(
+        f"- line {number}: '{field}' is {problem}"
+        for number, problems in invalid.items() for field, problem in problems.items()
+    )
+    example = json.dumps({str(number): {field: "..." for field in problems} for number, problems in invalid.items()})
+    return list(prompts) + [
+        {"role": "assistant", "content": json.dumps(line_items)},
+        {"role": "user", "content": (
+            "Some fields of the lines above (numbered from 1) are missing or invalid:\n"
+            f"{problem_lines}\n\n"
+            "Look them up in the purchase order again and return ONLY a JSON object that maps each "
+            f"line number to the corrected fields, in the same formats as before: {example}"
+        )},
+    ]
+
+# Function to build the prompts asking for the line items after a cut-off
+def create_continuation_prompts(prompts, line_items):
+    return list(prompts) + [
+        {"role": "assistant", "content": json.dumps(line_items)},
+        {"role": "user", "content": (
+            f"Your answer was cut off after line {len(line_items)} (lines numbered from 1). Return ONLY a JSON "
+            f"array of the remaining line items of the purchase order, starting with line {len(line_items) + 1}, "
+            "in the same format as before. Return [] if there are none."
+        )},
+    ]
+
+# Function to ask the model for the line items a cut-off response lost
+def complete_truncated_lines(result, prompts, openai_api_key, deployment=None, reporter=None):
+    """
+    Args:
+        result (dict): As returned by process_api_response; its "truncated" flag is
+                       removed and recovered line items are appended in place
+
+    Returns:
+        dict or None: The result
+    """
+    if not result or not result.pop('truncated', False):
+        return result
+    data = result['data']
+    if not isinstance(data, list):
+        # A single cut-off line item only lacks fields, which complete_missing_fields asks for
+        return result
+
+    reporter = get_reporter(reporter)
+    for _ in range(MAX_CONTINUATIONS):
+        count('continuation_requests')
+        try:
+            response, _ = api.chat_completion(openai_api_key, create_continuation_prompts(prompts, data), deployment)
+            answer, repairs = repair_json(response.choices[0].message.content or "")
+        except Exception as e:
+            reporter.error(f"⚠ {result['filename']}: the response was cut off after line {len(data)} "
+                           f"and asking for the rest failed: {e}")
+            return result
+        lines = answer if isinstance(answer, list) else [answer]
+        lines = [line_item for line_item in lines if isinstance(line_item, dict) and line_item]
+        data.extend(lines)
+        count('continuation_lines', len(lines))
+        if 'truncated' not in repairs:
+            return result
+    reporter.error(f"⚠ {result['filename']}: the response was cut off again after line {len(data)}; "
+                   "later line items may be missing")
+    return result
+
+# Function to ask the model again for only the missing or invalid fields of a result
+def complete_missing_fields(result, prompts, openai_api_key, deployment=None, reporter=None):
+    """
+    Args:
+        result (dict): {"filename": ..., "data": ...} as returned by process_api_response; updated in place
+        prompts (list): The messages that produced the result
+
+    Returns:
+        dict or None: The result, with the fields the follow-up fixed
+    """
+    if not result:
+        return result
+    result = complete_truncated_lines(result, prompts, openai_api_key, deployment, reporter)
+    data = result['data']
+    line_items = data if isinstance(data, list) else [data]
+    invalid = find_invalid_fields(line_items)
+    if not invalid:
+        return result
+
+    reporter = get_reporter(reporter)
+    field_count = sum(len(problems) for problems in invalid.values())
+    count('reask_requests')
+    try:
+        response, _ = api.chat_completion(openai_api_key, create_followup_prompts(prompts, line_items, invalid), deployment)
+        answer, _ = repair_json(response.choices[0].message.content or "")
+    except Exception as e:
+        count('reask_fields', field_count, label='unfixed')
+        reporter.warning(f"⚠ Could not complete {field_count} fields of {result['filename']}: {e}")
+        return result
+
+    fixed = 0
+    unfixed = []
+    for number, problems in invalid.items():
+        line_item = line_items[number - 1]
+        corrections = answer.get(str(number)) if isinstance(answer, dict) else None
+        if not isinstance(corrections, dict):
+            corrections = {}
+        for field in problems:
+            value = corrections.get(field)
+            if isinstance(value, str):
+                value = value.replace('\n', ' ').replace('\r', ' ')
+            # Keep a corrected value only if it passes validation
+            if value is not None and field not in validate_line_item({**line_item, field: value}):
+                line_item[field] = value
+                fixed += 1
+            else:
+                unfixed.append(f"line {number} {field}")
+
+    count('reask_fields', fixed, label='fixed')
+    count('reask_fields', len(unfixed), label='unfixed')
+    reporter.info(f"Follow-up for {result['filename']}: {fixed} of {field_count} fields fixed")
+    if unfixed:
+        reporter.warning(f"⚠ {result['filename']}: still missing or invalid after a follow-up: {', '.join(unfixed)}")
+    return result
+
+# Function to summarize the JSON repair and follow-up counters of a StageMetrics
+def repair_summary(metrics):
+    """
+    Returns:
+        dict or None: Responses by outcome, repairs by kind, follow-up requests and
+                      fields fixed, with rates per response; None if nothing was parsed
+    """
+    responses = {outcome: metrics.counter('json_responses', outcome) for outcome in ('clean', 'repaired', 'failed')}
+    total = sum(responses.values())
+    if not total:
+        return None
+    repairs = {repair: metrics.counter('json_repairs', repair)
+               for repair in ('fence', 'prose', 'trailing_comma', 'truncated')}
+    reasks = metrics.counter('reask_requests')
+    return {
+        'responses': responses,
+        'repairs': {repair: value for repair, value in repairs.items() if value},
+        'repair_rate': round(responses['repaired'] / total, 3),
+        'failure_rate': round(responses['failed'] / total, 3),
+        'reask_requests': reasks,
+        'reask_rate': round(reasks / total, 3),
+        'fields_fixed': metrics.counter('reask_fields', 'fixed'),
+        'fields_unfixed': metrics.counter('reask_fields', 'unfixed'),
+        'continuation_requests': metrics.counter('continuation_requests'),
+        'lines_recovered': metrics.counter('continuation_lines'),
+    }
+
+# Function to format repair_summary() as one line
+def format_repair_summary(summary):
+    repairs = ", ".join(f"{repair} {value}" for repair, value in summary['repairs'].items()) or "none"
+    return (f"{summary['responses']['repaired']} repaired ({summary['repair_rate']:.1%}; {repairs}), "
+            f"{summary['responses']['failed']} unparseable; {summary['reask_requests']} follow-ups "
+            f"({summary['reask_rate']:.1%}) fixed {summary['fields_fixed']} fields, "
+            f"{summary['fields_unfixed']} left invalid; {summary['continuation_requests']} continuations "
+            f"recovered {summary['lines_recovered']} cut-off lines")
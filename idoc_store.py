@@ -0,0 +1,142 @@
+import sqlite3
+import datetime
+
+# Default location of the received-IDoc store used by the SAP endpoint stand-in
+IDOC_DB_FILE = "sap_endpoint_idocs.db"
+
+# Hard cap on rows returned by a single query
+MAX_QUERY_LIMIT = 10000
+# Cap on PO/customer values in one query (keeps below SQLite's bound-parameter limit)
+MAX_FILTER_VALUES = 900
+
+# Columns returned by queries, in order
+IDOC_COLUMNS = ('id', 'received_at', 'request_id', 'idoc_id', 'po_number',
+                'customer', 'part_number', 'quantity', 'delivery_date', 'currency')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idocs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    received_at TEXT NOT NULL,
+    request_id TEXT,
+    idoc_id TEXT,
+    po_number TEXT,
+    customer TEXT,
+    part_number TEXT,
+    quantity NUMERIC,
+    delivery_date TEXT,
+    currency TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_idocs_po_number ON idocs (po_number);
+CREATE INDEX IF NOT EXISTS idx_idocs_customer_date ON idocs (customer, delivery_date);
+CREATE INDEX IF NOT EXISTS idx_idocs_delivery_date ON idocs (delivery_date);
+"""
+
+# Function to open (and create if needed) the IDoc store
+def connect_idoc_store(db_path=IDOC_DB_FILE):
+    """
+    Open a connection to the IDoc store, creating the table and indexes on first use.
+
+    Args:
+        db_path (str): Path of the SQLite database file
+
+    Returns:
+        sqlite3.Connection: Open connection
+    """
+    conn = sqlite3.connect(db_path)
+    # WAL lets readers query while a large POST is being inserted
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+# Function to normalize a date to the IDoc YYYYMMDD format
+def normalize_idoc_date(value):
+    """
+    Normalize a date given as YYYYMMDD or YYYY-MM-DD to YYYYMMDD.
+
+    Raises:
+        ValueError: If the value is not a valid date in either format
+    """
+    value = value.strip().replace('-', '')
+    datetime.datetime.strptime(value, '%Y%m%d')
+    return value
+
+# Function to batch-insert extracted IDoc key fields
+def insert_idoc_records(conn, records, request_id=None):
+    """
+    Insert a batch of IDoc key-field records in a single executemany call.
+
+    The caller owns the transaction, so a whole POST can be committed or
+    rolled back as one unit.
+
+    Args:
+        conn (sqlite3.Connection): Open store connection
+        records (list): Dicts as returned by sap_endpoint.extract_idoc_fields
+        request_id (str): Identifier of the POST the records arrived in
+    """
+    if not records:
+        return
+    received_at = datetime.datetime.now().isoformat(timespec='seconds')
+    conn.executemany(
+        "INSERT INTO idocs (received_at, request_id, idoc_id, po_number, customer, "
+        "part_number, quantity, delivery_date, currency) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                received_at,
+                request_id,
+                record.get('idoc_id'),
+                record.get('po_number'),
+                record.get('customer'),
+                record.get('part_number'),
+                record.get('quantity'),
+                record.get('delivery_date'),
+                record.get('currency'),
+            )
+            for record in records
+        ]
+    )
+
+# Function to query stored IDocs
+def query_idoc_records(conn, po_numbers=None, customers=None, date_from=None, date_to=None, limit=1000):
+    """
+    Look up stored IDocs by PO number, customer and/or delivery date range.
+
+    Args:
+        conn (sqlite3.Connection): Open store connection
+        po_numbers (list): PO numbers (BELNR) to match, any of
+        customers (list): Customer numbers (PARTN) to match, any of
+        date_from (str): Inclusive lower bound on DATUM (YYYYMMDD or YYYY-MM-DD)
+        date_to (str): Inclusive upper bound on DATUM (YYYYMMDD or YYYY-MM-DD)
+        limit (int): Maximum number of rows to return
+
+    Returns:
+        list: One dict per matching IDoc, newest first
+
+    Raises:
+        ValueError: On an invalid date or too many filter values
+    """
+    if len(po_numbers or []) + len(customers or []) > MAX_FILTER_VALUES:
+        raise ValueError(f"At most {MAX_FILTER_VALUES} PO/customer values per query")
+
+    clauses = []
+    params = []
+    if po_numbers:
+        clauses.append(f"po_number IN ({', '.join('?' * len(po_numbers))})")
+        params.extend(po_numbers)
+    if customers:
+        clauses.append(f"customer IN ({', '.join('?' * len(customers))})")
+        params.extend(customers)
+    if date_from:
+        clauses.append("delivery_date >= ?")
+        params.append(normalize_idoc_date(date_from))
+    if date_to:
+        clauses.append("delivery_date <= ?")
+        params.append(normalize_idoc_date(date_to))
+
+    sql = f"SELECT {', '.join(IDOC_COLUMNS)} FROM idocs"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(max(1, min(int(limit), MAX_QUERY_LIMIT)))
+
+    return [dict(zip(IDOC_COLUMNS, row)) for row in conn.execute(sql, params)]
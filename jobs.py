@@ -0,0 +1,329 @@
+"""
+Background extraction jobs.
+
+Extraction runs in a process-wide worker pool instead of the Streamlit script
+thread, so widget interactions and browser refreshes do not restart a batch.
+Each job persists its inputs, progress and per-file results under JOBS_DIR,
+which lets the UI poll progress, reattach by job ID and resume a job that was
+interrupted by a server restart.
+"""
+import datetime
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from processing import process_single_file
+from packing import plan_packs, extract_pack
+from utils import extract_pages_from_pdf
+from reporting import CollectingReporter
+from metrics import StageMetrics, record_stages
+from profiling import profile_batch
+
+# Job storage and worker configuration
+JOBS_DIR = os.environ.get("PO_JOBS_DIR", ".jobs")
+JOB_WORKERS = int(os.environ.get("PO_JOB_WORKERS", 2))
+JOB_TTL_SECONDS = int(os.environ.get("PO_JOB_TTL_SECONDS", 24 * 3600))
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_INTERRUPTED = "interrupted"
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="extraction-job")
+# Jobs with a live future in this process, and jobs asked to stop
+_futures = {}
+_cancel_requested = set()
+_lock = threading.Lock()
+
+def _job_dir(job_id):
+    # Job IDs are generated hex strings; reject anything else before touching the filesystem
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id or ""):
+        raise ValueError(f"Invalid job ID: {job_id}")
+    return os.path.join(JOBS_DIR, job_id)
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+def _read_status(job_id):
+    with open(os.path.join(_job_dir(job_id), "status.json")) as f:
+        return json.load(f)
+
+def _write_status(status):
+    # Write to a temp file and rename so pollers never see a half-written file
+    status['updated_at'] = _now()
+    path = os.path.join(_job_dir(status['job_id']), "status.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _append_result(job_id, record):
+    with open(os.path.join(_job_dir(job_id), "results.jsonl"), 'a') as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _read_results(job_id):
+    path = os.path.join(_job_dir(job_id), "results.jsonl")
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn final line from a crash; that file is simply re-processed
+                break
+    return records
+
+# Function to submit a batch of PDFs as a background extraction job
+def submit_extraction_job(files, openai_api_key, profile=False, pack=False):
+    """
+    Persist the uploaded PDFs and start extracting them in the background.
+
+    Args:
+        files (list): (filename, pdf_bytes or path to a stored PDF) tuples
+        openai_api_key (str): Azure OpenAI API key (kept in memory only)
+        profile (bool): Profile the job run (see profiling.py) even if PO_PROFILE is not set
+        pack (bool): Send small POs together in packed requests (see packing.py)
+
+    Returns:
+        str: Job ID
+    """
+    cleanup_expired_jobs()
+
+    job_id = uuid.uuid4().hex
+    input_dir = os.path.join(_job_dir(job_id), "inputs")
+    os.makedirs(input_dir)
+
+    file_entries = []
+    for index, (filename, data) in enumerate(files):
+        input_path = os.path.join(input_dir, f"{index:05d}.pdf")
+        if isinstance(data, (bytes, bytearray)):
+            with open(input_path, 'wb') as f:
+                f.write(data)
+        else:
+            # A spilled upload (upload_store.py): hard-link it if possible instead of copying
+            try:
+                os.link(data, input_path)
+            except OSError:
+                shutil.copyfile(data, input_path)
+        file_entries.append({'filename': filename, 'input_path': input_path})
+
+    _write_status({
+        'job_id': job_id,
+        'status': JOB_QUEUED,
+        'created_at': _now(),
+        'total': len(file_entries),
+        'completed': 0,
+        'succeeded': 0,
+        'errors': [],
+        'files': file_entries,
+        'profile': profile,
+        'pack': pack,
+    })
+    _start(job_id, openai_api_key)
+    return job_id
+
+# Function to resume an interrupted job, skipping files that already have results
+def resume_job(job_id, openai_api_key):
+    status = _read_status(job_id)
+    if status['status'] in ACTIVE_STATES and job_id in _futures:
+        return
+    status['status'] = JOB_QUEUED
+    _write_status(status)
+    _start(job_id, openai_api_key)
+
+def _start(job_id, openai_api_key):
+    with _lock:
+        _cancel_requested.discard(job_id)
+        _futures[job_id] = _executor.submit(_run_job_profiled, job_id, openai_api_key)
+
+# Function to ask a running job to stop after the current file
+def cancel_job(job_id):
+    with _lock:
+        if job_id in _futures:
+            _cancel_requested.add(job_id)
+
+def _run_job_profiled(job_id, openai_api_key):
+    try:
+        with profile_batch('job', enabled=_read_status(job_id).get('profile', False)) as profile:
+            _run_job(job_id, openai_api_key)
+        if profile is not None and profile.files:
+            status = _read_status(job_id)
+            status['profile_files'] = profile.files
+            _write_status(status)
+    finally:
+        # The job counts as active until its profile (if any) is on disk
+        with _lock:
+            _futures.pop(job_id, None)
+            _cancel_requested.discard(job_id)
+
+# Function to parse the pending PDFs of a packed job and group them into requests
+def _plan_job_packs(status, pending):
+    """
+    Returns:
+        tuple: (lists of file indexes, file index -> page texts, StageMetrics of the parsing)
+    """
+    pages = {}
+    with record_stages() as planning_metrics:
+        for index in pending:
+            with open(status['files'][index]['input_path'], 'rb') as f:
+                pages[index] = extract_pages_from_pdf(f, CollectingReporter())
+    documents = [(status['files'][index]['filename'], pages[index]) for index in pending]
+    return [[pending[position] for position in pack] for pack in plan_packs(documents)], pages, planning_metrics
+
+# Function to extract one file, or one packed group of files, of a job
+def _process_group(status, group, pages, openai_api_key, reporter):
+    """
+    Returns:
+        list: One process_single_file result (or None) per file index in group
+    """
+    if not status.get('pack'):
+        entry = status['files'][group[0]]
+        with open(entry['input_path'], 'rb') as f:
+            pdf_file = io.BytesIO(f.read())
+        pdf_file.name = entry['filename']
+        return [process_single_file(pdf_file, openai_api_key, reporter)]
+    return extract_pack([(status['files'][index]['filename'], pages[index]) for index in group], openai_api_key, reporter)
+
+def _run_job(job_id, openai_api_key):
+    status = _read_status(job_id)
+    status['status'] = JOB_RUNNING
+    status['started_at'] = status.get('started_at') or _now()
+    _write_status(status)
+
+    # Results already on disk belong to files processed before an interruption
+    previous_results = _read_results(job_id)
+    done = {record['index'] for record in previous_results}
+    status['completed'] = len(done)
+    status['succeeded'] = sum(1 for record in previous_results if record.get('result'))
+    status['errors'] = [record['error'] for record in previous_results if record.get('error')]
+    try:
+        pending = [index for index in range(len(status['files'])) if index not in done]
+        if status.get('pack'):
+            groups, pages, planning_metrics = _plan_job_packs(status, pending)
+        else:
+            groups, pages, planning_metrics = [[index] for index in pending], {}, None
+        for group in groups:
+            if job_id in _cancel_requested:
+                status['status'] = JOB_CANCELLED
+                break
+
+            started = time.perf_counter()
+            # Worker threads have no Streamlit context; keep pipeline errors with the job instead
+            reporter = CollectingReporter()
+            group_error = None
+            try:
+                with record_stages(planning_metrics) as group_metrics:
+                    results = _process_group(status, group, pages, openai_api_key, reporter)
+            except Exception as e:
+                results = [None] * len(group)
+                group_error = str(e)
+                print(f"Job {job_id}: error processing {', '.join(status['files'][index]['filename'] for index in group)}: "
+                      f"{traceback.format_exc()}")
+            # The PDF parsing done while planning packs is counted with the first group
+            planning_metrics = None
+            seconds = round(time.perf_counter() - started, 3)
+
+            for position, index in enumerate(group):
+                entry = status['files'][index]
+                processed_data = results[position]
+                error = None
+                if group_error:
+                    error = f"{entry['filename']}: {group_error}"
+                elif reporter.errors and (len(group) == 1 or not processed_data):
+                    # A packed request shares one reporter; its errors go to the files that failed
+                    error = f"{entry['filename']}: {'; '.join(reporter.errors)}"
+                if error:
+                    status['errors'].append(error)
+
+                _append_result(job_id, {
+                    'index': index,
+                    'filename': entry['filename'],
+                    'seconds': seconds,
+                    'result': processed_data,
+                    'error': error,
+                    # Metrics of a packed request are stored once, with its first file
+                    'metrics': group_metrics.to_dict() if position == 0 else None,
+                })
+                done.add(index)
+                status['completed'] = len(done)
+                status['succeeded'] += 1 if processed_data else 0
+            _write_status(status)
+        else:
+            status['status'] = JOB_COMPLETED
+    except Exception as e:
+        status['status'] = JOB_FAILED
+        status['errors'].append(str(e))
+        print(f"Job {job_id} failed: {traceback.format_exc()}")
+    finally:
+        status['finished_at'] = _now()
+        _write_status(status)
+
+# Function to get the current status of a job
+def get_job(job_id):
+    """
+    Returns:
+        dict: Job status (see submit_extraction_job), or None if the job does not exist.
+              A job that is active on disk but has no worker in this process (e.g. the
+              server restarted) is reported as interrupted; a finished job whose worker
+              is still saving its profile is reported as running.
+    """
+    try:
+        status = _read_status(job_id)
+    except (ValueError, FileNotFoundError, json.JSONDecodeError):
+        return None
+    if status['status'] in ACTIVE_STATES and job_id not in _futures:
+        status['status'] = JOB_INTERRUPTED
+    elif status['status'] not in ACTIVE_STATES and job_id in _futures:
+        status['status'] = JOB_RUNNING
+    return status
+
+# Function to load the extracted data of a job in input order
+def load_job_results(job_id):
+    """
+    Returns:
+        list: process_api_response results for files that succeeded so far,
+              as {"filename": ..., "data": ...} dicts for convert_to_dataframe
+    """
+    records = sorted(_read_results(job_id), key=lambda record: record['index'])
+    return [record['result'] for record in records if record.get('result')]
+
+# Function to load the combined stage metrics of a job's files
+def load_job_metrics(job_id):
+    """
+    Returns:
+        StageMetrics: Stage timings and token counts summed over the files processed so far
+    """
+    job_metrics = StageMetrics()
+    for record in _read_results(job_id):
+        job_metrics.merge(record.get('metrics'))
+    return job_metrics
+
+# Function to remove finished jobs older than JOB_TTL_SECONDS
+def cleanup_expired_jobs():
+    if not os.path.isdir(JOBS_DIR):
+        return
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for job_id in os.listdir(JOBS_DIR):
+        if job_id in _futures:
+            continue
+        path = os.path.join(JOBS_DIR, job_id)
+        try:
+            if os.path.getmtime(os.path.join(path, "status.json")) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            continue
@@ -0,0 +1,101 @@
+"""
+Customer part number to SAP material number cross-reference.
+
+The model reads the customer's own part number from the PO. Order entry
+needs the SAP material number, which depends on the customer:
+update_material_xref.py turns an Excel sheet of (Customer Number, Customer
+Part Number, Material Number) rows into MATERIAL_XREF_FILE, with normalized
+keys, and ``load_material_xref`` flattens that into a dict keyed by
+(customer number, normalized part number). The index is parsed once and
+again only when the file changes.
+
+``resolve_materials`` looks up the line items of a whole DataFrame at once
+(convert_to_dataframe calls it), normalizing each distinct part number once.
+"""
+import json
+import os
+import re
+
+from metrics import stage, count
+
+# Cross-reference written by update_material_xref.py
+MATERIAL_XREF_FILE = os.environ.get("PO_MATERIAL_XREF_FILE", "material_xref.json")
+
+# Parsed index, reused until the file changes
+_xref_cache = {}
+
+_SEPARATORS = re.compile(r"[^0-9A-Z]")
+
+# Function to normalize a customer part number for lookups
+def normalize_part_number(part_number):
+    """
+    Upper-case the part number, drop spaces, dashes, dots and other separators,
+    and drop leading zeros of purely numeric part numbers, so that "p-100.20",
+    "P 10020" and "P10020" (or "000123" and "123") share one key.
+    """
+    if part_number is None:
+        return ""
+    key = _SEPARATORS.sub("", str(part_number).upper())
+    if key.isdigit():
+        key = key.lstrip("0") or "0"
+    return key
+
+# Function to normalize a customer number the way update_customer_master.py does
+def normalize_customer_number(customer_number):
+    return "" if customer_number is None else str(customer_number).strip().upper()
+
+# Function to load the cross-reference as a hash index
+def load_material_xref():
+    """
+    Returns:
+        dict: (customer number, normalized part number) -> SAP material number;
+              empty if MATERIAL_XREF_FILE does not exist or cannot be read
+    """
+    try:
+        stat = os.stat(MATERIAL_XREF_FILE)
+    except OSError:
+        return {}
+    file_key = (stat.st_mtime_ns, stat.st_size)
+    if _xref_cache.get('key') == file_key:
+        return _xref_cache['index']
+    try:
+        with open(MATERIAL_XREF_FILE) as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error loading the material cross-reference: {e}")
+        return {}
+    index = {
+        (customer_number, part_key): material
+        for customer_number, parts in data.items()
+        for part_key, material in parts.items()
+    }
+    _xref_cache.update(key=file_key, index=index)
+    print(f"Loaded material cross-reference with {len(index)} entries")
+    return index
+
+# Function to look up the SAP material numbers of many line items at once
+@stage('material_xref')
+def resolve_materials(customer_numbers, part_numbers, index=None):
+    """
+    Args:
+        customer_numbers (iterable): Customer number of each line item
+        part_numbers (iterable): Customer part number of each line item
+        index (dict): As returned by load_material_xref (default: loaded from MATERIAL_XREF_FILE)
+
+    Returns:
+        list: SAP material number per line item, "" where there is no entry
+    """
+    if index is None:
+        index = load_material_xref()
+    part_keys = {}
+    materials = []
+    for customer_number, part_number in zip(customer_numbers, part_numbers):
+        part_key = part_keys.get(part_number)
+        if part_key is None:
+            part_key = part_keys[part_number] = normalize_part_number(part_number)
+        materials.append(index.get((normalize_customer_number(customer_number), part_key), ""))
+    if materials:
+        resolved = sum(1 for material in materials if material)
+        count('material_lookups', resolved, label='resolved')
+        count('material_lookups', len(materials) - resolved, label='unresolved')
+    return materials
@@ -0,0 +1,277 @@
+"""
+Stage-level timing and token-usage metrics for the extraction pipeline.
+
+Pipeline functions wrap their work in ``stage(name)``. Every observation goes
+into the process-wide REGISTRY, which the HTTP service exposes at /metrics and
+the command-line tools can write as a Prometheus text file. Observations are
+also added to the StageMetrics of the enclosing ``record_stages()`` block, if
+any, so a single file or batch can be summarized on its own. The current
+recorder lives in a context variable, which keeps concurrent worker threads
+from mixing up their numbers.
+
+Stages:
+    pdf_parse, prompt_build, llm_call, json_parse, customer_match,
+    dataframe, excel_export, idoc_xml, x12, idoc_send
+"""
+import contextlib
+import contextvars
+import math
+import os
+import tempfile
+import threading
+import time
+
+# Histogram buckets (seconds) for stage durations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Pipeline stages in the order they run
+STAGES = ('pdf_parse', 'prompt_build', 'llm_call', 'json_parse', 'customer_match',
+          'dataframe', 'excel_export', 'idoc_xml', 'x12', 'idoc_send')
+
+# Counter name -> (Prometheus metric, help text, label name or None)
+COUNTERS = {
+    'llm_requests': ('po_llm_requests_total', "Chat-completion calls made", None),
+    'llm_errors': ('po_llm_errors_total', "Chat-completion calls that raised", None),
+    'llm_retries': ('po_llm_retries_total', "Retries taken by the OpenAI client", None),
+    'prompt_tokens': ('po_llm_prompt_tokens_total', "Prompt tokens billed", None),
+    'completion_tokens': ('po_llm_completion_tokens_total', "Completion tokens billed", None),
+    'cached_prompt_tokens': ('po_llm_cached_prompt_tokens_total', "Prompt tokens served from the prompt cache", None),
+    'cache_hits': ('po_cache_hits_total', "Lookups served from a cache", 'cache'),
+    'cache_misses': ('po_cache_misses_total', "Lookups that missed a cache", 'cache'),
+    'stage_errors': ('po_stage_errors_total', "Stages that raised", 'stage'),
+    'routed_files': ('po_routed_files_total', "Files by model route: fast, full or escalated", 'route'),
+    'llm_cost_usd': ('po_llm_cost_usd_total', "Estimated spend on routed chat completions", 'deployment'),
+    'llm_seconds': ('po_llm_seconds_total', "Time spent in routed chat completions", 'deployment'),
+    'baseline_cost_usd': ('po_llm_baseline_cost_usd_total', "Estimated spend had every routed file used the full deployment", None),
+    'baseline_seconds': ('po_llm_baseline_seconds_total', "Estimated completion time had every routed file used the full deployment", None),
+    'json_responses': ('po_json_responses_total', "Model responses by parse outcome: clean, repaired or failed", 'outcome'),
+    'json_repairs': ('po_json_repairs_total', "Repairs applied to model responses", 'repair'),
+    'reask_requests': ('po_reask_requests_total', "Follow-up requests for missing or invalid fields", None),
+    'reask_fields': ('po_reask_fields_total', "Fields asked for again, by outcome: fixed or unfixed", 'outcome'),
+    'continuation_requests': ('po_continuation_requests_total', "Follow-up requests for the line items a cut-off response lost", None),
+    'continuation_lines': ('po_continuation_lines_total', "Line items recovered by continuation requests", None),
+    'packed_requests': ('po_packed_requests_total', "Requests carrying several packed POs", None),
+    'packed_documents': ('po_packed_documents_total', "POs sent in packed requests", None),
+    'pack_fallbacks': ('po_pack_fallbacks_total', "Packed POs missing from the answer and extracted alone", None),
+    'pack_baseline_tokens': ('po_pack_baseline_prompt_tokens_total', "Estimated prompt tokens of packed POs had each been sent alone", None),
+    'pack_prompt_tokens': ('po_pack_prompt_tokens_total', "Estimated prompt tokens spent on packed POs", None),
+    'pool_requests': ('po_pool_requests_total', "Chat completions answered or failed, by pool member", 'endpoint'),
+    'pool_failures': ('po_pool_failures_total', "Chat completions that failed, by pool member", 'endpoint'),
+    'pool_failovers': ('po_pool_failovers_total', "Failed chat completions re-sent to another pool member", None),
+    'hedged_requests': ('po_hedged_requests_total', "Hedged chat completions, by winner: primary, hedge or none", 'winner'),
+    'cancelled_requests': ('po_cancelled_requests_total', "Chat completions cancelled after the other hedged request answered", 'endpoint'),
+    'material_lookups': ('po_material_lookups_total', "Line items looked up in the material cross-reference, by outcome: resolved or unresolved", 'outcome'),
+}
+
+class StageMetrics:
+    """Thread-safe stage durations (histograms) and counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # stage -> [count, total seconds, max seconds, per-bucket counts]
+        self.stages = {}
+        # (counter, label value) -> value
+        self.counters = {}
+
+    def observe(self, stage_name, seconds):
+        with self._lock:
+            entry = self.stages.get(stage_name)
+            if entry is None:
+                entry = self.stages[stage_name] = [0, 0.0, 0.0, [0] * len(DURATION_BUCKETS)]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    entry[3][i] += 1
+
+    def inc(self, counter, value=1, label=''):
+        if counter not in COUNTERS:
+            raise ValueError(f"Unknown counter: {counter}")
+        with self._lock:
+            key = (counter, label)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def counter(self, counter, label=None):
+        """Value of a counter; with label=None, summed over all labels."""
+        with self._lock:
+            return sum(value for (name, key_label), value in self.counters.items()
+                       if name == counter and (label is None or key_label == label))
+
+    def to_dict(self):
+        """JSON-serializable snapshot (see from_dict)."""
+        with self._lock:
+            return {
+                'stages': {name: [entry[0], entry[1], entry[2], list(entry[3])] for name, entry in self.stages.items()},
+                'counters': [[name, label, value] for (name, label), value in self.counters.items()],
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        metrics = cls()
+        metrics.merge(data)
+        return metrics
+
+    def merge(self, other):
+        """Add another StageMetrics (or its to_dict() snapshot) into this one."""
+        data = other.to_dict() if isinstance(other, StageMetrics) else other
+        if not data:
+            return
+        with self._lock:
+            for name, (count, total, longest, buckets) in data.get('stages', {}).items():
+                entry = self.stages.get(name)
+                if entry is None:
+                    entry = self.stages[name] = [0, 0.0, 0.0, [0] * len(DURATION_BUCKETS)]
+                entry[0] += count
+                entry[1] += total
+                entry[2] = max(entry[2], longest)
+                entry[3] = [a + b for a, b in zip(entry[3], buckets)]
+            for name, label, value in data.get('counters', []):
+                key = (name, label)
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary_rows(self):
+        """One row per stage (pipeline order) for display."""
+        with self._lock:
+            stages = dict(self.stages)
+        order = [name for name in STAGES if name in stages] + sorted(set(stages) - set(STAGES))
+        total_seconds = sum(entry[1] for entry in stages.values()) or 1.0
+        return [{
+            'Stage': name,
+            'Calls': stages[name][0],
+            'Total (s)': round(stages[name][1], 3),
+            'Mean (ms)': round(stages[name][1] / stages[name][0] * 1000, 1) if stages[name][0] else 0.0,
+            'Max (ms)': round(stages[name][2] * 1000, 1),
+            'Share': f"{stages[name][1] / total_seconds:.0%}",
+        } for name in order]
+
+    def render_prometheus(self, prefix_labels=None):
+        """Render in the Prometheus text exposition format (version 0.0.4)."""
+        base = dict(prefix_labels or {})
+
+        def labels(**extra):
+            merged = {**base, **extra}
+            if not merged:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in merged.values())
+            return '{' + ','.join(f'{key}="{value}"' for key, value in zip(merged, escaped)) + '}'
+
+        with self._lock:
+            stages = {name: (entry[0], entry[1], entry[2], list(entry[3])) for name, entry in self.stages.items()}
+            counters = dict(self.counters)
+
+        lines = [
+            "# HELP po_stage_duration_seconds Time spent in each extraction pipeline stage",
+            "# TYPE po_stage_duration_seconds histogram",
+        ]
+        for name in sorted(stages):
+            count, total, _, buckets = stages[name]
+            for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                lines.append(f"po_stage_duration_seconds_bucket{labels(stage=name, le=bound)} {bucket_count}")
+            lines.append(f"po_stage_duration_seconds_bucket{labels(stage=name, le='+Inf')} {count}")
+            lines.append(f"po_stage_duration_seconds_sum{labels(stage=name)} {total:.6f}")
+            lines.append(f"po_stage_duration_seconds_count{labels(stage=name)} {count}")
+
+        for counter, (metric, help_text, label_name) in COUNTERS.items():
+            values = sorted((label, value) for (name, label), value in counters.items() if name == counter)
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            if not values and label_name is None:
+                values = [('', 0)]
+            for label, value in values:
+                lines.append(f"{metric}{labels(**{label_name: label}) if label_name else labels()} {value}")
+        return "\n".join(lines) + "\n"
+
+# Process-wide metrics since start-up
+REGISTRY = StageMetrics()
+
+_current = contextvars.ContextVar('stage_metrics', default=None)
+
+# Function to collect the observations of a block (e.g. one file or one batch) separately
+@contextlib.contextmanager
+def record_stages(metrics=None):
+    """
+    Yields:
+        StageMetrics: Receives every observation made inside the block, in addition
+                      to REGISTRY. Pass an existing instance to keep accumulating.
+    """
+    metrics = metrics if metrics is not None else StageMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+# Function to time a pipeline stage; usable as a context manager or decorator
+@contextlib.contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        count('stage_errors', label=name)
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        REGISTRY.observe(name, seconds)
+        current = _current.get()
+        if current is not None:
+            current.observe(name, seconds)
+
+# Function to compute a percentile (nearest-rank) of a list of numbers
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+# Function to summarize latencies in milliseconds
+def latency_summary(seconds):
+    """
+    Args:
+        seconds (list): Latencies in seconds
+
+    Returns:
+        dict: p50/p95/p99/max/mean in milliseconds (None when there are no samples)
+    """
+    if not seconds:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None, 'mean_ms': None}
+    return {
+        'p50_ms': round(percentile(seconds, 50) * 1000, 3),
+        'p95_ms': round(percentile(seconds, 95) * 1000, 3),
+        'p99_ms': round(percentile(seconds, 99) * 1000, 3),
+        'max_ms': round(max(seconds) * 1000, 3),
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 3),
+    }
+
+# Function to add to a counter in the registry and the current recorder
+def count(counter, value=1, label=''):
+    if not value:
+        return
+    REGISTRY.inc(counter, value, label)
+    current = _current.get()
+    if current is not None:
+        current.inc(counter, value, label)
+
+# Function to record the usage block of a chat-completions response
+def record_usage(usage, retries=0):
+    count('llm_requests')
+    count('llm_retries', retries or 0)
+    if usage is None:
+        return
+    count('prompt_tokens', getattr(usage, 'prompt_tokens', 0) or 0)
+    count('completion_tokens', getattr(usage, 'completion_tokens', 0) or 0)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    count('cached_prompt_tokens', getattr(details, 'cached_tokens', 0) or 0)
+
+# Function to write metrics as a Prometheus text file (e.g. for node_exporter's textfile collector)
+def write_prometheus_file(path, metrics=None):
+    metrics = metrics or REGISTRY
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Write-then-rename so a scraper never reads a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.prom.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(metrics.render_prometheus())
+    os.replace(tmp_path, path)
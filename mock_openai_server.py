@@ -0,0 +1,330 @@
+"""
+Local mock of the Azure OpenAI chat-completions endpoint for benchmarks.
+
+Answers POST .../chat/completions the way the deployment would for the
+synthetic purchase orders written by bench_end_to_end.py: it reads the PO
+text out of the user prompt, extracts the fields with regular expressions and
+returns them as the JSON the real prompts ask for, together with a usage
+block. Latency and failures are configurable so retries, timeouts and
+throughput can be measured without calling Azure. Requests for the deployment
+named by --fast-deployment are answered faster and, at --fast-miss-rate, with
+a field missing, which exercises the escalation in routing.py. Follow-up
+requests for missing fields (followup.py) are answered with just those fields,
+requests for the rest of a cut-off response with the remaining line items,
+and packed requests (packing.py) with one result per document. At
+--stall-rate a request is held for an extra --stall-ms; a request whose client
+disconnects while it waits (a cancelled hedge, see endpoint_pool.py) is
+dropped.
+
+Usage:
+    python mock_openai_server.py --port 8200 --latency-ms 800 --jitter-ms 200 --error-rate 0.05
+    python mock_openai_server.py --fast-deployment gpt-4o-mini --fast-latency-factor 0.3 --fast-miss-rate 0.1
+    python mock_openai_server.py --port 8201 --stall-rate 0.05 --stall-ms 8000
+    AZURE_OPENAI_ENDPOINT=http://localhost:8200/ streamlit run app.py
+"""
+import argparse
+import datetime
+import http.server
+import json
+import random
+import re
+import select
+import socket
+import threading
+import time
+import uuid
+
+PORT = 8200
+
+_FIELD_PATTERNS = {
+    'Customer Name': re.compile(r"^Customer:\s*(.+)$", re.MULTILINE),
+    'Purchase Order Number': re.compile(r"^PO Number:\s*(\S+)", re.MULTILINE),
+    'Required Delivery Date': re.compile(r"^Required Delivery Date:\s*(\d{2})/(\d{2})/(\d{4})", re.MULTILINE),
+    'Delivery Address': re.compile(r"^SHIP TO:\s*(.+)$", re.MULTILINE),
+}
+_LINE_PATTERN = re.compile(r"^\s*(\d+)\s+(\S+)\s+([\d,]+(?:\.\d+)?)\s+KG\b", re.MULTILINE)
+# Document sections of a packed request (see packing.py)
+_DOCUMENT_PATTERN = re.compile(r"^=== DOCUMENT (\d+) ===\n(.*?)\n=== END DOCUMENT \1 ===$", re.MULTILINE | re.DOTALL)
+# Fields a follow-up request asks for (see followup.py)
+_FOLLOWUP_PATTERN = re.compile(r"^- line (\d+): '([^']+)'", re.MULTILINE)
+# Line a continuation request asks to resume after (see followup.py)
+_CONTINUATION_PATTERN = re.compile(r"cut off after line (\d+)")
+
+# Function to extract the PO fields from the synthetic PO text the way the model would
+def mock_extract(pdf_text):
+    """
+    Returns:
+        dict or list: One JSON object per line item (a single object for one line),
+                      or None if the text does not look like a synthetic PO
+    """
+    header = {}
+    for field, pattern in _FIELD_PATTERNS.items():
+        match = pattern.search(pdf_text)
+        if not match:
+            continue
+        if field == 'Required Delivery Date':
+            month, day, year = match.groups()
+            header[field] = f"{year}-{month}-{day}"
+        else:
+            header[field] = match.group(1).strip()
+    lines = []
+    for _, material, quantity in _LINE_PATTERN.findall(pdf_text):
+        # "Order Quantity in kg": clean number, rounded down
+        lines.append({**header, 'Material Number': material,
+                      'Order Quantity in kg': str(int(float(quantity.replace(',', ''))))})
+    if not header or not lines:
+        return None
+    return lines[0] if len(lines) == 1 else lines
+
+# Function to answer a follow-up request for missing fields the way the model would
+def mock_followup(pdf_text, followup_text):
+    """
+    Returns:
+        dict: line number -> {field: value} for the fields asked for
+    """
+    extracted = mock_extract(pdf_text) or []
+    lines = extracted if isinstance(extracted, list) else [extracted]
+    answer = {}
+    for number, field in _FOLLOWUP_PATTERN.findall(followup_text):
+        index = int(number) - 1
+        if index < len(lines) and field in lines[index]:
+            answer.setdefault(number, {})[field] = lines[index][field]
+    return answer
+
+# Function to answer a request for the line items after a cut-off
+def mock_continuation(pdf_text, line_number):
+    extracted = mock_extract(pdf_text) or []
+    lines = extracted if isinstance(extracted, list) else [extracted]
+    return lines[line_number:]
+
+class MockBehaviour:
+    """Latency and failure settings shared by all request threads."""
+
+    def __init__(self, latency_ms=500.0, jitter_ms=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 bad_json_rate=0.0, seed=None, fast_deployment=None, fast_latency_factor=0.4, fast_miss_rate=0.0,
+                 messy_json_rate=0.0, stall_rate=0.0, stall_ms=5000.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.bad_json_rate = bad_json_rate
+        # Valid JSON wrapped in a code fence and with a trailing comma
+        self.messy_json_rate = messy_json_rate
+        # Requests for the fast deployment are quicker but sometimes miss a field
+        self.fast_deployment = fast_deployment
+        self.fast_latency_factor = fast_latency_factor
+        self.fast_miss_rate = fast_miss_rate
+        # Occasional long stalls, as from a busy region, to exercise hedging (endpoint_pool.py)
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'errors': 0, 'rate_limited': 0, 'bad_json': 0, 'messy_json': 0,
+                       'fast': 0, 'fast_missed': 0, 'followups': 0, 'continuations': 0, 'packed': 0, 'stalled': 0, 'cancelled': 0}
+
+    def draw(self, deployment=None):
+        """Pick the outcome and delay of one request."""
+        with self.lock:
+            self.counts['requests'] += 1
+            delay = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000.0 if self.jitter_ms else self.latency_ms / 1000.0
+            roll = self.rng.random()
+            if roll < self.error_rate:
+                outcome = 'errors'
+            elif roll < self.error_rate + self.rate_limit_rate:
+                outcome = 'rate_limited'
+            elif roll < self.error_rate + self.rate_limit_rate + self.bad_json_rate:
+                outcome = 'bad_json'
+            elif roll < self.error_rate + self.rate_limit_rate + self.bad_json_rate + self.messy_json_rate:
+                outcome = 'messy_json'
+            else:
+                outcome = 'ok'
+            if deployment and deployment == self.fast_deployment:
+                self.counts['fast'] += 1
+                delay *= self.fast_latency_factor
+                if outcome == 'ok' and self.rng.random() < self.fast_miss_rate:
+                    outcome = 'fast_missed'
+            if self.stall_rate and self.rng.random() < self.stall_rate:
+                self.counts['stalled'] += 1
+                delay += self.stall_ms / 1000.0
+            if outcome != 'ok':
+                self.counts[outcome] += 1
+            return outcome, delay
+
+class MockOpenAIHandler(http.server.BaseHTTPRequestHandler):
+    behaviour = MockBehaviour()
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status_code, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _wait(self, delay):
+        """Sleep for the response latency; False if the client disconnects meanwhile."""
+        deadline = time.monotonic() + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            readable, _, _ = select.select([self.connection], [], [], remaining)
+            if readable:
+                try:
+                    data = self.connection.recv(1, socket.MSG_PEEK)
+                except OSError:
+                    data = b''
+                if not data:
+                    return False
+                # A pipelined request, not a disconnect
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                return True
+
+    def do_GET(self):
+        # validate_api_key() lists models
+        if self.path.split('?')[0].rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'gpt-4o', 'object': 'model'}]})
+        elif self.path.startswith('/stats'):
+            with self.behaviour.lock:
+                self._send_json(200, dict(self.behaviour.counts))
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.split('?')[0].endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+        try:
+            request = json.loads(body)
+            messages = request['messages']
+        except (ValueError, KeyError):
+            self._send_json(400, {'error': {'message': 'Invalid request body'}})
+            return
+
+        outcome, delay = self.behaviour.draw(request.get('model'))
+        if not self._wait(delay):
+            # The client gave up (e.g. the other hedged request won): stop working on it
+            with self.behaviour.lock:
+                self.behaviour.counts['cancelled'] += 1
+            self.close_connection = True
+            return
+        if outcome == 'errors':
+            self._send_json(500, {'error': {'message': 'Injected server error', 'code': 'internal_error'}})
+            return
+        if outcome == 'rate_limited':
+            self._send_json(429, {'error': {'message': 'Injected rate limit', 'code': '429'}}, {'Retry-After': '1'})
+            return
+
+        prompt_text = "\n".join(str(message.get('content', '')) for message in messages)
+        user_messages = [str(message.get('content', '')) for message in messages if message.get('role') == 'user']
+        continuation = _CONTINUATION_PATTERN.search(user_messages[-1]) if len(user_messages) > 1 else None
+        if continuation:
+            # Continuation of a cut-off response: the line items after the last one kept
+            with self.behaviour.lock:
+                self.behaviour.counts['continuations'] += 1
+            content = json.dumps(mock_continuation(user_messages[0], int(continuation.group(1))))
+        elif len(user_messages) > 1:
+            # Follow-up for missing fields: answer only those
+            with self.behaviour.lock:
+                self.behaviour.counts['followups'] += 1
+            content = json.dumps(mock_followup(user_messages[0], user_messages[-1]))
+        elif _DOCUMENT_PATTERN.search(user_messages[0] if user_messages else ""):
+            # Packed request: one result per document section
+            with self.behaviour.lock:
+                self.behaviour.counts['packed'] += 1
+            content = json.dumps({number: mock_extract(section) or {}
+                                  for number, section in _DOCUMENT_PATTERN.findall(user_messages[0])})
+        else:
+            extracted = mock_extract("\n".join(user_messages))
+            if outcome == 'fast_missed' and extracted is not None:
+                # Leave out the quantity of the first line, as a weaker model might
+                first_line = extracted[0] if isinstance(extracted, list) else extracted
+                first_line.pop('Order Quantity in kg', None)
+            content = json.dumps(extracted) if extracted is not None else "{}"
+        if len(user_messages) <= 1:
+            if outcome == 'bad_json':
+                content = content[:max(1, len(content) // 2)]
+            elif outcome == 'messy_json':
+                content = f"```json\n{content[:-1]},{content[-1]}\n```"
+
+        # Rough token counts (about four characters per token)
+        prompt_tokens = max(1, len(prompt_text) // 4)
+        completion_tokens = max(1, len(content) // 4)
+        self._send_json(200, {
+            'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'gpt-4o'),
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': content},
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+# Function to create (but not start) a mock server
+def create_mock_server(behaviour=None, host="127.0.0.1", port=PORT):
+    """
+    Returns:
+        ThreadingHTTPServer: Call serve_forever() (e.g. in a daemon thread); the
+                             base URL is http://host:server_port/
+    """
+    handler = type('BoundMockOpenAIHandler', (MockOpenAIHandler,), {'behaviour': behaviour or MockBehaviour()})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+# Function to start a mock server in a background thread
+def start_mock_server(behaviour=None, host="127.0.0.1", port=0):
+    """
+    Returns:
+        tuple: (server, base_url)
+    """
+    server = create_mock_server(behaviour, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/"
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Azure OpenAI chat-completions server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument("--bad-json-rate", type=float, default=0.0, help="Fraction of responses with truncated JSON content")
+    parser.add_argument("--messy-json-rate", type=float, default=0.0, help="Fraction of responses fenced and with a trailing comma")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible runs")
+    parser.add_argument("--fast-deployment", help="Deployment name answered as the fast model (see routing.py)")
+    parser.add_argument("--fast-latency-factor", type=float, default=0.4, help="Fast-model latency as a fraction of --latency-ms")
+    parser.add_argument("--fast-miss-rate", type=float, default=0.0, help="Fraction of fast-model answers missing a field")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of requests delayed by an extra --stall-ms")
+    parser.add_argument("--stall-ms", type=float, default=5000.0, help="Extra latency of a stalled request")
+    args = parser.parse_args()
+
+    behaviour = MockBehaviour(args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_rate,
+                              args.bad_json_rate, args.seed, args.fast_deployment, args.fast_latency_factor,
+                              args.fast_miss_rate, args.messy_json_rate, args.stall_rate, args.stall_ms)
+    server = create_mock_server(behaviour, args.host, args.port)
+    print(f"[{datetime.datetime.now():%Y-%m-%d %H:%M:%S}] Mock chat-completions server on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Multi-document request packing for small POs.
+
+Without packing every PO is its own chat-completions request that repeats the
+full instructions. In packing mode, POs whose text is small
+(PACK_MAX_DOCUMENT_TOKENS) are grouped in input order, up to
+PACK_MAX_DOCUMENTS per request and PACK_MAX_TOKENS of PO text. Each group is
+sent once, as delimited sections after the same static instruction prefix
+(prompts.create_packed_prompts). The model answers with one JSON object keyed
+by document number, which is split back into one result per file. A document
+missing from the answer is extracted on its own; fields that fail validation
+are completed by a follow-up request as usual (followup.py). Larger POs are
+extracted on their own.
+
+Packed requests use AZURE_DEPLOYMENT; complexity routing (routing.py) applies
+to the documents extracted on their own.
+
+``packing_summary`` reports requests and prompt tokens saved. The
+pack_baseline_tokens counter holds the prompt tokens the packed documents
+would have used alone, and pack_prompt_tokens what they used. Both are
+estimated at four characters per token and scaled to the token count the API
+reported for the packed request.
+"""
+import os
+
+import api
+from prompts import create_prompts, create_packed_prompts
+from data_processing import process_api_response, clean_delivery_addresses, is_line_item_data
+from processing import pages_to_text, extract_from_pages
+from followup import complete_missing_fields
+from reporting import get_reporter, CollectingReporter
+from metrics import stage, count
+
+# Limits of a packed request
+PACK_MAX_DOCUMENTS = int(os.environ.get("PO_PACK_MAX_DOCUMENTS", 5))
+PACK_MAX_DOCUMENT_TOKENS = int(os.environ.get("PO_PACK_MAX_DOCUMENT_TOKENS", 1500))
+PACK_MAX_TOKENS = int(os.environ.get("PO_PACK_MAX_TOKENS", 6000))
+
+# Function to estimate the prompt tokens of a message list (about four characters per token)
+def estimate_tokens(prompts):
+    return sum(len(message['content']) for message in prompts) // 4
+
+# Function to group documents into packed requests
+def plan_packs(documents):
+    """
+    Args:
+        documents (list): (filename, pages) tuples in input order
+
+    Returns:
+        list: Lists of document indexes; each list is one request
+    """
+    packs = []
+    current = []
+    current_tokens = 0
+    for index, (_, pages) in enumerate(documents):
+        tokens = len(pages_to_text(pages)) // 4
+        if tokens > PACK_MAX_DOCUMENT_TOKENS:
+            packs.append([index])
+            continue
+        if current and (len(current) >= PACK_MAX_DOCUMENTS or current_tokens + tokens > PACK_MAX_TOKENS):
+            packs.append(current)
+            current = []
+            current_tokens = 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+# Function to extract several documents with one packed request
+def extract_pack(documents, openai_api_key, reporter=None):
+    """
+    Args:
+        documents (list): (filename, pages) tuples
+
+    Returns:
+        list: One result per document, in order, as process_single_file returns it
+    """
+    reporter = get_reporter(reporter)
+    if len(documents) == 1:
+        filename, pages = documents[0]
+        return [extract_from_pages(pages, openai_api_key, filename, reporter)]
+
+    pdf_texts = [pages_to_text(pages) for _, pages in documents]
+    with stage('prompt_build'):
+        prompts = create_packed_prompts(pdf_texts)
+        single_prompts = [create_prompts(pdf_text) for pdf_text in pdf_texts]
+
+    answer = {}
+    usage = None
+    try:
+        response, _ = api.chat_completion(openai_api_key, prompts)
+        usage = response.usage
+        content = response.choices[0].message.content
+        # Documents the answer lacks are extracted on their own, so a bad pack is not reported as an error
+        packed = process_api_response(content, f"pack of {len(documents)}", CollectingReporter()) if content else None
+        if packed and isinstance(packed['data'], dict):
+            answer = packed['data']
+            if packed.get('truncated') and answer:
+                # The last document in a cut-off answer may have lost line items; extract it on its own
+                answer.pop(list(answer)[-1])
+    except Exception as e:
+        reporter.warning(f"⚠ Packed request for {len(documents)} POs failed ({e}); extracting them one by one")
+
+    results = []
+    fallback_tokens = 0
+    for number, (filename, pages) in enumerate(documents, start=1):
+        data = answer.get(str(number))
+        # Anything but a non-empty line item or list of line items is extracted again on its own
+        if data and is_line_item_data(data):
+            result = {"filename": filename, "data": clean_delivery_addresses(data)}
+            results.append(complete_missing_fields(result, single_prompts[number - 1], openai_api_key, reporter=reporter))
+        else:
+            count('pack_fallbacks')
+            fallback_tokens += estimate_tokens(single_prompts[number - 1])
+            results.append(extract_from_pages(pages, openai_api_key, filename, reporter))
+
+    if usage is not None:
+        # Scale the character-based estimates to the tokenizer's count for the packed request
+        packed_estimate = estimate_tokens(prompts)
+        scale = (getattr(usage, 'prompt_tokens', 0) or packed_estimate) / max(packed_estimate, 1)
+        count('packed_requests')
+        count('packed_documents', len(documents))
+        count('pack_baseline_tokens', round(sum(estimate_tokens(single) for single in single_prompts) * scale))
+        count('pack_prompt_tokens', round((packed_estimate + fallback_tokens) * scale))
+    return results
+
+# Function to summarize the packing counters of a StageMetrics
+def packing_summary(metrics):
+    """
+    Returns:
+        dict or None: Packed requests and documents, fallbacks, and prompt tokens
+                      with and without packing; None if nothing was packed
+    """
+    requests = metrics.counter('packed_requests')
+    if not requests:
+        return None
+    documents = metrics.counter('packed_documents')
+    baseline_tokens = metrics.counter('pack_baseline_tokens')
+    prompt_tokens = metrics.counter('pack_prompt_tokens')
+    return {
+        'packed_requests': requests,
+        'packed_documents': documents,
+        'requests_saved': documents - requests,
+        'fallbacks': metrics.counter('pack_fallbacks'),
+        'baseline_tokens': baseline_tokens,
+        'prompt_tokens': prompt_tokens,
+        'tokens_saved': baseline_tokens - prompt_tokens,
+    }
+
+# Function to format packing_summary() as one line
+def format_packing_summary(summary):
+    return (f"{summary['packed_documents']} POs in {summary['packed_requests']} requests "
+            f"({summary['requests_saved']} requests saved, {summary['fallbacks']} extracted alone); "
+            f"prompt tokens {summary['prompt_tokens']} vs {summary['baseline_tokens']} "
+            f"(saved {summary['tokens_saved']})")
@@ -1,47 +1,41 @@
-import streamlit as st
-from utils import extract_text_from_pdf, fix_number_format
+from utils import extract_pages_from_pdf, fix_number_format
 from api import extract_data_from_text
 from data_processing import process_api_response
 from prompts import create_prompts
+from routing import routing_enabled, extract_with_routing
+from followup import complete_missing_fields
+from metrics import stage
 
-# Function to process uploaded files
-def process_files(uploaded_files, openai_api_key):
-    # Show a progress indicator
-    with st.spinner("🔍 Processing files... Please wait."):
-        progress_bar = st.progress(0)
-        extracted_data = []
-        total_files = len(uploaded_files)
-
-        for i, pdf_file in enumerate(uploaded_files):
-            # Update progress bar
-            progress_bar.progress((i + 0.5) / total_files)
-            
-            # Reset file pointer for text extraction
-            pdf_file.seek(0)
-            
-            # Extract and clean text from PDF
-            pdf_text = extract_text_from_pdf(pdf_file)
-            pdf_text = fix_number_format(pdf_text)
-
-            # Create prompts using the imported module
-            prompts = create_prompts(pdf_text)
-
-            # Call OpenAI API
-            extract_contents = extract_data_from_text(pdf_text, openai_api_key, prompts)
-            
-            if extract_contents:
-                # Process the API response
-                processed_data = process_api_response(extract_contents, pdf_file.name)
-                if processed_data:
-                    extracted_data.append(processed_data)
-            
-            # Update progress bar to completion for this file
-            progress_bar.progress((i + 1) / total_files)
-
-        # Complete the progress bar
-        progress_bar.progress(1.0)
-        
-        # Show success message
-        st.success(f"✅ Successfully processed {len(extracted_data)} files!")
-
-    return extracted_data
+# Function to run the extraction pipeline for a single PDF
+def process_single_file(pdf_file, openai_api_key, reporter=None, filename=None):
+    # Reset file pointer for text extraction
+    pdf_file.seek(0)
+
+    # Extract text from PDF
+    pages = extract_pages_from_pdf(pdf_file, reporter)
+    return extract_from_pages(pages, openai_api_key, filename or pdf_file.name, reporter)
+
+# Function to join and clean the text of PDF pages
+def pages_to_text(pages):
+    return fix_number_format("".join(page_text + "\n" for page_text in pages))
+
+# Function to run the extraction pipeline on the text of an already parsed PDF
+def extract_from_pages(pages, openai_api_key, filename, reporter=None):
+    pdf_text = pages_to_text(pages)
+
+    # Create prompts using the imported module
+    with stage('prompt_build'):
+        prompts = create_prompts(pdf_text)
+
+    # Send simple POs to the fast deployment when one is configured
+    if routing_enabled():
+        return extract_with_routing(pdf_text, len(pages), openai_api_key, prompts, filename, reporter)
+
+    # Call OpenAI API
+    extract_contents = extract_data_from_text(pdf_text, openai_api_key, prompts, reporter)
+
+    if extract_contents:
+        # Process the API response, then ask again for any missing or invalid fields
+        result = process_api_response(extract_contents, filename, reporter)
+        return complete_missing_fields(result, prompts, openai_api_key, reporter=reporter)
+    return None
@@ -0,0 +1,197 @@
+"""
+Opt-in CPU and allocation profiling of a processing batch.
+
+``profile_batch(name)`` wraps one batch (a background-job run or one
+convert_to_dataframe call) in cProfile, tracemalloc and a stack
+sampler, and saves to PROFILE_DIR:
+
+    <stamp>_<name>_<id>.pstats   cProfile data (pstats, snakeviz, ...)
+    <stamp>_<name>_<id>.txt      report: top functions by cumulative and own
+                                 time, top allocation sites, peak traced memory
+    <stamp>_<name>_<id>.folded   sampled stacks in the folded format read by
+                                 flamegraph.pl, speedscope and inferno
+
+Profiling is off unless PO_PROFILE is set ("1"/"all" for every target, or a
+comma-separated list such as "job,convert_to_dataframe"), or the caller passes
+enabled=True (the app's "Profile next batch" option). When it is off the only
+cost is one set lookup per batch.
+
+cProfile and the sampler follow the thread that entered the block; work
+handed to other threads is not included.
+"""
+import collections
+import contextlib
+import datetime
+import io
+import os
+import sys
+import threading
+import time
+import uuid
+
+# Profiling targets: job, convert_to_dataframe
+PROFILE_TARGETS = {target.strip().lower() for target in os.environ.get("PO_PROFILE", "").split(',') if target.strip()}
+PROFILE_DIR = os.environ.get("PO_PROFILE_DIR", ".profiles")
+# Interval of the stack sampler behind the folded flamegraph output
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PO_PROFILE_INTERVAL_MS", 5)) / 1000.0
+# Rows per section of the text report
+PROFILE_REPORT_ROWS = 40
+# Frames kept per tracemalloc allocation traceback
+TRACEMALLOC_FRAMES = 10
+
+_active = threading.local()
+# Running profiles that need tracemalloc; tracing stops when the last one ends
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started_here = False
+
+# Function to check whether PO_PROFILE turns profiling on for a target
+def profiling_enabled(name):
+    return name in PROFILE_TARGETS or not PROFILE_TARGETS.isdisjoint(('1', 'all', 'true', 'yes'))
+
+class BatchProfile:
+    """cProfile, tracemalloc and a stack sampler around one batch in the current thread."""
+
+    def __init__(self, name, output_dir=None):
+        # Imported here so that importing this module stays free when profiling is off
+        import cProfile
+        self.name = name
+        self.output_dir = output_dir or PROFILE_DIR
+        self.profiler = cProfile.Profile()
+        self.stacks = collections.Counter()
+        self.thread_id = threading.get_ident()
+        self.files = {}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f"profile-sampler-{name}", daemon=True)
+        self._snapshot = None
+        self._started = None
+        self.seconds = None
+        self.traced_peak = None
+
+    def start(self):
+        global _tracing_users, _tracing_started_here
+        import tracemalloc
+        with _tracing_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                _tracing_started_here = True
+            else:
+                # Another batch is already tracing; the peak then covers both
+                tracemalloc.reset_peak()
+            _tracing_users += 1
+            self._snapshot = tracemalloc.take_snapshot()
+        self._started = time.perf_counter()
+        self._sampler.start()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one cProfile per process; keep the sampler and tracemalloc data
+            self.profiler = None
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.seconds = time.perf_counter() - self._started
+        self._stop.set()
+        self._sampler.join()
+        global _tracing_users, _tracing_started_here
+        import tracemalloc
+        with _tracing_lock:
+            self.traced_peak = tracemalloc.get_traced_memory()[1]
+            # Leave out the profiler's own allocations
+            own_files = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            self.allocations = tracemalloc.take_snapshot().filter_traces(own_files).compare_to(
+                self._snapshot.filter_traces(own_files), 'lineno')
+            _tracing_users -= 1
+            if _tracing_users == 0 and _tracing_started_here:
+                tracemalloc.stop()
+                _tracing_started_here = False
+
+    def _sample(self):
+        while not self._stop.wait(PROFILE_SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = getattr(code, 'co_qualname', code.co_name)
+                stack.append(f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def save(self):
+        """
+        Returns:
+            dict: 'pstats', 'report' and 'folded' -> written file paths
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        prefix = os.path.join(self.output_dir, f"{stamp}_{self.name}_{uuid.uuid4().hex[:8]}")
+
+        if self.profiler is not None:
+            self.files['pstats'] = prefix + ".pstats"
+            self.profiler.dump_stats(self.files['pstats'])
+
+        self.files['folded'] = prefix + ".folded"
+        with open(self.files['folded'], 'w') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f"{stack} {samples}\n")
+
+        self.files['report'] = prefix + ".txt"
+        with open(self.files['report'], 'w') as f:
+            f.write(self.render_report())
+        return self.files
+
+    def render_report(self):
+        import pstats
+        buffer = io.StringIO()
+        buffer.write(f"Profile of {self.name}\n")
+        buffer.write(f"Wall time:          {self.seconds:.3f} s\n")
+        buffer.write(f"Stack samples:      {sum(self.stacks.values())} every {PROFILE_SAMPLE_INTERVAL * 1000:.0f} ms\n")
+        buffer.write(f"Peak traced memory: {self.traced_peak / (1024 * 1024):.1f} MB\n")
+        buffer.write(f"cProfile data:      {self.files.get('pstats')} (e.g. python -m pstats, snakeviz)\n")
+        buffer.write(f"Folded stacks:      {self.files.get('folded')} (flamegraph.pl, speedscope)\n")
+
+        if self.profiler is None:
+            buffer.write("\ncProfile was unavailable (another batch was being profiled); see the folded stacks.\n")
+        else:
+            for sort_key, title in (('cumulative', "cumulative time"), ('tottime', "own time")):
+                buffer.write(f"\n===== Top {PROFILE_REPORT_ROWS} functions by {title} =====\n")
+                stats = pstats.Stats(self.profiler, stream=buffer)
+                stats.strip_dirs().sort_stats(sort_key).print_stats(PROFILE_REPORT_ROWS)
+
+        buffer.write(f"\n===== Top {PROFILE_REPORT_ROWS} allocation sites (net growth during the batch) =====\n")
+        for stat in self.allocations[:PROFILE_REPORT_ROWS]:
+            buffer.write(f"{stat}\n")
+        return buffer.getvalue()
+
+# Function to profile a batch when profiling is switched on
+@contextlib.contextmanager
+def profile_batch(name, enabled=False, output_dir=None):
+    """
+    Args:
+        name (str): Target name, also used in the file names (see PROFILE_TARGETS)
+        enabled (bool): Profile even if PO_PROFILE does not select this target
+
+    Yields:
+        BatchProfile or None: The running profile (its ``files`` are filled in on exit),
+                              or None when profiling is off
+    """
+    # cProfile allows one active profiler per thread, so nested batches are not profiled again
+    if not (enabled or profiling_enabled(name)) or getattr(_active, 'profile', None) is not None:
+        yield None
+        return
+
+    profile = BatchProfile(name, output_dir)
+    _active.profile = profile
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _active.profile = None
+        try:
+            paths = profile.save()
+            print(f"Profile of {name} ({profile.seconds:.1f}s) saved to {paths['report']}")
+        except OSError as e:
+            print(f"Could not save the profile of {name}: {e}")
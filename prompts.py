@@ -26,19 +26,38 @@ def get_multi_line_prompt():
         "\n\nIMPORTANT: Format the Delivery Address as a single line with spaces instead of line breaks."
     )
 
+def get_packing_prompt():
+    return (
+        "The user message contains several purchase orders. Each one starts with a line '=== DOCUMENT n ===' "
+        "and ends with a line '=== END DOCUMENT n ==='. Extract every document on its own, following the instructions above. "
+        "Return ONLY a valid JSON object that maps each document number (as a string) to that document's result: "
+        "a JSON object if it has one line, or a JSON array if it has several. Include every document number exactly once."
+    )
+
+def get_static_prefix():
+    # Static instructions lead every request, so the provider can cache them as a shared prompt prefix
+    return [
+        {"role": "system", "content": get_system_message()},
+        {"role": "system", "content": get_multi_line_prompt()},
+    ]
+
 def create_prompts(pdf_text):
-    system_message = get_system_message()
     user_prompt = f"Extract relevant details from the following purchase order:\n{pdf_text}"
     
-    prompts = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": user_prompt},
-    ]
+    prompts = get_static_prefix()
+    prompts.append({"role": "user", "content": user_prompt})
+    
+    return prompts
+
+def create_packed_prompts(pdf_texts):
+    sections = "\n".join(
+        f"=== DOCUMENT {number} ===\n{pdf_text.strip()}\n=== END DOCUMENT {number} ==="
+        for number, pdf_text in enumerate(pdf_texts, start=1)
+    )
+    user_prompt = f"Extract relevant details from each of the following purchase orders:\n{sections}"
     
-    # Add multi-line prompt
-    prompts.append({
-        "role": "system",
-        "content": get_multi_line_prompt()
-    })
+    prompts = get_static_prefix()
+    prompts.append({"role": "system", "content": get_packing_prompt()})
+    prompts.append({"role": "user", "content": user_prompt})
     
     return prompts
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""
+Reporter interface for user-facing messages and progress.
+
+The extraction pipeline reports through a Reporter instead of calling st.*
+directly, so the same code runs in the Streamlit app, background jobs and
+headless tools. Functions take an optional ``reporter`` argument; when it is
+omitted, get_reporter() falls back to the process default, which is the
+Streamlit reporter unless set_default_reporter() was called.
+"""
+import contextlib
+import sys
+import threading
+
+class Reporter:
+    """Base reporter that ignores every message."""
+
+    def error(self, message):
+        pass
+
+    def warning(self, message):
+        pass
+
+    def info(self, message):
+        pass
+
+    def success(self, message):
+        pass
+
+    def code(self, text, language=None):
+        pass
+
+    def progress(self, fraction, text=None):
+        pass
+
+    @contextlib.contextmanager
+    def spinner(self, message):
+        yield
+
+class StreamlitReporter(Reporter):
+    """Reports into the running Streamlit script (imported lazily)."""
+
+    def __init__(self):
+        import streamlit as st
+        self._st = st
+        self._progress_bar = None
+
+    def error(self, message):
+        self._st.error(message)
+
+    def warning(self, message):
+        self._st.warning(message)
+
+    def info(self, message):
+        self._st.info(message)
+
+    def success(self, message):
+        self._st.success(message)
+
+    def code(self, text, language=None):
+        self._st.code(text, language=language)
+
+    def progress(self, fraction, text=None):
+        if self._progress_bar is None:
+            self._progress_bar = self._st.progress(0)
+        self._progress_bar.progress(min(max(fraction, 0.0), 1.0), text=text)
+
+    @contextlib.contextmanager
+    def spinner(self, message):
+        with self._st.spinner(message):
+            yield
+
+class ConsoleReporter(Reporter):
+    """Prints messages to stderr; used by command-line tools."""
+
+    def __init__(self, stream=None, show_progress=False):
+        self._stream = stream or sys.stderr
+        self._show_progress = show_progress
+        self._lock = threading.Lock()
+
+    def _write(self, prefix, message):
+        with self._lock:
+            print(f"{prefix} {message}", file=self._stream, flush=True)
+
+    def error(self, message):
+        self._write("[ERROR]", message)
+
+    def warning(self, message):
+        self._write("[WARN]", message)
+
+    def info(self, message):
+        self._write("[INFO]", message)
+
+    def success(self, message):
+        self._write("[OK]", message)
+
+    def code(self, text, language=None):
+        self._write("", text)
+
+    def progress(self, fraction, text=None):
+        if self._show_progress:
+            self._write("[PROGRESS]", f"{fraction:.0%}" + (f" {text}" if text else ""))
+
+class CollectingReporter(Reporter):
+    """Keeps errors and warnings in memory, e.g. to persist them with a background job."""
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+
+    def error(self, message):
+        self.errors.append(message)
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+_default_reporter = None
+
+# Function to set the reporter used when callers do not pass one
+def set_default_reporter(reporter):
+    global _default_reporter
+    _default_reporter = reporter
+
+# Function to resolve the reporter for a call
+def get_reporter(reporter=None):
+    if reporter is not None:
+        return reporter
+    if _default_reporter is not None:
+        return _default_reporter
+    return StreamlitReporter()
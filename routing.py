@@ -0,0 +1,246 @@
+"""
+Complexity-based routing between a fast and a full model deployment.
+
+Every PO used to go to AZURE_DEPLOYMENT. When AZURE_OPENAI_FAST_DEPLOYMENT
+names a cheaper, lower-latency deployment, ``extract_with_routing`` first
+estimates how hard the document is from its extracted text:
+
+    pages         pages in the PDF
+    line density  rows that look like order lines (item number ... quantity UOM) per page
+    tokens        prompt size, estimated at four characters per token
+
+Documents within all three limits go to the fast deployment. Its answer is
+accepted only if it parses, every line item has the fields and formats the
+prompts ask for (data_processing.validate_line_item) and the customer name
+matches the customer master; otherwise the file is escalated to the full
+deployment and the fast answer is discarded. Everything else goes straight to
+the full deployment.
+
+Every routed file adds its spend and completion time to the llm_cost_usd and
+llm_seconds counters, and what the full deployment alone would have taken to
+baseline_cost_usd and baseline_seconds, so ``routing_savings`` can report the
+cost and latency saved for a file, a batch (record_stages) or the process.
+The full-deployment time of a file the fast deployment handled is estimated
+from the latency ratio seen on escalated files, which ran on both.
+
+Limits and prices are read from the environment:
+    PO_ROUTER_MAX_PAGES, PO_ROUTER_MAX_LINE_DENSITY, PO_ROUTER_MAX_TOKENS,
+    PO_ROUTER_LATENCY_FACTOR, PO_ROUTER_PRICES (JSON: deployment -> [input, output] USD per 1M tokens)
+"""
+import json
+import os
+import re
+import threading
+import time
+
+import api
+from data_processing import process_api_response, validate_line_item
+from followup import complete_missing_fields
+from utils import load_customer_master_data, find_customer_number
+from reporting import get_reporter, CollectingReporter
+from metrics import count
+
+# Complexity limits for the fast deployment
+FAST_MAX_PAGES = int(os.environ.get("PO_ROUTER_MAX_PAGES", 2))
+FAST_MAX_LINE_DENSITY = float(os.environ.get("PO_ROUTER_MAX_LINE_DENSITY", 5))
+FAST_MAX_TOKENS = int(os.environ.get("PO_ROUTER_MAX_TOKENS", 3000))
+# Full / fast completion time assumed until enough escalations have been timed
+DEFAULT_LATENCY_FACTOR = float(os.environ.get("PO_ROUTER_LATENCY_FACTOR", 2.0))
+MIN_LATENCY_SAMPLES = 3
+
+# USD per 1M (input, output) tokens; unknown deployments are priced like gpt-4o
+DEPLOYMENT_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+}
+
+# Function to parse PO_ROUTER_PRICES; a malformed value is ignored so importing the pipeline never fails
+def _load_price_overrides(value):
+    try:
+        overrides = json.loads(value or "{}")
+        prices = {}
+        for name, (input_price, output_price) in overrides.items():
+            prices[name] = (float(input_price), float(output_price))
+        return prices
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"Ignoring PO_ROUTER_PRICES ({e}); expected JSON like {{\"my-deployment\": [0.15, 0.60]}}")
+        return {}
+
+DEPLOYMENT_PRICES.update(_load_price_overrides(os.environ.get("PO_ROUTER_PRICES")))
+DEFAULT_PRICE = DEPLOYMENT_PRICES['gpt-4o']
+
+ROUTES = ('fast', 'full', 'escalated')
+
+# A row that starts with an item number and carries a quantity with a unit of measure
+_LINE_ITEM_PATTERN = re.compile(
+    r"^\s*\d{1,6}\s+\S+.*?\b\d[\d,]*(?:\.\d+)?\s*(?:KGS?|LBS?|EA|PCS?|MT|TONS?|G|L|GAL)\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# (fast seconds, full seconds) summed over escalated files
+_latency_lock = threading.Lock()
+_escalation_latency = [0.0, 0.0, 0]
+
+# Function to check whether a fast deployment is configured
+def routing_enabled():
+    return bool(api.AZURE_FAST_DEPLOYMENT)
+
+# Function to estimate how hard a PO is to extract
+def estimate_complexity(pdf_text, page_count):
+    """
+    Returns:
+        dict: pages, line_items, line_density (line items per page), tokens
+    """
+    pages = max(page_count, 1)
+    line_items = len(_LINE_ITEM_PATTERN.findall(pdf_text))
+    return {
+        'pages': page_count,
+        'line_items': line_items,
+        'line_density': round(line_items / pages, 2),
+        'tokens': len(pdf_text) // 4,
+    }
+
+# Function to decide whether a PO is simple enough for the fast deployment
+def is_simple(complexity):
+    return (complexity['pages'] <= FAST_MAX_PAGES
+            and complexity['line_density'] <= FAST_MAX_LINE_DENSITY
+            and complexity['tokens'] <= FAST_MAX_TOKENS)
+
+# Function to check an extraction result against the schema and the customer master
+def validate_extraction(result, customer_master_data=None):
+    """
+    Returns:
+        list: Problems found; empty if the result can be used
+    """
+    if not result:
+        return ["no valid JSON"]
+    if result.get('truncated'):
+        return ["response cut off"]
+    data = result['data']
+    line_items = data if isinstance(data, list) else [data]
+    if not line_items:
+        return ["no line items"]
+
+    problems = []
+    for number, line_item in enumerate(line_items, start=1):
+        problems += [f"line {number}: {field} {problem}" for field, problem in validate_line_item(line_item).items()]
+    if problems:
+        return problems
+
+    # Master-data check: the customer must be one we can assign a customer number to
+    if customer_master_data is None:
+        customer_master_data = load_customer_master_data()
+    if customer_master_data:
+        for customer_name in {line_item['Customer Name'] for line_item in line_items}:
+            customer_number, _ = find_customer_number(customer_name, customer_master_data)
+            if not customer_number:
+                problems.append(f"customer '{customer_name}' not in the customer master")
+    return problems
+
+# Function to estimate the cost of one completion
+def completion_cost(deployment, usage):
+    if usage is None:
+        return 0.0
+    input_price, output_price = DEPLOYMENT_PRICES.get(deployment, DEFAULT_PRICE)
+    return ((getattr(usage, 'prompt_tokens', 0) or 0) * input_price
+            + (getattr(usage, 'completion_tokens', 0) or 0) * output_price) / 1_000_000
+
+# Function to estimate full / fast completion time from the escalated files
+def latency_factor():
+    with _latency_lock:
+        fast_seconds, full_seconds, samples = _escalation_latency
+    if samples >= MIN_LATENCY_SAMPLES and fast_seconds > 0:
+        return full_seconds / fast_seconds
+    return DEFAULT_LATENCY_FACTOR
+
+# Function to run one extraction attempt on a deployment
+def _attempt(deployment, openai_api_key, prompts, filename, reporter):
+    """
+    Returns:
+        tuple: (result or None, usage or None, seconds)
+    """
+    started = time.perf_counter()
+    try:
+        response, seconds = api.chat_completion(openai_api_key, prompts, deployment)
+    except Exception as e:
+        reporter.error(f"⚠ Error calling OpenAI API: {e}")
+        return None, None, time.perf_counter() - started
+    content = response.choices[0].message.content
+    result = process_api_response(content, filename, reporter) if content else None
+    return result, response.usage, seconds
+
+# Function to extract a PO on the fast deployment if it is simple, escalating to the full one when needed
+def extract_with_routing(pdf_text, page_count, openai_api_key, prompts, filename, reporter=None):
+    """
+    Returns:
+        dict or None: {"filename": ..., "data": ...} as returned by process_api_response
+    """
+    reporter = get_reporter(reporter)
+    fast_deployment = api.AZURE_FAST_DEPLOYMENT
+    full_deployment = api.AZURE_DEPLOYMENT
+    complexity = estimate_complexity(pdf_text, page_count)
+
+    escalated = False
+    if is_simple(complexity):
+        # Failures of the fast attempt are handled by escalating, so they are not shown to the user
+        result, usage, fast_seconds = _attempt(fast_deployment, openai_api_key, prompts, filename, CollectingReporter())
+        fast_cost = completion_cost(fast_deployment, usage)
+        count('llm_cost_usd', fast_cost, label=fast_deployment)
+        count('llm_seconds', fast_seconds, label=fast_deployment)
+        problems = validate_extraction(result)
+        if not problems:
+            count('routed_files', label='fast')
+            # Same tokens at the full deployment's price and estimated speed
+            count('baseline_cost_usd', completion_cost(full_deployment, usage))
+            count('baseline_seconds', fast_seconds * latency_factor())
+            return result
+        reporter.info(f"Escalating {filename} to {full_deployment}: {'; '.join(problems[:3])}")
+        escalated = True
+
+    result, usage, full_seconds = _attempt(full_deployment, openai_api_key, prompts, filename, reporter)
+    full_cost = completion_cost(full_deployment, usage)
+    count('routed_files', label='escalated' if escalated else 'full')
+    count('llm_cost_usd', full_cost, label=full_deployment)
+    count('llm_seconds', full_seconds, label=full_deployment)
+    count('baseline_cost_usd', full_cost)
+    count('baseline_seconds', full_seconds)
+    if escalated and usage is not None:
+        with _latency_lock:
+            _escalation_latency[0] += fast_seconds
+            _escalation_latency[1] += full_seconds
+            _escalation_latency[2] += 1
+    return complete_missing_fields(result, prompts, openai_api_key, full_deployment, reporter)
+
+# Function to summarize the routing counters of a StageMetrics
+def routing_savings(metrics):
+    """
+    Returns:
+        dict or None: Files per route, spend and completion time with routing and
+                      for the full deployment alone, and the savings; None if no
+                      file was routed
+    """
+    files = {route: metrics.counter('routed_files', route) for route in ROUTES}
+    if not any(files.values()):
+        return None
+    cost = metrics.counter('llm_cost_usd')
+    baseline_cost = metrics.counter('baseline_cost_usd')
+    seconds = metrics.counter('llm_seconds')
+    baseline_seconds = metrics.counter('baseline_seconds')
+    return {
+        'files': files,
+        'cost_usd': round(cost, 4),
+        'baseline_cost_usd': round(baseline_cost, 4),
+        'cost_saved_usd': round(baseline_cost - cost, 4),
+        'seconds': round(seconds, 2),
+        'baseline_seconds': round(baseline_seconds, 2),
+        'seconds_saved': round(baseline_seconds - seconds, 2),
+    }
+
+# Function to format routing_savings() as one line
+def format_routing_savings(savings):
+    files = savings['files']
+    return (f"{files['fast']} fast, {files['full']} full, {files['escalated']} escalated; "
+            f"cost ${savings['cost_usd']:.4f} vs ${savings['baseline_cost_usd']:.4f} "
+            f"(saved ${savings['cost_saved_usd']:.4f}); "
+            f"completion time {savings['seconds']:.1f}s vs {savings['baseline_seconds']:.1f}s "
+            f"(saved {savings['seconds_saved']:.1f}s)")
@@ -2,9 +2,16 @@ import http.server
 import socketserver
 import json
 import logging
+import logging.handlers
+import atexit
+import contextlib
 import os
+import queue
+import uuid
+import zlib
 from urllib.parse import urlparse, parse_qs
 import xml.etree.ElementTree as ET
+from idoc_store import IDOC_DB_FILE, connect_idoc_store, insert_idoc_records, query_idoc_records
 
 # File paths
 LOG_FILE = "sap_endpoint.log"
@@ -22,24 +29,119 @@ def reset_log_files():
     
     print(f"Log files {LOG_FILE} and {XML_FILE} have been reset")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
+# Logging verbosity levels
+VERBOSITY_MINIMAL = 0  # One summary line per request, no XML log file
+VERBOSITY_SUMMARY = 1  # Plus one key-field line per IDOC
+VERBOSITY_FULL = 2     # Plus the full XML of every IDOC and the complete XML log file
+VERBOSITY_LEVELS = {'minimal': VERBOSITY_MINIMAL, 'summary': VERBOSITY_SUMMARY, 'full': VERBOSITY_FULL}
+
+# Logging configuration (overridable through the environment)
+LOG_VERBOSITY = VERBOSITY_LEVELS.get(os.environ.get("SAP_ENDPOINT_LOG_VERBOSITY", "full").lower(), VERBOSITY_FULL)
+LOG_MAX_BYTES = int(os.environ.get("SAP_ENDPOINT_LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("SAP_ENDPOINT_LOG_BACKUP_COUNT", 5))
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
 logger = logging.getLogger("SAP-Endpoint")
+_log_listener = None
+
+# Function to configure asynchronous, size-rotated logging
+def setup_logging(verbosity=None, log_file=None, max_bytes=None, backup_count=None, console=True):
+    """
+    Route all log records through a queue so request threads never block on disk I/O.
+
+    A QueueListener thread drains the queue into a RotatingFileHandler (and the
+    console). Calling this again replaces the previous configuration.
+
+    Args:
+        verbosity (int|str): One of VERBOSITY_LEVELS (name or value); defaults to LOG_VERBOSITY
+        log_file (str): Log file path; defaults to LOG_FILE
+        max_bytes (int): Size at which the log file is rotated
+        backup_count (int): Number of rotated files to keep
+        console (bool): Also echo records to stderr
+
+    Returns:
+        logging.handlers.QueueListener: The running listener
+    """
+    global _log_listener, LOG_VERBOSITY
+
+    if isinstance(verbosity, str):
+        if verbosity.lower() not in VERBOSITY_LEVELS:
+            raise ValueError(f"Unknown verbosity '{verbosity}', expected one of {', '.join(VERBOSITY_LEVELS)}")
+        verbosity = VERBOSITY_LEVELS[verbosity.lower()]
+    if verbosity is not None:
+        LOG_VERBOSITY = verbosity
+    stop_logging()
 
-# Reset log files on startup
-reset_log_files()
-logger.info("SAP Endpoint server starting - log files reset")
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file or LOG_FILE,
+        maxBytes=max_bytes if max_bytes is not None else LOG_MAX_BYTES,
+        backupCount=backup_count if backup_count is not None else LOG_BACKUP_COUNT
+    )
+    file_handler.setFormatter(formatter)
+    handlers = [file_handler]
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+        handlers.append(stream_handler)
+
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root_logger.setLevel(logging.INFO)
+
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    return _log_listener
+
+# Function to flush and stop the logging listener
+def stop_logging():
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+atexit.register(stop_logging)
 
 # Define the port
 PORT = 8000
 
+# Size of each read from the request body; bounds per-request memory
+READ_CHUNK_SIZE = 64 * 1024
+# Upper bound for a chunked transfer-encoding size line
+MAX_CHUNK_LINE = 1024
+# Number of IDOC records buffered before a batch insert into the store
+STORE_BATCH_SIZE = 500
+
+# Function to extract the key fields from a single IDOC element
+def extract_idoc_fields(idoc):
+    """
+    Extract the key fields of an IDOC element.
+
+    Args:
+        idoc (xml.etree.ElementTree.Element): IDOC element
+
+    Returns:
+        dict: PO number, customer, part number, quantity, delivery date and currency
+              (None for any field that is missing)
+    """
+    def find_text(path):
+        elem = idoc.find(path)
+        return elem.text if elem is not None and elem.text else None
+
+    return {
+        'idoc_id': idoc.get('BEGIN'),
+        'po_number': find_text('.//E1EDK02/BELNR'),
+        'customer': find_text('.//E1EDKA1/PARTN'),
+        # Customer part (QUALF 001); a second E1EDP19 may carry the SAP material (QUALF 002)
+        'part_number': find_text(".//E1EDP19[QUALF='001']/IDTNR") or find_text('.//E1EDP19/IDTNR'),
+        'quantity': find_text('.//E1EDP01/MENGE'),
+        'delivery_date': find_text('.//E1EDK02/DATUM'),
+        'currency': find_text('.//E1EDK01/CURRENCY'),
+    }
+
 class SAPEndpointHandler(http.server.BaseHTTPRequestHandler):
     def _set_response(self, status_code=200, content_type='application/json'):
         self.send_response(status_code)
@@ -54,121 +156,263 @@ class SAPEndpointHandler(http.server.BaseHTTPRequestHandler):
         self._set_response()
     
     def do_GET(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path.rstrip('/') == '/idocs':
+            self._query_idocs(parse_qs(parsed_url.query))
+            return
+
         # Simple status endpoint
         self._set_response()
         response = {'status': 'SAP Endpoint is running', 'message': 'Use POST to send IDoc-XML data'}
         self.wfile.write(json.dumps(response).encode('utf-8'))
         logger.info(f"GET request received at {self.path}")
+
+    # Query API over the IDoc store:
+    # GET /idocs?po_number=..&customer=..&date_from=YYYYMMDD&date_to=YYYYMMDD&limit=N
+    # po_number and customer may be repeated (or comma-separated) to look up many at once
+    def _query_idocs(self, params):
+        def multi(name):
+            values = []
+            for value in params.get(name, []):
+                values.extend(v.strip() for v in value.split(',') if v.strip())
+            return values
+
+        try:
+            conn = connect_idoc_store(IDOC_DB_FILE)
+            try:
+                results = query_idoc_records(
+                    conn,
+                    po_numbers=multi('po_number'),
+                    customers=multi('customer'),
+                    date_from=params.get('date_from', [None])[0],
+                    date_to=params.get('date_to', [None])[0],
+                    limit=params.get('limit', [1000])[0]
+                )
+            finally:
+                conn.close()
+        except ValueError as e:
+            self._set_response(400)
+            response = {'status': 'error', 'message': f'Invalid query: {str(e)}'}
+            self.wfile.write(json.dumps(response).encode('utf-8'))
+            return
+
+        self._set_response()
+        response = {'status': 'success', 'count': len(results), 'results': results}
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+        logger.info(f"IDoc query at {self.path} returned {len(results)} rows")
     
+    # Generator that yields the raw request body in chunks, honouring
+    # chunked transfer encoding and Content-Length framing
+    def _iter_body_chunks(self):
+        transfer_encoding = self.headers.get('Transfer-Encoding', '').lower()
+        if 'chunked' in transfer_encoding:
+            while True:
+                # Chunk size line, optionally followed by chunk extensions
+                size_line = self.rfile.readline(MAX_CHUNK_LINE + 1)
+                if len(size_line) > MAX_CHUNK_LINE:
+                    raise ValueError("Chunk size line too long")
+                chunk_size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+                if chunk_size == 0:
+                    # Consume optional trailers up to the terminating blank line
+                    while self.rfile.readline(MAX_CHUNK_LINE + 1) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                remaining = chunk_size
+                while remaining > 0:
+                    data = self.rfile.read(min(remaining, READ_CHUNK_SIZE))
+                    if not data:
+                        raise ValueError("Unexpected end of chunked body")
+                    remaining -= len(data)
+                    yield data
+                # Each chunk is terminated by CRLF
+                self.rfile.readline(MAX_CHUNK_LINE + 1)
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                data = self.rfile.read(min(remaining, READ_CHUNK_SIZE))
+                if not data:
+                    raise ValueError("Unexpected end of request body")
+                remaining -= len(data)
+                yield data
+
+    # Generator that yields the decoded request body, inflating gzip on the fly
+    def _iter_decoded_body(self):
+        content_encoding = self.headers.get('Content-Encoding', '').lower()
+        if content_encoding in ('gzip', 'x-gzip'):
+            # 16 + MAX_WBITS tells zlib to expect a gzip header and trailer
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            for chunk in self._iter_body_chunks():
+                data = decompressor.decompress(chunk, READ_CHUNK_SIZE)
+                while data:
+                    yield data
+                    # Drain any output held back by the max_length limit
+                    data = decompressor.decompress(decompressor.unconsumed_tail, READ_CHUNK_SIZE)
+            tail = decompressor.flush()
+            if tail:
+                yield tail
+            if not decompressor.eof:
+                raise zlib.error("Truncated gzip body")
+        elif content_encoding in ('', 'identity'):
+            yield from self._iter_body_chunks()
+        else:
+            raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+
+    # Send the default per-request access line through the async logger instead of stderr
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+    # Extract the key fields of a single IDOC element and log them per LOG_VERBOSITY
+    def _log_idoc(self, idx, idoc):
+        fields = extract_idoc_fields(idoc)
+        if LOG_VERBOSITY < VERBOSITY_SUMMARY:
+            return fields
+
+        idoc_id = fields['idoc_id'] or f'Unknown-{idx}'
+        if LOG_VERBOSITY < VERBOSITY_FULL:
+            # One compact line per IDOC
+            logger.info(
+                f"IDOC {idx+1} - ID: {idoc_id} - PO: {fields['po_number'] or 'N/A'}, "
+                f"Customer: {fields['customer'] or 'N/A'}, Part: {fields['part_number'] or 'N/A'}, "
+                f"Qty: {fields['quantity'] or 'N/A'}, Date: {fields['delivery_date'] or 'N/A'}, "
+                f"Currency: {fields['currency'] or 'N/A'}"
+            )
+            return fields
+
+        logger.info(f"IDOC {idx+1} - ID: {idoc_id}")
+
+        # Log the entire IDOC structure
+        logger.info(f"  IDOC XML Structure:")
+
+        # Convert IDOC element to string and log it
+        idoc_str = ET.tostring(idoc, encoding='unicode')
+        logger.info(f"  {idoc_str}")
+
+        # Also log specific fields for quick reference
+        logger.info(f"  Key Fields Summary:")
+        logger.info(f"    PO Number: {fields['po_number'] or 'N/A'}")
+        logger.info(f"    Customer: {fields['customer'] or 'N/A'}")
+        logger.info(f"    Part Number: {fields['part_number'] or 'N/A'}")
+        logger.info(f"    Quantity: {fields['quantity'] or 'N/A'}")
+        logger.info(f"    Delivery Date: {fields['delivery_date'] or 'N/A'}")
+        logger.info(f"    Currency: {fields['currency'] or 'N/A'}")
+        return fields
+
     def do_POST(self):
-        # Reset log files for each new request
-        reset_log_files()
-        logger.info("Log files reset for new request")
-        
-        # Get content length
-        content_length = int(self.headers['Content-Length'])
-        # Read the data
-        post_data = self.rfile.read(content_length)
-        
         # Parse the URL to get query parameters
         parsed_url = urlparse(self.path)
         params = parse_qs(parsed_url.query)
-        
+
         # Log the received data
         logger.info(f"POST request received at {self.path}")
         logger.info(f"Query parameters: {params}")
-        
-        # Check if it's XML data
+
+        # Parse the body incrementally so memory stays flat regardless of payload size
+        request_id = uuid.uuid4().hex
+        conn = connect_idoc_store(IDOC_DB_FILE)
         try:
-            # Try to parse as XML
-            xml_data = post_data.decode('utf-8')
-            root = ET.fromstring(xml_data)
-            
-            # Log a message about receiving XML
-            logger.info("Received XML data (see sap_endpoint_xml.log for complete XML)")
-            
-            # Write the complete XML to a separate file
-            with open(XML_FILE, 'w') as f:
-                f.write(xml_data)
-            
+            parser = ET.XMLPullParser(events=('start', 'end'))
+            # Stack of currently open elements, used to detach finished IDOCs from their parent
+            open_elements = []
+            idoc_count = 0
+            received_bytes = 0
+            # Key fields waiting to be batch-inserted into the store
+            pending_records = []
+
+            # The complete XML is only kept (overwritten per request) at full verbosity
+            if LOG_VERBOSITY >= VERBOSITY_FULL:
+                logger.info(f"Receiving XML data (see {XML_FILE} for complete XML)")
+                xml_log = open(XML_FILE, 'wb')
+            else:
+                xml_log = contextlib.nullcontext()
+
+            # Write the complete XML to a separate file as it streams in
+            with xml_log as xml_out:
+                for data in self._iter_decoded_body():
+                    received_bytes += len(data)
+                    if xml_out is not None:
+                        xml_out.write(data)
+                    parser.feed(data)
+                    for event, elem in parser.read_events():
+                        if event == 'start':
+                            open_elements.append(elem)
+                            continue
+                        open_elements.pop()
+                        if elem.tag != 'IDOC':
+                            continue
+                        pending_records.append(self._log_idoc(idoc_count, elem))
+                        idoc_count += 1
+                        if len(pending_records) >= STORE_BATCH_SIZE:
+                            insert_idoc_records(conn, pending_records, request_id)
+                            pending_records = []
+                        # Release the processed IDOC so the tree never grows
+                        elem.clear()
+                        if open_elements:
+                            open_elements[-1].remove(elem)
+                parser.close()
+
+            # Store the remaining records; the whole POST is committed as one transaction
+            insert_idoc_records(conn, pending_records, request_id)
+            conn.commit()
+
             # Count the number of IDOCs
-            idocs = root.findall('.//IDOC')
-            idoc_count = len(idocs)
-            logger.info(f"Number of IDOCs in XML: {idoc_count}")
-            
-            # Log information about each IDOC
-            for idx, idoc in enumerate(idocs):
-                idoc_id = idoc.get('BEGIN', f'Unknown-{idx}')
-                logger.info(f"IDOC {idx+1}/{idoc_count} - ID: {idoc_id}")
-                
-                # Log the entire IDOC structure
-                logger.info(f"  IDOC XML Structure:")
-                
-                # Convert IDOC element to string and log it
-                idoc_str = ET.tostring(idoc, encoding='unicode')
-                logger.info(f"  {idoc_str}")
-                
-                # Also log specific fields for quick reference
-                logger.info(f"  Key Fields Summary:")
-                
-                # Try to extract PO number
-                po_elem = idoc.find('.//E1EDK02/BELNR')
-                po_number = po_elem.text if po_elem is not None and po_elem.text else "N/A"
-                logger.info(f"    PO Number: {po_number}")
-                
-                # Try to extract customer number
-                cust_elem = idoc.find('.//E1EDKA1/PARTN')
-                customer = cust_elem.text if cust_elem is not None and cust_elem.text else "N/A"
-                logger.info(f"    Customer: {customer}")
-                
-                # Try to extract part number
-                part_elem = idoc.find('.//E1EDP19/IDTNR')
-                part_number = part_elem.text if part_elem is not None and part_elem.text else "N/A"
-                logger.info(f"    Part Number: {part_number}")
-                
-                # Try to extract quantity
-                qty_elem = idoc.find('.//E1EDP01/MENGE')
-                quantity = qty_elem.text if qty_elem is not None and qty_elem.text else "N/A"
-                logger.info(f"    Quantity: {quantity}")
-                
-                # Try to extract delivery date
-                date_elem = idoc.find('.//E1EDK02/DATUM')
-                delivery_date = date_elem.text if date_elem is not None and date_elem.text else "N/A"
-                logger.info(f"    Delivery Date: {delivery_date}")
-                
-                # Try to extract currency
-                currency_elem = idoc.find('.//E1EDK01/CURRENCY')
-                currency = currency_elem.text if currency_elem is not None and currency_elem.text else "N/A"
-                logger.info(f"    Currency: {currency}")
-            
+            logger.info(f"Number of IDOCs in XML: {idoc_count} ({received_bytes} bytes), stored as request {request_id}")
+
             # Simulate SAP processing
             # In a real scenario, this would validate the XML against SAP schemas
             # and process the data into the SAP system
-            
+
             # Return success response
             self._set_response()
             response = {
                 'status': 'success',
                 'message': f'Received {idoc_count} IDOCs for processing',
-                'details': 'This is a dummy SAP endpoint for demonstration purposes'
+                'details': 'This is a dummy SAP endpoint for demonstration purposes',
+                'request_id': request_id
             }
             self.wfile.write(json.dumps(response).encode('utf-8'))
-            
+
         except ET.ParseError:
             # Not XML or invalid XML
             logger.error("Failed to parse XML data")
             self._set_response(400)
             response = {'status': 'error', 'message': 'Invalid XML data'}
             self.wfile.write(json.dumps(response).encode('utf-8'))
+        except (zlib.error, ValueError) as e:
+            # Malformed framing, gzip stream or unsupported encoding
+            logger.error(f"Failed to read request body: {str(e)}")
+            self._set_response(400)
+            response = {'status': 'error', 'message': f'Invalid request body: {str(e)}'}
+            self.wfile.write(json.dumps(response).encode('utf-8'))
         except Exception as e:
             # Other errors
             logger.error(f"Error processing request: {str(e)}")
             self._set_response(500)
             response = {'status': 'error', 'message': str(e)}
             self.wfile.write(json.dumps(response).encode('utf-8'))
+        finally:
+            # Closing without a commit rolls back records from a failed request
+            conn.close()
+
+class EndpointServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+class ThreadedEndpointServer(socketserver.ThreadingMixIn, EndpointServer):
+    daemon_threads = True
+
+# Function to create the endpoint server without starting it
+def create_server(host="", port=PORT, threaded=False):
+    # A threaded server handles concurrent POSTs (e.g. under load tests); the
+    # XML log file is only meaningful for sequential requests
+    server_class = ThreadedEndpointServer if threaded else EndpointServer
+    return server_class((host, port), SAPEndpointHandler)
 
 def run_server():
-    with socketserver.TCPServer(("", PORT), SAPEndpointHandler) as httpd:
+    # Reset log files on startup
+    reset_log_files()
+    setup_logging()
+    logger.info("SAP Endpoint server starting - log files reset")
+
+    with create_server() as httpd:
         logger.info(f"SAP Endpoint server started at port {PORT}")
         print(f"SAP Endpoint server started at http://localhost:{PORT}")
         print("Press Ctrl+C to stop the server")
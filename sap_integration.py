@@ -1,9 +1,10 @@
 import io
 import datetime
-import requests
 import json
+from metrics import stage
 
 # Function to generate IDoc-XML data for SAP integration
+@stage('idoc_xml')
 def generate_idoc_xml_data(df):
     """
     Generate IDoc-XML data for SAP integration based on the provided guideline.
@@ -32,6 +33,7 @@ def generate_idoc_xml_data(df):
         ship_to_number = row.get('Ship To Number', '')
         delivery_date = row.get('Required Delivery Date', '')
         customer_part_number = row.get('Customer Part Number', '')
+        material_number = row.get('SAP Material Number', '')
         order_quantity = row.get('Order Quantity', '1')
         customer_name = row.get('Customer Name', '')
         
@@ -126,6 +128,13 @@ def generate_idoc_xml_data(df):
         buffer.write('      <QUALF>001</QUALF>\n')
         buffer.write(f'      <IDTNR>{customer_part_number}</IDTNR>\n')
         buffer.write('    </E1EDP19>\n')
+
+        # E1EDP19: Item Object Identification - SAP material (from the material cross-reference)
+        if material_number:
+            buffer.write('    <E1EDP19>\n')
+            buffer.write('      <QUALF>002</QUALF>\n')
+            buffer.write(f'      <IDTNR>{material_number}</IDTNR>\n')
+            buffer.write('    </E1EDP19>\n')
         
         # End IDoc record
         buffer.write('  </IDOC>\n')
@@ -140,6 +149,7 @@ def generate_idoc_xml_data(df):
     return xml_data
 
 # Function to send IDoc-XML data to SAP endpoint
+@stage('idoc_send')
 def send_idoc_xml_to_sap(xml_data, endpoint_url="http://localhost:8000/idoc"):
     """
     Send IDoc-XML data to SAP endpoint.
@@ -151,6 +161,8 @@ def send_idoc_xml_to_sap(xml_data, endpoint_url="http://localhost:8000/idoc"):
     Returns:
         dict: Response from the SAP endpoint
     """
+    import requests
+
     if not xml_data:
         return {"status": "error", "message": "No XML data to send"}
     
@@ -211,6 +223,7 @@ def send_idoc_xml_to_sap(xml_data, endpoint_url="http://localhost:8000/idoc"):
         }
 
 # Function to generate ANSI X12 850 data for SAP integration
+@stage('x12')
 def generate_ansi_x12_850_data(df):
     """
     Generate ANSI X12 850 (Purchase Order) data for SAP integration in raw EDI format.
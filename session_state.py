@@ -1,22 +1,80 @@
 import streamlit as st
 import uuid
+import os
+import sys
 
 # Function to initialize session state variables
 def initialize_session_state():
-    if "uploaded_files_list" not in st.session_state:
-        st.session_state.uploaded_files_list = []
+    if "upload_handles" not in st.session_state:
+        # Uploaded PDFs live on disk (upload_store.py); the session keeps only their handles
+        st.session_state.upload_handles = []
     if "uploader_key" not in st.session_state:
         st.session_state.uploader_key = str(uuid.uuid4())  # Unique key to force refresh
-    if "extracted_data" not in st.session_state:
-        st.session_state.extracted_data = []
     if "api_key_valid" not in st.session_state:
         st.session_state.api_key_valid = False
     if "processed" not in st.session_state:
         st.session_state.processed = False
+    if "job_id" not in st.session_state:
+        # Reattach to a running or finished job after a browser refresh via the URL
+        st.session_state.job_id = st.query_params.get("job")
+    if "loaded_job_id" not in st.session_state:
+        st.session_state.loaded_job_id = None
 
 # Function to reset session state
 def reset_session_state():
-    st.session_state.uploaded_files_list = []  # Clear stored files
+    st.session_state.upload_handles = []  # Forget stored files (the TTL cleanup removes them from disk)
     st.session_state.processed = False  # Reset processing state
-    st.session_state.extracted_data = []  # Clear extracted data
     st.session_state.uploader_key = str(uuid.uuid4())  # Change uploader key to reset UI
+    st.session_state.job_id = None  # Detach from any background job
+    st.session_state.loaded_job_id = None
+    st.query_params.clear()
+    # Release the cached Excel export of the previous data
+    st.session_state.pop("excel_export", None)
+
+# Function to estimate the memory held by a session state value, in bytes
+def estimate_size(value, _seen=None):
+    seen = _seen if _seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    # DataFrames, Series and file-like uploads report their own size
+    if hasattr(value, 'memory_usage'):
+        try:
+            usage = value.memory_usage(deep=True)
+            return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+        except TypeError:
+            pass
+    if hasattr(value, 'getbuffer'):
+        return value.getbuffer().nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, seen) for item in value)
+    return size
+
+# Function to report the memory held by this session and the files it spilled to disk
+def session_memory_report():
+    """
+    Returns:
+        dict: 'keys' (session state key -> estimated bytes, largest first), 'total_bytes',
+              'spilled_files', 'spilled_bytes' (upload handles' files on disk) and
+              'process_rss_bytes' (the whole server process, or None if unknown)
+    """
+    keys = {key: estimate_size(value) for key, value in st.session_state.items()}
+    handles = st.session_state.get("upload_handles", [])
+    return {
+        'keys': dict(sorted(keys.items(), key=lambda item: item[1], reverse=True)),
+        'total_bytes': sum(keys.values()),
+        'spilled_files': len(handles),
+        'spilled_bytes': sum(handle['size'] for handle in handles),
+        'process_rss_bytes': _process_rss_bytes(),
+    }
+
+def _process_rss_bytes():
+    # Current resident set size on Linux; other platforms report None
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
@@ -1,8 +1,18 @@
 import streamlit as st
 import pandas as pd
-import io
-from session_state import reset_session_state
+import os
+import uuid
+import api
+from exports import export_excel_to_tempfile, export_parquet_bytes, write_parquet_dataset, PARQUET_DATASET_DIR
+from session_state import reset_session_state, session_memory_report
+from upload_store import spill_upload
 from data_processing import convert_to_dataframe
+from metrics import count
+from routing import routing_savings
+from followup import repair_summary
+from packing import packing_summary
+from endpoint_pool import pool_summary
+from jobs import load_job_results, load_job_metrics, cancel_job, resume_job, JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_INTERRUPTED, JOB_CANCELLED
 
 # Function to create sidebar components
 def create_sidebar(openai_api_key_callback):
@@ -29,33 +39,149 @@ def create_sidebar(openai_api_key_callback):
             key=st.session_state.uploader_key  # Dynamic key to reset uploader
         )
 
-        # Store uploaded files in session state
+        # Spill uploaded files to disk and keep only their handles in session state
         if uploaded_files:
-            st.session_state.uploaded_files_list = uploaded_files
+            known = {(handle['filename'], handle['sha256']) for handle in st.session_state.upload_handles}
+            for pdf_file in uploaded_files:
+                handle = spill_upload(pdf_file)
+                if (handle['filename'], handle['sha256']) not in known:
+                    st.session_state.upload_handles.append(handle)
+                    known.add((handle['filename'], handle['sha256']))
             st.session_state.processed = False  # Ensure files aren't processed immediately
-            st.success(f"📂 {len(uploaded_files)} files uploaded. Click 'Process' to extract data.")
+            st.session_state.uploader_key = str(uuid.uuid4())  # Clear the uploader so Streamlit frees the files
+            st.rerun()
+
+        if st.session_state.upload_handles:
+            spilled_mb = sum(handle['size'] for handle in st.session_state.upload_handles) / (1024 * 1024)
+            st.success(f"📂 {len(st.session_state.upload_handles)} files uploaded ({spilled_mb:.1f} MB on disk). "
+                       "Click 'Process' to extract data.")
 
         # Reset Button (Clears UI and uploaded files)
         if st.button("Reset Files"):
+            if st.session_state.job_id:
+                cancel_job(st.session_state.job_id)  # Stop spending API calls on the discarded batch
             reset_session_state()
             st.rerun()  # Force full UI refresh
 
         # Process Button (Only appears when API key is valid and files exist)
         process_clicked = False
-        if st.session_state.api_key_valid and st.session_state.uploaded_files_list:
+        if st.session_state.api_key_valid and st.session_state.upload_handles:
+            st.checkbox("🔬 Profile next batch", key="profile_next_batch",
+                        help="Record a CPU/allocation profile and a flamegraph stack dump of the extraction run")
+            st.checkbox("📦 Pack small POs", key="pack_small_pos",
+                        help="Send several small POs in one request to save prompt tokens and requests")
             if st.button("Process Files"):
                 st.session_state.processed = True  # Set processing flag
                 process_clicked = True
+
+        display_session_memory()
                 
         return openai_api_key, process_clicked
 
+# Function to display what this session holds in memory and on disk
+def display_session_memory():
+    report = session_memory_report()
+    with st.expander("🧠 Session memory"):
+        col1, col2 = st.columns(2)
+        col1.metric("Session state", f"{report['total_bytes'] / (1024 * 1024):.2f} MB")
+        col2.metric("Uploads on disk", f"{report['spilled_bytes'] / (1024 * 1024):.1f} MB",
+                    f"{report['spilled_files']} files", delta_color="off")
+        if report['process_rss_bytes'] is not None:
+            st.caption(f"Server process RSS (all sessions): {report['process_rss_bytes'] / (1024 * 1024):.0f} MB")
+        st.dataframe(
+            pd.DataFrame([{'key': key, 'KB': round(size / 1024, 1)} for key, size in report['keys'].items()]),
+            hide_index=True, use_container_width=True,
+        )
+
+# Function to display the progress of a background extraction job
+def display_job_status(job, openai_api_key):
+    """
+    Show progress and controls for a background job.
+
+    Returns:
+        bool: True while the job is still queued or running (the caller should poll again)
+    """
+    if job is None:
+        st.warning("⚠ The extraction job could not be found (it may have expired). Please process the files again.")
+        st.session_state.job_id = None
+        st.query_params.clear()
+        return False
+
+    total = job['total'] or 1
+    if job['status'] in (JOB_QUEUED, JOB_RUNNING):
+        st.progress(job['completed'] / total, text=f"🔍 Processing files in the background... {job['completed']}/{job['total']} done")
+        if st.button("Cancel Processing"):
+            cancel_job(job['job_id'])
+        return True
+
+    if job['status'] == JOB_COMPLETED:
+        st.success(f"✅ Successfully processed {job['succeeded']} files!")
+    elif job['status'] == JOB_CANCELLED:
+        st.info(f"Processing cancelled after {job['completed']}/{job['total']} files.")
+    elif job['status'] == JOB_INTERRUPTED:
+        st.warning(f"⚠ Processing was interrupted after {job['completed']}/{job['total']} files (the server restarted).")
+        if st.session_state.api_key_valid and st.button("Resume Processing"):
+            resume_job(job['job_id'], openai_api_key)
+            st.session_state.loaded_job_id = None
+            st.rerun()
+    else:
+        st.error(f"⚠ Processing failed after {job['completed']}/{job['total']} files.")
+
+    for error in job['errors']:
+        st.error(f"⚠ {error}")
+
+    # Profile of the run, if it was profiled
+    profile_files = job.get('profile_files') or {}
+    if profile_files:
+        st.caption(f"🔬 Profile saved to {profile_files.get('report')}")
+        col1, col2 = st.columns(2)
+        for column, key, label in ((col1, 'report', " Download profile report"), (col2, 'folded', " Download flamegraph stacks")):
+            if key in profile_files and os.path.exists(profile_files[key]):
+                with open(profile_files[key], 'rb') as profile_file:
+                    column.download_button(label=label, data=profile_file.read(),
+                                           file_name=os.path.basename(profile_files[key]), mime="text/plain")
+    return False
+
+# Function to get the streamed Excel export for a DataFrame, rebuilding it only when the data changes
+def get_excel_export(df):
+    """
+    Returns:
+        bytes: The .xlsx file. The workbook is written to a temp file in constant memory, read
+               back once per table fingerprint and the temp file removed; the bytes are kept in
+               session state so reruns hand the same object to st.download_button.
+    """
+    try:
+        content_hash = int(pd.util.hash_pandas_object(df, index=False).sum())
+    except TypeError:
+        # Unhashable cell values (e.g. lists returned by the model)
+        content_hash = int(pd.util.hash_pandas_object(df.astype(str), index=False).sum())
+    fingerprint = (tuple(df.columns), len(df), content_hash)
+    cached = st.session_state.get("excel_export")
+    if cached and cached['fingerprint'] == fingerprint:
+        count('cache_hits', label='excel_export')
+        return cached['data']
+    count('cache_misses', label='excel_export')
+
+    # Drop the previous export before building the next, so only one is held at a time
+    st.session_state.pop("excel_export", None)
+    path, stats = export_excel_to_tempfile(df)
+    try:
+        with open(path, 'rb') as excel_file:
+            data = excel_file.read()
+    finally:
+        os.remove(path)
+    st.session_state.excel_export = {'fingerprint': fingerprint, 'data': data, 'stats': stats}
+    return data
+
 # Function to display data and download options
 def display_data_and_downloads():
-    if st.session_state.get("extracted_data"):
+    # Results are read from the finished job on each run instead of being kept in session state
+    extracted_data = load_job_results(st.session_state.loaded_job_id) if st.session_state.get("loaded_job_id") else []
+    if extracted_data:
         st.subheader("📥 Download Data")
         
         # Convert extracted data to DataFrame
-        df = convert_to_dataframe(st.session_state.extracted_data)
+        df = convert_to_dataframe(extracted_data)
         
         if not df.empty:
             # Display as editable table
@@ -70,11 +196,8 @@ def display_data_and_downloads():
                 disabled=["filename"]  # Make filename column non-editable
             )
             
-            # Update the session state with edited data
-            st.session_state.edited_data = edited_df
-            
-            # Use edited data for downloads if available
-            download_df = st.session_state.edited_data
+            # Use edited data for downloads (the data editor keeps the edits itself)
+            download_df = edited_df
             
             # Create CSV file in memory (more reliable than Excel in Streamlit)
             csv = download_df.to_csv(index=False)
@@ -91,34 +214,14 @@ def display_data_and_downloads():
                 )
             
             with col2:
-                # Try to create Excel file if possible (with fallback)
+                # Build the Excel file in constant memory; its bytes are cached until the table changes
                 try:
-                    output = io.BytesIO()
-                    
-                    # Try different Excel engines
-                    try:
-                        # Try using xlsxwriter first (often available in Streamlit)
-                        download_df.to_excel(output, engine='xlsxwriter', index=False, sheet_name='Purchase Orders')
-                        excel_available = True
-                    except ImportError:
-                        try:
-                            # Try using openpyxl as fallback
-                            download_df.to_excel(output, engine='openpyxl', index=False, sheet_name='Purchase Orders')
-                            excel_available = True
-                        except ImportError:
-                            # If both fail, use basic Excel writer
-                            download_df.to_excel(output, index=False, sheet_name='Purchase Orders')
-                            excel_available = True
-                    
-                    # Create download button for Excel if available
-                    if excel_available:
-                        excel_data = output.getvalue()
-                        st.download_button(
-                            label=" Download as Excel",
-                            data=excel_data,
-                            file_name="Purchase_Order_Data.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        )
+                    st.download_button(
+                        label=" Download as Excel",
+                        data=get_excel_export(download_df),
+                        file_name="Purchase_Order_Data.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    )
                 except Exception as e:
                     st.info("Excel download not available. Please use CSV format.")
             
@@ -166,8 +269,93 @@ def display_data_and_downloads():
                                 st.success("Success")
                             else:
                                 st.error("Failed")
+
+            # Columnar export for downstream analytics: typed quantity and date columns
+            col1, col2, _, _ = st.columns(4)
+            try:
+                parquet_data = export_parquet_bytes(download_df)
+            except ImportError:
+                parquet_data = None
+                col1.info("Parquet export needs pyarrow.")
+            except Exception as e:
+                parquet_data = None
+                col1.error(f"Parquet export failed: {e}")
+            if parquet_data is not None:
+                col1.download_button(
+                    label=" Download as Parquet",
+                    data=parquet_data,
+                    file_name="Purchase_Order_Data.parquet",
+                    mime="application/vnd.apache.parquet",
+                )
+                if col2.button(" Append to Parquet dataset"):
+                    try:
+                        parquet_files = write_parquet_dataset(download_df)
+                        col2.success(f"Appended {len(download_df)} rows ({len(parquet_files)} files) to {PARQUET_DATASET_DIR}")
+                    except Exception as e:
+                        col2.error(f"Appending to {PARQUET_DATASET_DIR} failed: {e}")
             
             return edited_df
         else:
             st.info("No data available to download. Process files to extract data.")
             return None
+
+# Function to display stage timings and token usage for the current batch
+def display_metrics_panel(job_id, render_metrics=None):
+    if not job_id:
+        return
+    batch_metrics = load_job_metrics(job_id)
+    if render_metrics is not None:
+        batch_metrics.merge(render_metrics)
+    rows = batch_metrics.summary_rows()
+    if not rows:
+        return
+
+    with st.expander("📊 Pipeline Metrics"):
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("LLM calls", batch_metrics.counter('llm_requests'))
+        col2.metric("Prompt tokens", batch_metrics.counter('prompt_tokens'))
+        col3.metric("Completion tokens", batch_metrics.counter('completion_tokens'))
+        col4.metric("Cached prompt tokens", batch_metrics.counter('cached_prompt_tokens'))
+        col5.metric("Retries / errors", f"{batch_metrics.counter('llm_retries')} / {batch_metrics.counter('llm_errors')}")
+        st.caption(f"Excel export cache: {batch_metrics.counter('cache_hits', 'excel_export')} hits, "
+                   f"{batch_metrics.counter('cache_misses', 'excel_export')} misses")
+        savings = routing_savings(batch_metrics)
+        if savings:
+            files = savings['files']
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Fast / full / escalated", f"{files['fast']} / {files['full']} / {files['escalated']}")
+            # Deltas are relative to sending every file to the full deployment
+            col2.metric("Model cost (USD)", f"{savings['cost_usd']:.4f}", f"{-savings['cost_saved_usd']:+.4f} vs full model", delta_color="inverse")
+            col3.metric("Completion time", f"{savings['seconds']:.1f}s", f"{-savings['seconds_saved']:+.1f}s vs full model", delta_color="inverse")
+        repairs = repair_summary(batch_metrics)
+        if repairs:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Repaired JSON", f"{repairs['responses']['repaired']} ({repairs['repair_rate']:.0%})")
+            col2.metric("Field follow-ups", f"{repairs['reask_requests']} ({repairs['reask_rate']:.0%})")
+            col3.metric("Fields fixed / left invalid", f"{repairs['fields_fixed']} / {repairs['fields_unfixed']}")
+            if repairs['continuation_requests']:
+                st.caption(f"Cut-off responses: {repairs['continuation_requests']} continuation requests "
+                           f"recovered {repairs['lines_recovered']} line items")
+        packing = packing_summary(batch_metrics)
+        if packing:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Packed POs / requests", f"{packing['packed_documents']} / {packing['packed_requests']}")
+            col2.metric("Requests saved", packing['requests_saved'])
+            col3.metric("Prompt tokens saved", packing['tokens_saved'])
+        pool = pool_summary(batch_metrics)
+        if pool:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Requests per endpoint", " / ".join(f"{member} {value}" for member, value in pool['requests'].items()))
+            col2.metric("Hedged (won by hedge)", f"{pool['hedges']} ({pool['hedges_won']})")
+            col3.metric("Failovers / failures", f"{pool['failovers']} / {sum(pool['failures'].values())}")
+        if api.ENDPOINT_POOL.members:
+            # Live health of the configured pool, across all jobs of this server
+            st.caption("Endpoint pool: in-flight requests, health and recent latency per member")
+            st.dataframe(pd.DataFrame(api.ENDPOINT_POOL.status()), hide_index=True, use_container_width=True)
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+        st.download_button(
+            label=" Download metrics (Prometheus)",
+            data=batch_metrics.render_prometheus({'job': job_id}),
+            file_name=f"po_metrics_{job_id}.prom",
+            mime="text/plain",
+        )
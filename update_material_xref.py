@@ -0,0 +1,35 @@
+import pandas as pd
+import json
+from material_xref import normalize_customer_number, normalize_part_number, MATERIAL_XREF_FILE
+
+# Load the Excel file (update 'material xref.xlsx' with the actual file path)
+file_path = "material xref.xlsx"
+df = pd.read_excel(file_path, dtype=str)
+
+# Drop rows without a customer, part or material
+df = df.dropna(subset=["Customer Number", "Customer Part Number", "Material Number"])
+
+# Normalize the keys once here so lookups only normalize the part number read from the PO
+xref_dict = {}
+duplicates = 0
+
+for _, row in df.iterrows():
+    cust_num = normalize_customer_number(row["Customer Number"])
+    part_key = normalize_part_number(row["Customer Part Number"])
+    material = str(row["Material Number"]).strip()
+
+    parts = xref_dict.setdefault(cust_num, {})
+    if part_key in parts and parts[part_key] != material:
+        duplicates += 1
+        print(f"Customer {cust_num} part '{row['Customer Part Number']}' maps to both "
+              f"{parts[part_key]} and {material}; keeping {material}")
+    parts[part_key] = material
+
+# Save JSON to a file
+with open(MATERIAL_XREF_FILE, "w") as json_file:
+    json.dump(xref_dict, json_file, indent=4)
+
+# Print confirmation message
+entries = sum(len(parts) for parts in xref_dict.values())
+print(f"JSON file '{MATERIAL_XREF_FILE}' has been successfully created with {entries} entries "
+      f"for {len(xref_dict)} customers ({duplicates} conflicting rows)!")
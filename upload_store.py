@@ -0,0 +1,94 @@
+"""
+Disk-spilled storage for uploaded PDFs.
+
+Streamlit keeps every file a file_uploader holds in server memory, and the
+session used to keep those UploadedFile objects for its whole lifetime.
+``spill_upload`` streams an upload in chunks to UPLOADS_DIR, named after its
+SHA-256 so a PDF uploaded by several sessions is stored once, and returns a
+small handle dict. The app then clears the uploader, so the session holds
+only handles and jobs read the PDFs from disk.
+
+Stored PDFs not used for UPLOAD_TTL_SECONDS are removed by
+``cleanup_expired_uploads``, which runs on every upload. Uploading a file
+again or submitting it in a job counts as a use.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+# Upload storage configuration
+UPLOADS_DIR = os.environ.get("PO_UPLOADS_DIR", ".uploads")
+UPLOAD_TTL_SECONDS = int(os.environ.get("PO_UPLOAD_TTL_SECONDS", 24 * 3600))
+# Bytes copied per read while spilling
+CHUNK_SIZE = 1024 * 1024
+
+# Function to get the storage path of a PDF from its SHA-256
+def upload_path(sha256):
+    return os.path.join(UPLOADS_DIR, sha256[:2], f"{sha256}.pdf")
+
+# Function to stream an uploaded file to disk
+def spill_upload(uploaded_file, filename=None):
+    """
+    Args:
+        uploaded_file: Binary file object, e.g. a Streamlit UploadedFile
+        filename (str): Name to keep in the handle (default: uploaded_file.name)
+
+    Returns:
+        dict: Handle with 'filename', 'sha256', 'path' and 'size'
+    """
+    cleanup_expired_uploads()
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    uploaded_file.seek(0)
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOADS_DIR, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: uploaded_file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        sha256 = digest.hexdigest()
+        path = upload_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Rename over any stored copy: same content, and its timestamp starts the TTL again
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {'filename': filename or uploaded_file.name, 'sha256': sha256, 'path': path, 'size': size}
+
+# Function to mark stored uploads as used, so the TTL cleanup keeps them
+def touch_uploads(handles):
+    """
+    Returns:
+        tuple: (handles whose PDF is still stored, handles whose PDF has expired)
+    """
+    present = []
+    missing = []
+    for handle in handles:
+        try:
+            os.utime(handle['path'])
+            present.append(handle)
+        except OSError:
+            missing.append(handle)
+    return present, missing
+
+# Function to remove stored uploads (and abandoned partial spills) older than the TTL
+def cleanup_expired_uploads():
+    if not os.path.isdir(UPLOADS_DIR):
+        return 0
+    cutoff = time.time() - UPLOAD_TTL_SECONDS
+    removed = 0
+    for directory, _, filenames in os.walk(UPLOADS_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+    return removed
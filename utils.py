@@ -1,19 +1,31 @@
-import streamlit as st
-import PyPDF2
+import os
 import re
 import json
-from fuzzywuzzy import process
+from reporting import get_reporter
+from metrics import stage
+
+# Customer master written by update_customer_master.py
+CUSTOMER_MASTER_FILE = 'customer_master_data.json'
+
+# Parsed customer master, reused until the file changes
+_customer_master_cache = {}
 
 ## Function to extract text from PDF
-def extract_text_from_pdf(pdf_file):
-    text = ""
+def extract_text_from_pdf(pdf_file, reporter=None):
+    return "".join(page_text + "\n" for page_text in extract_pages_from_pdf(pdf_file, reporter))
+
+# Function to extract the text of each PDF page
+def extract_pages_from_pdf(pdf_file, reporter=None):
+    import PyPDF2
+    pages = []
     try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
+        with stage('pdf_parse'):
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            for page in pdf_reader.pages:
+                pages.append(page.extract_text())
     except Exception as e:
-        st.error(f"Error reading PDF: {e}")
-    return text
+        get_reporter(reporter).error(f"Error reading PDF: {e}")
+    return pages
 
 # Function to fix number formatting issues
 def fix_number_format(text):
@@ -21,10 +33,16 @@ def fix_number_format(text):
     return text
 
 # Load customer master data from JSON file
-def load_customer_master_data():
+def load_customer_master_data(reporter=None):
     try:
-        with open('customer_master_data.json', 'r') as file:
+        # Parse the file on first use and again only after update_customer_master.py rewrites it
+        stat = os.stat(CUSTOMER_MASTER_FILE)
+        file_key = (stat.st_mtime_ns, stat.st_size)
+        if _customer_master_cache.get('key') == file_key:
+            return _customer_master_cache['data']
+        with open(CUSTOMER_MASTER_FILE, 'r') as file:
             data = json.load(file)
+            _customer_master_cache.update(key=file_key, data=data)
             print(f"Successfully loaded customer master data with {len(data)} entries")
             # Print the first entry to help debug structure
             if data:
@@ -33,19 +51,19 @@ def load_customer_master_data():
             return data
     except FileNotFoundError:
         print("customer_master_data.json file not found")
-        st.warning("Customer master data file not found. Customer matching will not be available.")
+        get_reporter(reporter).warning("Customer master data file not found. Customer matching will not be available.")
         return {}
     except json.JSONDecodeError as e:
         print(f"Error decoding customer master data JSON: {e}")
-        st.error(f"Error decoding customer master data: {e}")
+        get_reporter(reporter).error(f"Error decoding customer master data: {e}")
         return {}
     except Exception as e:
         print(f"Unexpected error loading customer master data: {e}")
-        st.error(f"Error loading customer master data: {e}")
+        get_reporter(reporter).error(f"Error loading customer master data: {e}")
         return {}
 
 # Function to find customer number using fuzzy matching
-def find_customer_number(customer_name, customer_master_data):
+def find_customer_number(customer_name, customer_master_data, reporter=None):
     if not customer_name or not customer_master_data:
         print(f"Missing data: customer_name={customer_name}, customer_master_data has {len(customer_master_data) if customer_master_data else 0} entries")
         return None, None
@@ -79,10 +97,11 @@ def find_customer_number(customer_name, customer_master_data):
                         customer_dict[name] = cust_num
     except Exception as e:
         print(f"Error creating customer dictionary: {e}")
-        st.error(f"Error processing customer data: {e}")
+        get_reporter(reporter).error(f"Error processing customer data: {e}")
         return None, None
     
     # Use fuzzy matching to find the best match
+    from fuzzywuzzy import process
     best_match = process.extractOne(customer_name, customer_dict.keys())
     
     # If match score is above threshold (adjust as needed)
@@ -132,6 +151,7 @@ def find_ship_to_number(customer_number, delivery_address, customer_master_data)
             return None
         
         # Use fuzzy matching to find the best match
+        from fuzzywuzzy import process
         best_match = process.extractOne(delivery_address, address_dict.keys())
         
         # If match score is above threshold
@@ -0,0 +1,462 @@
+"""
+Watch-folder ingestion daemon.
+
+Polls a directory (e.g. the share the email gateway drops PO PDFs into) and
+runs every new or changed PDF through the extraction and customer-matching
+pipeline in micro-batches. Results are appended to JSONL/CSV files in the
+output directory as each batch finishes, with optional IDoc-XML files per
+batch and optional delivery to the SAP endpoint.
+
+Files are tracked by SHA-256 of their content in a small SQLite state file, so
+a PDF is processed once no matter how often it is copied or renamed, and a
+file whose content changes is picked up again. A file that fails is retried
+with exponential backoff, up to MAX_ATTEMPTS times. The state also remembers each
+path's size and mtime, so a poll only hashes files that actually changed and
+stays cheap as the folder grows to tens of thousands of files.
+
+Usage:
+    python watch_folder.py incoming/ --output-dir out --workers 4 --batch-size 20
+    python watch_folder.py incoming/ --idoc --send-idoc http://localhost:8000/idoc
+    python watch_folder.py incoming/ --once
+    python watch_folder.py incoming/ --max-attempts 3 --retry-seconds 300
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+
+from batch_extract import run_batch
+from data_processing import convert_to_dataframe
+from exports import write_parquet_dataset
+from utils import load_customer_master_data
+from reporting import ConsoleReporter, get_reporter, set_default_reporter
+from metrics import record_stages, write_prometheus_file
+from routing import routing_savings, format_routing_savings
+from followup import repair_summary, format_repair_summary
+from packing import packing_summary, format_packing_summary
+from endpoint_pool import pool_summary, format_pool_summary
+
+# Default location of the processed-file state
+WATCH_STATE_FILE = ".watch_state.db"
+# Seconds between scans of the watched folder
+POLL_SECONDS = 5.0
+# Files per micro-batch
+BATCH_SIZE = 20
+# A file must be unmodified this long before it is picked up (still being copied otherwise)
+SETTLE_SECONDS = 2.0
+# Read size for content hashing
+HASH_CHUNK_SIZE = 1024 * 1024
+# Attempts per file before it is left alone until its content changes
+MAX_ATTEMPTS = 5
+# Wait before the first retry of a failed file; doubled after every further failure, up to RETRY_MAX_SECONDS
+RETRY_SECONDS = 60.0
+RETRY_MAX_SECONDS = 3600.0
+
+STATUS_PROCESSED = "processed"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processed (
+    sha256 TEXT PRIMARY KEY,
+    filename TEXT,
+    status TEXT NOT NULL,
+    line_items INTEGER,
+    processed_at TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    next_retry_at REAL
+);
+"""
+
+# Function to hash a file's content without reading it into memory at once
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class WatchState:
+    """
+    Processed-file state backed by SQLite and mirrored in memory.
+
+    ``seen`` maps path -> (mtime_ns, size, sha256), ``done`` holds the
+    content hashes processed successfully and ``failed`` maps the hashes of
+    failed files to (attempts, next_retry_at), so the per-poll checks are
+    dictionary and set lookups rather than queries.
+    """
+
+    def __init__(self, db_path=WATCH_STATE_FILE, max_attempts=MAX_ATTEMPTS, retry_seconds=RETRY_SECONDS):
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        # State files written before retries were added lack the retry columns
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(processed)")}
+        if 'attempts' not in columns:
+            self.conn.execute("ALTER TABLE processed ADD COLUMN attempts INTEGER NOT NULL DEFAULT 1")
+        if 'next_retry_at' not in columns:
+            self.conn.execute("ALTER TABLE processed ADD COLUMN next_retry_at REAL")
+        self.conn.commit()
+        self.seen = {
+            path: (mtime_ns, size, sha256)
+            for path, mtime_ns, size, sha256 in self.conn.execute("SELECT path, mtime_ns, size, sha256 FROM seen_files")
+        }
+        self.done = {
+            sha256 for (sha256,) in self.conn.execute("SELECT sha256 FROM processed WHERE status = ?", (STATUS_PROCESSED,))
+        }
+        self.failed = {
+            sha256: (attempts, next_retry_at or 0.0)
+            for sha256, attempts, next_retry_at in self.conn.execute(
+                "SELECT sha256, attempts, next_retry_at FROM processed WHERE status = ?", (STATUS_FAILED,))
+        }
+
+    def is_due(self, sha256, now=None):
+        """True if the content has not been processed and is not waiting for (or out of) retries."""
+        if sha256 in self.done:
+            return False
+        failure = self.failed.get(sha256)
+        if failure is None:
+            return True
+        attempts, next_retry_at = failure
+        return attempts < self.max_attempts and (now or time.time()) >= next_retry_at
+
+    def remember(self, entries):
+        """Record (path, mtime_ns, size, sha256) tuples for hashed files."""
+        if not entries:
+            return
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO seen_files (path, mtime_ns, size, sha256) VALUES (?, ?, ?, ?)", entries
+        )
+        self.conn.commit()
+        for path, mtime_ns, size, sha256 in entries:
+            self.seen[path] = (mtime_ns, size, sha256)
+
+    def forget(self, paths):
+        """Drop paths that no longer exist so the state does not grow with deleted files."""
+        if not paths:
+            return
+        self.conn.executemany("DELETE FROM seen_files WHERE path = ?", [(path,) for path in paths])
+        self.conn.commit()
+        for path in paths:
+            self.seen.pop(path, None)
+
+    def mark(self, records):
+        """
+        Record (sha256, filename, status, line_items) tuples for a finished batch.
+
+        A failed file is retried after retry_seconds, doubling with every further
+        failure up to RETRY_MAX_SECONDS, until it has failed max_attempts times.
+        """
+        if not records:
+            return
+        now = time.time()
+        processed_at = datetime.datetime.now().isoformat(timespec='seconds')
+        rows = []
+        for sha256, filename, status, line_items in records:
+            attempts = self.failed.get(sha256, (0, 0.0))[0] + 1
+            next_retry_at = None
+            if status == STATUS_FAILED:
+                next_retry_at = now + min(self.retry_seconds * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                self.failed[sha256] = (attempts, next_retry_at)
+            else:
+                self.failed.pop(sha256, None)
+                self.done.add(sha256)
+            rows.append((sha256, filename, status, line_items, processed_at, attempts, next_retry_at))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO processed (sha256, filename, status, line_items, processed_at, attempts, next_retry_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+# Function to list the PDFs currently in the folder as path -> (mtime_ns, size)
+def scan_folder(folder, recursive=False):
+    found = {}
+    pending = [folder]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and not entry.name.startswith('.'):
+                        pending.append(entry.path)
+                elif entry.name.lower().endswith('.pdf') and entry.is_file():
+                    stat = entry.stat()
+                    found[os.path.abspath(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+    return found
+
+# Function to find files whose content has not been processed yet
+def find_new_files(state, folder, recursive=False, settle_seconds=SETTLE_SECONDS):
+    """
+    Returns:
+        list: (path, sha256) tuples, oldest first, one per unprocessed content hash
+    """
+    found = scan_folder(folder, recursive)
+    state.forget([path for path in state.seen if path not in found and path.startswith(os.path.abspath(folder))])
+
+    now = time.time()
+    settle_before = time.time_ns() - int(settle_seconds * 1e9)
+    hashed = []
+    candidates = []
+    for path, (mtime_ns, size) in found.items():
+        cached = state.seen.get(path)
+        if cached and cached[:2] == (mtime_ns, size):
+            sha256 = cached[2]
+        elif mtime_ns > settle_before:
+            # Still being written; look again on the next poll
+            continue
+        else:
+            try:
+                sha256 = file_sha256(path)
+            except OSError:
+                continue
+            hashed.append((path, mtime_ns, size, sha256))
+        if state.is_due(sha256, now):
+            candidates.append((mtime_ns, path, sha256))
+    state.remember(hashed)
+
+    # The same content under several names is processed once
+    unique = {}
+    for mtime_ns, path, sha256 in sorted(candidates):
+        unique.setdefault(sha256, path)
+    return [(path, sha256) for sha256, path in unique.items()]
+
+# Function to append a batch's records to the output files
+def append_outputs(df, output_dir, formats):
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    if 'jsonl' in formats:
+        path = os.path.join(output_dir, "Purchase_Order_Data.jsonl")
+        with open(path, 'a') as f:
+            for record in df.to_dict(orient='records'):
+                f.write(json.dumps(record, default=str) + "\n")
+        written.append(path)
+    if 'csv' in formats:
+        path = os.path.join(output_dir, "Purchase_Order_Data.csv")
+        if os.path.exists(path):
+            # Keep the column order of the existing file so appended rows line up
+            with open(path, newline='') as f:
+                columns = next(csv.reader(f), None)
+            if columns:
+                extra = [column for column in df.columns if column not in columns]
+                if extra:
+                    reporter = get_reporter()
+                    reporter.warning(f"Dropping columns not in {path}: {', '.join(extra)}")
+                df = df.reindex(columns=columns)
+            df.to_csv(path, mode='a', header=not columns, index=False)
+        else:
+            df.to_csv(path, index=False)
+        written.append(path)
+    if 'parquet' in formats:
+        path = os.path.join(output_dir, "parquet")
+        write_parquet_dataset(df, path)
+        written.append(path)
+    return written
+
+class FolderWatcher:
+    """Scans a folder and processes new PDFs in micro-batches until stopped."""
+
+    def __init__(self, folder, openai_api_key, output_dir="output", state_path=WATCH_STATE_FILE,
+                 workers=4, batch_size=BATCH_SIZE, formats=("jsonl", "csv"), idoc=False,
+                 send_idoc_url=None, recursive=False, settle_seconds=SETTLE_SECONDS, metrics_file=None, reporter=None,
+                 pack=False, max_attempts=MAX_ATTEMPTS, retry_seconds=RETRY_SECONDS):
+        self.folder = folder
+        self.openai_api_key = openai_api_key
+        self.output_dir = output_dir
+        self.workers = workers
+        self.batch_size = batch_size
+        self.formats = set(formats)
+        self.idoc = idoc or bool(send_idoc_url)
+        self.send_idoc_url = send_idoc_url
+        self.recursive = recursive
+        self.settle_seconds = settle_seconds
+        self.metrics_file = metrics_file
+        self.pack = pack
+        self.reporter = reporter or ConsoleReporter()
+        self.state = WatchState(state_path, max_attempts, retry_seconds)
+        self.stop_event = threading.Event()
+        self.totals = {'batches': 0, 'files': 0, 'failed': 0, 'line_items': 0, 'seconds': 0.0}
+
+    def process_batch(self, batch, batch_number):
+        """Process one micro-batch of (path, sha256) tuples and record the outcome."""
+        paths = [path for path, _ in batch]
+        started = time.perf_counter()
+        with record_stages() as batch_metrics:
+            extracted_data, _, failed = run_batch(paths, self.openai_api_key, self.workers, self.reporter, pack=self.pack)
+        failed = set(failed)
+
+        # extracted_data holds the successful files in input order; records only carry the base name,
+        # which is not unique with --recursive, so line items are counted per path here
+        succeeded = [path for path in paths if path not in failed]
+        line_counts = {path: len(item['data']) if isinstance(item['data'], list) else 1
+                       for path, item in zip(succeeded, extracted_data)}
+
+        line_items = 0
+        try:
+            df = convert_to_dataframe(extracted_data, load_customer_master_data(self.reporter), self.reporter)
+            line_items = len(df)
+            if not df.empty:
+                append_outputs(df, self.output_dir, self.formats)
+                if self.idoc:
+                    self._write_idoc(df, batch_number)
+        except Exception as e:
+            # Keep the daemon running; the whole batch is retried (outputs appended before the error are not rolled back)
+            self.reporter.error(f"Batch {batch_number}: writing the results failed: {e}")
+            failed = set(paths)
+            line_items = 0
+
+        self.state.mark([
+            (sha256, os.path.basename(path), STATUS_FAILED if path in failed else STATUS_PROCESSED,
+             0 if path in failed else line_counts.get(path, 0))
+            for path, sha256 in batch
+        ])
+        for path, sha256 in batch:
+            attempts = self.state.failed.get(sha256, (0, 0.0))[0]
+            if path in failed and attempts >= self.state.max_attempts:
+                self.reporter.warning(f"{os.path.basename(path)}: failed {attempts} times; not retried until the file changes")
+
+        seconds = time.perf_counter() - started
+        self.totals['files'] += len(batch)
+        self.totals['failed'] += len(failed)
+        self.totals['line_items'] += line_items
+        self.totals['seconds'] += seconds
+        self.reporter.info(
+            f"Batch {batch_number}: {len(batch)} files ({len(failed)} failed), {line_items} line items "
+            f"in {seconds:.1f}s ({len(batch) / seconds * 60:.1f} files/min)"
+        )
+        savings = routing_savings(batch_metrics)
+        if savings:
+            self.reporter.info(f"Batch {batch_number} routing: {format_routing_savings(savings)}")
+        packing = packing_summary(batch_metrics)
+        if packing:
+            self.reporter.info(f"Batch {batch_number} packing: {format_packing_summary(packing)}")
+        pool = pool_summary(batch_metrics)
+        if pool:
+            self.reporter.info(f"Batch {batch_number} pool: {format_pool_summary(pool)}")
+        repairs = repair_summary(batch_metrics)
+        if repairs and (repairs['responses']['repaired'] or repairs['responses']['failed'] or repairs['reask_requests']):
+            self.reporter.info(f"Batch {batch_number} JSON: {format_repair_summary(repairs)}")
+        if self.metrics_file:
+            write_prometheus_file(self.metrics_file)
+
+    def _write_idoc(self, df, batch_number):
+        from sap_integration import generate_idoc_xml_data, send_idoc_xml_to_sap
+        xml_data = generate_idoc_xml_data(df)
+        idoc_dir = os.path.join(self.output_dir, "idoc")
+        os.makedirs(idoc_dir, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        with open(os.path.join(idoc_dir, f"SAP_IDOC_{stamp}_{batch_number:05d}.xml"), 'w') as f:
+            f.write(xml_data)
+        if self.send_idoc_url:
+            response = send_idoc_xml_to_sap(xml_data, self.send_idoc_url)
+            if response.get('status') == 'error':
+                self.reporter.error(f"Batch {batch_number}: IDoc delivery failed: {response.get('message')}")
+
+    def poll_once(self):
+        """Scan the folder once and process everything new; returns the number of files processed."""
+        pending = find_new_files(self.state, self.folder, self.recursive, self.settle_seconds)
+        processed = 0
+        for start in range(0, len(pending), self.batch_size):
+            if self.stop_event.is_set():
+                break
+            batch = pending[start:start + self.batch_size]
+            self.totals['batches'] += 1
+            self.process_batch(batch, self.totals['batches'])
+            processed += len(batch)
+        return processed
+
+    def run(self, poll_seconds=POLL_SECONDS, once=False):
+        """Poll until stop() is called (or after one pass with ``once``)."""
+        try:
+            while not self.stop_event.is_set():
+                self.poll_once()
+                if once:
+                    break
+                self.stop_event.wait(poll_seconds)
+        finally:
+            self.state.close()
+
+    def stop(self):
+        self.stop_event.set()
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a folder and extract purchase-order data from new PDFs")
+    parser.add_argument("folder", help="Directory to watch")
+    parser.add_argument("--recursive", action="store_true", help="Also watch subdirectories")
+    parser.add_argument("--workers", type=int, default=4, help="Files processed in parallel within a batch")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Files per micro-batch")
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS, help="Seconds between folder scans")
+    parser.add_argument("--settle-seconds", type=float, default=SETTLE_SECONDS,
+                        help="Skip files modified more recently than this (still being copied)")
+    parser.add_argument("--state", default=WATCH_STATE_FILE, help="SQLite file tracking processed content hashes")
+    parser.add_argument("--api-key", help="Azure OpenAI API key (default: AZURE_API_KEY environment variable / .env)")
+    parser.add_argument("--output-dir", default="output", help="Directory the result files are appended to")
+    parser.add_argument("--format", default="jsonl,csv", help="Comma-separated record formats: jsonl, csv, parquet")
+    parser.add_argument("--idoc", action="store_true", help="Also write one IDoc-XML file per batch")
+    parser.add_argument("--send-idoc", metavar="URL", help="Send each batch's IDoc-XML to this SAP endpoint")
+    parser.add_argument("--metrics-file", help="Rewrite stage timings and token usage here (Prometheus text format) after each batch")
+    parser.add_argument("--pack", action="store_true", help="Send small POs of a batch together in packed requests")
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                        help="Attempts per file before it is left alone until its content changes")
+    parser.add_argument("--retry-seconds", type=float, default=RETRY_SECONDS,
+                        help="Wait before retrying a failed file; doubled after every further failure")
+    parser.add_argument("--once", action="store_true", help="Process what is there now and exit")
+    parser.add_argument("--quiet", action="store_true", help="Do not print per-file progress")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        parser.error(f"Not a directory: {args.folder}")
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    openai_api_key = args.api_key or os.environ.get("AZURE_API_KEY")
+    if not openai_api_key:
+        parser.error("No API key: pass --api-key or set AZURE_API_KEY")
+
+    reporter = ConsoleReporter(show_progress=not args.quiet)
+    set_default_reporter(reporter)
+
+    watcher = FolderWatcher(
+        args.folder, openai_api_key, output_dir=args.output_dir, state_path=args.state,
+        workers=args.workers, batch_size=args.batch_size,
+        formats=[fmt.strip().lower() for fmt in args.format.split(',') if fmt.strip()],
+        idoc=args.idoc, send_idoc_url=args.send_idoc, recursive=args.recursive,
+        settle_seconds=args.settle_seconds, metrics_file=args.metrics_file, reporter=reporter, pack=args.pack,
+        max_attempts=args.max_attempts, retry_seconds=args.retry_seconds
+    )
+
+    # Finish the current batch on Ctrl+C / SIGTERM, then exit
+    def request_stop(signum, frame):
+        reporter.info("Stopping after the current batch...")
+        watcher.stop()
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    print(f"Watching {os.path.abspath(args.folder)} (batch size {args.batch_size}, {args.workers} workers)", file=sys.stderr)
+    watcher.run(poll_seconds=args.poll_seconds, once=args.once)
+
+    totals = watcher.totals
+    print(f"Processed {totals['files']} files ({totals['failed']} failed), {totals['line_items']} line items", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()